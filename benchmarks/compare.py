@@ -0,0 +1,73 @@
+"""
+Compare the results of two benchmark runs, e.g. before and after a change.
+
+Usage: python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+
+import argparse
+import json
+
+
+def get_rows(results: dict) -> dict[str, float | None]:
+    """
+    Returns the headline numbers of a run, by name.
+    """
+    rows = {"throughput (jobs/s)": results["throughput_jobs_per_second"]}
+    summaries = {
+        "end-to-end": results["latency_seconds"],
+        "queue wait": results["queue_wait_seconds"],
+        **results["stage_seconds"],
+    }
+    for name, summary in summaries.items():
+        for key in ["p50", "p95", "p99"]:
+            rows[f"{name} {key} (s)"] = summary[key]
+    memory = results["memory"]["server_peak_rss_bytes"]
+    rows["server peak memory (MiB)"] = memory / 1024**2 if memory else None
+    return rows
+
+
+def compare(old: dict, new: dict) -> list[tuple[str, float | None, float | None, str]]:
+    """
+    Returns each headline number of both runs, with the relative change from the old one.
+    """
+    old_rows, new_rows = get_rows(old), get_rows(new)
+    table = []
+    for name in [*old_rows, *(name for name in new_rows if name not in old_rows)]:
+        before, after = old_rows.get(name), new_rows.get(name)
+        change = "-"
+        if before and after is not None:
+            change = f"{(after - before) / before:+.1%}"
+        table.append((name, before, after, change))
+    return table
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.compare", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("old", help="The results of the baseline run.")
+    parser.add_argument("new", help="The results of the run to compare with it.")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for path in [args.old, args.new]:
+        with open(path, "r") as file:
+            runs.append(json.load(file))
+
+    for label, run in zip(["old", "new"], runs):
+        version = run["version"]
+        dirty = " (with local changes)" if version["dirty"] else ""
+        print(f"{label}: {version['commit']}{dirty}, {run['time']}")
+
+    def format_value(value: float | None) -> str:
+        return "-" if value is None else f"{value:.3f}"
+
+    print(f"{'':<28} {'old':>10} {'new':>10} {'change':>8}")
+    for name, before, after, change in compare(*runs):
+        print(
+            f"{name:<28} {format_value(before):>10} {format_value(after):>10} {change:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
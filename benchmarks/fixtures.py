@@ -0,0 +1,194 @@
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def get_free_port() -> int:
+    """
+    Returns a TCP port on localhost that nothing listens on right now.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git(cwd: str, *args: str) -> str:
+    result = subprocess.run(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+    return result.stdout.decode().strip()
+
+
+def generate_repository(path: str, modules: int, tests_per_module: int) -> str:
+    """
+    Create a Python project with a package of `modules` modules, each with a test module.
+    The project has no requirements, so that the setup stage does not need the network.
+    :return: The SHA of the initial commit on `main`.
+    """
+    os.makedirs(os.path.join(path, "app"))
+    os.makedirs(os.path.join(path, "tests"))
+    files = {
+        "requirements-dev.txt": "# No requirements\n",
+        "app/__init__.py": "",
+        "tests/__init__.py": "",
+    }
+    for index in range(modules):
+        files[f"app/module{index}.py"] = (
+            f"VERSION = 0\n\n\ndef scale(value):\n    return value * {index + 1}\n"
+        )
+        tests = "".join(
+            f"\n    def test_scale_{test}(self):\n"
+            f"        self.assertEqual(module{index}.scale({test}), {test * (index + 1)})\n"
+            for test in range(tests_per_module)
+        )
+        files[f"tests/test_module{index}.py"] = (
+            f"import unittest\nfrom app import module{index}\n\n\n"
+            f"class Module{index}Test(unittest.TestCase):{tests}"
+        )
+
+    for name, content in files.items():
+        with open(os.path.join(path, name), "w") as file:
+            file.write(content)
+
+    git(path, "init", "--quiet", "--initial-branch=main")
+    git(path, "add", ".")
+    git(path, "commit", "--quiet", "-m", "Initial commit")
+    return git(path, "rev-parse", "HEAD")
+
+
+def push_commit(path: str, branch: str, base: str, module: str, version: int) -> dict:
+    """
+    Commit a change to a module on a branch, as a developer pushing to it would.
+    The branch is created from `base` if it does not exist yet.
+    :return: The commit, in the shape of the commits of a push event.
+    """
+    if git(path, "branch", "--list", branch):
+        git(path, "checkout", "--quiet", branch)
+    else:
+        git(path, "checkout", "--quiet", "-b", branch, base)
+
+    with open(os.path.join(path, module), "r") as file:
+        lines = file.read().splitlines()
+    lines[0] = f"VERSION = {version}"
+    with open(os.path.join(path, module), "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+    git(path, "commit", "--quiet", "-am", f"Change {module} to version {version}")
+    sha = git(path, "rev-parse", "HEAD")
+    return {
+        "id": sha,
+        "tree_id": git(path, "rev-parse", "HEAD^{tree}"),
+        "message": f"Change {module} to version {version}",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "url": f"https://github.com/bench/{os.path.basename(path)}/commit/{sha}",
+        "author": {"name": "bench"},
+        "committer": {"name": "bench"},
+        "distinct": True,
+        "added": [],
+        "removed": [],
+        "modified": [module],
+    }
+
+
+class GitDaemon:
+    """
+    A `git daemon` that serves the repositories in a folder over `git://`, read only.
+    """
+
+    def __init__(self, base_path: str):
+        self.port = get_free_port()
+        self.process = subprocess.Popen(
+            [
+                "git",
+                "daemon",
+                "--reuseaddr",
+                "--export-all",
+                "--listen=127.0.0.1",
+                f"--port={self.port}",
+                f"--base-path={base_path}",
+                base_path,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_for_port(self.port)
+
+    def url(self, name: str) -> str:
+        return f"git://127.0.0.1:{self.port}/{name}"
+
+    def close(self) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+
+class FakeStatusAPI:
+    """
+    A local stand-in for the commit status API of GitHub, that records when each status arrives.
+    """
+
+    def __init__(self):
+        self.statuses: list[dict] = []
+        self.lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with api.lock:
+                    api.statuses.append(
+                        {
+                            "sha": self.path.rsplit("/", 1)[-1],
+                            "state": body["state"],
+                            "id": body["target_url"].rsplit("/", 1)[-1],
+                            "time": time.time(),
+                        }
+                    )
+                self.send_response(201)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def final_statuses(self) -> dict[str, dict]:
+        """
+        Returns the first status that is not `pending` of each job, by job ID.
+        """
+        final = {}
+        with self.lock:
+            for status in self.statuses:
+                if status["state"] != "pending":
+                    final.setdefault(status["id"], status)
+        return final
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    """
+    Wait until something listens on the port of localhost.
+    :raises: TimeoutError if nothing does within the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"Nothing is listening on port {port}.")
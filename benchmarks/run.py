@@ -0,0 +1,453 @@
+"""
+Load test of the webhook-to-status pipeline.
+
+Starts the CI server with a local git daemon that serves generated repositories,
+and a fake GitHub status API, then fires bursts of push webhooks at it. Reports
+the throughput, the end-to-end latency from webhook to final commit status, the
+queue wait and duration of each stage, and the peak memory, and stores them as
+JSON so that runs can be compared across versions with `benchmarks.compare`.
+
+Usage: python -m benchmarks.run --bursts 3 --burst-size 10 --env CI_MAX_WORKERS=4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+import requests
+from benchmarks.fixtures import (
+    FakeStatusAPI,
+    GitDaemon,
+    generate_repository,
+    get_free_port,
+    git,
+    push_commit,
+    wait_for_port,
+)
+from benchmarks.stats import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The server must not wait on the rate limit of the real API, and must not read the developer's state
+DEFAULT_ENV = {
+    "GITHUB_TOKEN": "benchmark-token",
+    "CI_GITHUB_RATE_LIMIT": "3600000",
+    "CI_GITHUB_BURST": "1000",
+    "CI_WHEELHOUSE_MIN_REQUESTS": "1000000",
+}
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run", description=__doc__.split("\n\n")[1]
+    )
+    parser.add_argument("--repos", type=int, default=2, help="Repositories to push to.")
+    parser.add_argument(
+        "--modules", type=int, default=5, help="Modules per repository."
+    )
+    parser.add_argument("--tests", type=int, default=5, help="Tests per module.")
+    parser.add_argument("--bursts", type=int, default=3, help="Bursts of webhooks.")
+    parser.add_argument("--burst-size", type=int, default=5, help="Webhooks per burst.")
+    parser.add_argument(
+        "--interval", type=float, default=5.0, help="Seconds between bursts."
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Pushes per repository before the measured ones, to fill the caches.",
+    )
+    parser.add_argument(
+        "--same-ref",
+        action="store_true",
+        help="Push to `main` every time, so that newer pushes supersede older ones.",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="Seconds to wait for the jobs."
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="A setting of the server, e.g. CI_MAX_WORKERS=4. Can be repeated.",
+    )
+    parser.add_argument(
+        "--output",
+        help="The JSON file to write the results to, in benchmarks/results by default.",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the repositories and server state."
+    )
+    return parser.parse_args(argv)
+
+
+def get_version() -> dict:
+    """
+    Returns the commit of the CI server being benchmarked, and whether it has local changes.
+    """
+    try:
+        return {
+            "commit": git(ROOT, "rev-parse", "HEAD"),
+            "dirty": bool(git(ROOT, "status", "--porcelain", "--untracked-files=no")),
+        }
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return {"commit": None, "dirty": None}
+
+
+class Server:
+    """
+    The CI server under test, run by uvicorn in its own process and working folder.
+    """
+
+    def __init__(self, folder: str, env: dict[str, str]):
+        os.makedirs(folder, exist_ok=True)
+        self.port = get_free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "src.main:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(self.port),
+                "--log-level",
+                "warning",
+            ],
+            cwd=folder,
+            env={**os.environ, "PYTHONPATH": ROOT, **env},
+            stdout=open(os.path.join(folder, "server.log"), "w"),
+            stderr=subprocess.STDOUT,
+        )
+        wait_for_port(self.port, 60)
+
+    def peak_rss(self) -> int | None:
+        """
+        Returns the peak resident memory of the server process in bytes, if the OS reports it.
+        """
+        try:
+            with open(f"/proc/{self.process.pid}/status", "r") as file:
+                for line in file:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def close(self) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class Push:
+    """
+    A push to one of the generated repositories, and what became of its webhook.
+    """
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.sent: float | None = None
+        self.response: int | None = None
+        self.id: str | None = None
+
+    def send(self, server_url: str) -> None:
+        self.sent = time.time()
+        response = requests.post(f"{server_url}/webhook", json=self.payload, timeout=30)
+        self.response = response.status_code
+        if response.status_code == 202:
+            self.id = response.json()["id"]
+
+
+def create_pushes(
+    repos_folder: str,
+    names: list[str],
+    bases: dict[str, str],
+    heads: dict[tuple[str, str], str],
+    numbers: Iterator[int],
+    count: int,
+    args: argparse.Namespace,
+    daemon: GitDaemon,
+) -> list[Push]:
+    """
+    Commit `count` changes, spread over the repositories, and build the webhook of each push.
+    :param heads: The latest commit of each repository and branch, updated with the new ones.
+    :param numbers: The numbers of the pushes, shared by all the calls.
+    """
+    pushes = []
+    for _ in range(count):
+        index = next(numbers)
+        name = names[index % len(names)]
+        branch = "main" if args.same_ref else f"bench-{index}"
+        before = heads.get((name, branch), bases[name])
+        module = f"app/module{index % args.modules}.py"
+        commit = push_commit(
+            os.path.join(repos_folder, name), branch, before, module, index + 1
+        )
+        heads[(name, branch)] = commit["id"]
+
+        pushes.append(
+            Push(
+                {
+                    "after": commit["id"],
+                    "before": before,
+                    "commits": [commit],
+                    "compare": f"https://github.com/bench/{name}/compare/{before}...{commit['id']}",
+                    "created": False,
+                    "deleted": False,
+                    "forced": False,
+                    "head_commit": commit,
+                    "pusher": {"name": "bench"},
+                    "ref": f"refs/heads/{branch}",
+                    "repository": {
+                        "name": name,
+                        "full_name": f"bench/{name}",
+                        "owner": {"login": "bench"},
+                        "clone_url": daemon.url(name),
+                    },
+                    "sender": {"login": "bench"},
+                }
+            )
+        )
+    return pushes
+
+
+def send_burst(pushes: list[Push], server_url: str) -> None:
+    """
+    Send the webhooks of the pushes at the same time, as a busy organisation would.
+    """
+    with ThreadPoolExecutor(max_workers=len(pushes)) as executor:
+        list(executor.map(lambda push: push.send(server_url), pushes))
+
+
+def is_idle(server_url: str) -> bool:
+    """
+    Returns whether the server has no jobs left, and no commit statuses left to send.
+    """
+    queue = requests.get(f"{server_url}/queue", timeout=30).json()
+    if queue["pending"] or queue["running"]:
+        return False
+    metrics = requests.get(f"{server_url}/metrics", timeout=30).text
+    return "\nci_status_outbox_size 0\n" in metrics
+
+
+def wait_for_statuses(
+    api: FakeStatusAPI, pushes: list[Push], server_url: str, timeout: float
+) -> dict[str, dict]:
+    """
+    Wait until every accepted push has its final commit status, or the timeout passes.
+    Jobs that were superseded while still in the queue never get a status, so the wait
+    also ends once the server is idle.
+    :return: The final status of each job that has one, by job ID.
+    """
+    ids = {push.id for push in pushes if push.id}
+    deadline = time.monotonic() + timeout
+    while True:
+        final = api.final_statuses()
+        done = ids.issubset(final) or is_idle(server_url)
+        if done or time.monotonic() >= deadline:
+            # The statuses that were sent before the server went idle
+            final = api.final_statuses()
+            return {id: status for id, status in final.items() if id in ids}
+        time.sleep(0.2)
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Run the benchmark.
+    :return: The results, as written to the JSON file.
+    """
+    env = dict(DEFAULT_ENV)
+    for setting in args.env:
+        name, _, value = setting.partition("=")
+        env[name] = value
+
+    work_folder = tempfile.mkdtemp(prefix="ci-benchmark-")
+    repos_folder = os.path.join(work_folder, "repos")
+    names = [f"sample{index}" for index in range(args.repos)]
+    bases = {
+        name: generate_repository(
+            os.path.join(repos_folder, name), args.modules, args.tests
+        )
+        for name in names
+    }
+    heads: dict[tuple[str, str], str] = {}
+    numbers = itertools.count()
+
+    daemon = GitDaemon(repos_folder)
+    api = FakeStatusAPI()
+    env["CI_GITHUB_API_URL"] = api.url
+    server = None
+    try:
+        server = Server(os.path.join(work_folder, "server"), env)
+
+        # Fill the mirror and environment caches, as on a server that has been up for a while
+        warmup = create_pushes(
+            repos_folder,
+            names,
+            bases,
+            heads,
+            numbers,
+            args.warmup * args.repos,
+            args,
+            daemon,
+        )
+        if warmup:
+            send_burst(warmup, server.url)
+            wait_for_statuses(api, warmup, server.url, args.timeout)
+
+        bursts = [
+            create_pushes(
+                repos_folder,
+                names,
+                bases,
+                heads,
+                numbers,
+                args.burst_size,
+                args,
+                daemon,
+            )
+            for _ in range(args.bursts)
+        ]
+        started = time.time()
+        for index, burst in enumerate(bursts):
+            if index:
+                time.sleep(args.interval)
+            send_burst(burst, server.url)
+
+        pushes = [push for burst in bursts for push in burst]
+        final = wait_for_statuses(api, pushes, server.url, args.timeout)
+        ended = max((status["time"] for status in final.values()), default=started)
+
+        jobs = {}
+        for push in pushes:
+            if push.id in final:
+                response = requests.get(f"{server.url}/logs/{push.id}", timeout=30)
+                if response.status_code == 200:
+                    jobs[push.id] = response.json()
+
+        peak_rss = server.peak_rss()
+    finally:
+        if server is not None:
+            server.close()
+        daemon.close()
+        api.close()
+        if args.keep:
+            print(f"Kept the benchmark state in {work_folder}.")
+        else:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    stages: dict[str, list[float]] = {}
+    for job in jobs.values():
+        for stage, duration in job.get("stage_durations", {}).items():
+            stages.setdefault(stage, []).append(duration)
+
+    states: dict[str, int] = {}
+    for status in final.values():
+        states[status["state"]] = states.get(status["state"], 0) + 1
+
+    return {
+        "version": get_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {key: value for key, value in vars(args).items() if key != "output"}
+        | {"env": {k: v for k, v in env.items() if k != "GITHUB_TOKEN"}},
+        "webhooks": {
+            "sent": len(pushes),
+            "accepted": sum(push.response == 202 for push in pushes),
+            "rejected": sum(push.response == 503 for push in pushes),
+            "completed": len(final),
+            # Superseded while in the queue, these never run nor get a status
+            "dropped": sum(push.id is not None for push in pushes) - len(final),
+            "statuses": states,
+        },
+        "duration_seconds": ended - started,
+        "throughput_jobs_per_second": (
+            len(final) / (ended - started) if ended > started else None
+        ),
+        "latency_seconds": summarize(
+            [final[push.id]["time"] - push.sent for push in pushes if push.id in final]
+        ),
+        "queue_wait_seconds": summarize(
+            [
+                job["queue_wait"]
+                for job in jobs.values()
+                if job.get("queue_wait") is not None
+            ]
+        ),
+        "stage_seconds": {
+            stage: summarize(durations) for stage, durations in sorted(stages.items())
+        },
+        "memory": {
+            "server_peak_rss_bytes": peak_rss,
+            # Linux reports kilobytes, macOS bytes
+            "largest_process_peak_rss_bytes": resource.getrusage(
+                resource.RUSAGE_CHILDREN
+            ).ru_maxrss
+            * (1 if sys.platform == "darwin" else 1024),
+        },
+    }
+
+
+def format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_report(results: dict) -> None:
+    webhooks = results["webhooks"]
+    print(
+        f"Webhooks: {webhooks['sent']} sent, {webhooks['accepted']} accepted, "
+        f"{webhooks['rejected']} rejected, {webhooks['completed']} completed {webhooks['statuses']}, "
+        f"{webhooks['dropped']} dropped"
+    )
+    throughput = results["throughput_jobs_per_second"]
+    print(f"Throughput: {throughput:.2f} jobs/s" if throughput else "Throughput: -")
+    rows = [("end-to-end", results["latency_seconds"])]
+    rows += [("queue wait", results["queue_wait_seconds"])]
+    rows += list(results["stage_seconds"].items())
+    print(f"{'':<12} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, summary in rows:
+        values = [format_seconds(summary[key]) for key in ["p50", "p95", "p99", "max"]]
+        print(f"{name:<12} " + " ".join(f"{value:>8}" for value in values))
+    memory = results["memory"]["server_peak_rss_bytes"]
+    if memory:
+        print(f"Server peak memory: {memory / 1024**2:.1f} MiB")
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    results = run(args)
+    print_report(results)
+
+    output = args.output
+    if not output:
+        commit = (results["version"]["commit"] or "unknown")[:8]
+        stamp = results["time"].replace(":", "").replace("-", "")
+        output = os.path.join(ROOT, "benchmarks", "results", f"{stamp}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Wrote the results to {output}.")
+
+
+if __name__ == "__main__":
+    main()
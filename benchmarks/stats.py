@@ -0,0 +1,30 @@
+import math
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """
+    Returns the p-th percentile of the values, interpolated between the closest ranks.
+    :param values: The values, in any order.
+    :param p: The percentile, between 0 and 100.
+    :return: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(values: list[float]) -> dict:
+    """
+    Returns the count, mean, maximum, and the 50th, 95th and 99th percentiles of the values.
+    """
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
@@ -0,0 +1,417 @@
+"""
+Runs the CI checks of a job, in the server's own workers or in a runner.
+"""
+
+import logging
+import os
+import time
+from uuid import uuid4
+from src.modules.actions import (
+    checkout_ref,
+    clone_repo,
+    fetch_commit,
+    get_changed_files,
+    get_changed_python_files,
+    get_ci_config_hash,
+    run_linter_check,
+    run_tests,
+    setup_dependencies,
+)
+from src.modules.config import (
+    CLONE_STRATEGY,
+    FAIL_FAST,
+    INCREMENTAL_LINT,
+    LIVE_LOG_RETENTION_DAYS,
+    GITHUB_API_URL,
+    LOGS_FOLDER,
+    MIRROR_CACHE_FOLDER,
+    MIRROR_CACHE_MAX_BYTES,
+    PARALLEL_STAGES,
+    PIP_CACHE_FOLDER,
+    PRIORITY_CLASSES,
+    REAPER_MAX_FILES_PER_SECOND,
+    RESULT_CACHE,
+    STATUS_MAX_ATTEMPTS,
+    STATUS_OUTBOX_FILE,
+    STAGE_TIMEOUTS,
+    TEST_DURATIONS_FOLDER,
+    TEST_IMPACT,
+    TEST_IMPACT_FOLDER,
+    TEST_IMPACT_FULL_RUN_EVERY,
+    TEST_SHARDS,
+    TMPFS_FOLDER,
+    TMPFS_MAX_BYTES,
+    TMPFS_WORKSPACE_BYTES,
+    VENV_CACHE_FOLDER,
+    VENV_CACHE_MAX_BYTES,
+    WHEELHOUSE_FOLDER,
+    WORKSPACES_FOLDER,
+)
+from src.modules.logs import (
+    archive_live_log,
+    check_if_job_log_exists,
+    find_cached_result,
+    get_live_log_path,
+    read_job_log,
+    remove_expired_live_logs,
+    store_cached_result,
+    write_job_log,
+)
+from src.modules.impact import record_test_run, select_tests
+from src.modules.metrics import (
+    cache_lookups,
+    job_duration,
+    queue_wait_duration,
+    stage_duration,
+    time_stage,
+)
+from src.modules.notifier import StatusNotifier
+from src.modules.processes import (
+    JobCancelledError,
+    LiveLog,
+    ProcessGroup,
+    StageTimeoutError,
+)
+from src.modules.scheduler import Job, get_priority
+from src.modules.stages import Stage, run_stages
+from src.modules.types import JobMetadata, PushEventPayload, Status
+from src.modules.venv_cache import release_cached_venv
+from src.modules.workspaces import WorkspaceManager
+
+workspaces = WorkspaceManager(
+    WORKSPACES_FOLDER,
+    TMPFS_FOLDER or None,
+    TMPFS_MAX_BYTES,
+    TMPFS_WORKSPACE_BYTES,
+    REAPER_MAX_FILES_PER_SECOND,
+)
+notifier = StatusNotifier(STATUS_OUTBOX_FILE, GITHUB_API_URL, STATUS_MAX_ATTEMPTS)
+
+
+def log_step(uuid: str, live_log: LiveLog, message: str) -> None:
+    """
+    Logs a step of a job, both in the server logs and in the job's live log.
+    """
+    logging.info(f"[{uuid}] {message}")
+    live_log.write_line(f"==> {message}")
+
+
+def ci_check(
+    payload: PushEventPayload,
+    uuid: str | None = None,
+    group: ProcessGroup | None = None,
+    queue_wait: float | None = None,
+) -> None:
+    """
+    This function is used to run the CI checks on the incoming payload.
+
+    :param payload: The push event to run the CI checks on.
+    :param uuid: The unique ID of the job, a new one is generated if not given.
+    :param group: The process group to run the job's commands in. Cancelling it
+    stops the job, which then completes with the `cancelled` status.
+    :param queue_wait: How long the job waited in the queue, in seconds.
+    """
+    # Skip CI checks in special cases:
+    # If a branch is created, but no commits are pushed.
+    if payload.created and payload.commits == []:
+        return
+
+    # If a branch is deleted, do not run CI checks on the non-existent branch.
+    if payload.deleted:
+        return
+
+    # Create a unique ID for the job
+    uuid = uuid or str(uuid4())
+    status = Status.PENDING
+    time_started = int(time.time())
+    started = time.perf_counter()
+    stage_durations: dict[str, float] = {}
+    logs: list[str] = []
+    log_sections: list[str] = []
+    ephemeral_folder = None
+    repo_folder = None
+    # The result cache key, the tree of the pushed commit and the CI configuration
+    tree_id = payload.head_commit.tree_id if payload.head_commit else None
+    config_hash = get_ci_config_hash() if RESULT_CACHE and tree_id else None
+    reused_from = None
+    lint_files = None
+    test_modules = None
+
+    # Stream the output of every command to the live log while the job runs
+    live_log = LiveLog(get_live_log_path(uuid, LOGS_FOLDER))
+    group = group or ProcessGroup()
+    group.live_log = live_log
+
+    try:
+        log_step(uuid, live_log, "Starting CI check...")
+        # Extract some information from the payload
+        repo_owner = payload.repository["owner"]["login"]
+        repo_name = payload.repository["name"]
+        clone_url = payload.repository["clone_url"]
+        commit_sha = payload.after
+        author = payload.pusher.name
+        ref = payload.ref
+
+        # Reuse the result of an earlier job that checked the same tree, without cloning it
+        cached = (
+            find_cached_result(tree_id, config_hash, LOGS_FOLDER)
+            if config_hash
+            else None
+        )
+        if config_hash:
+            hit = "hit" if cached is not None else "miss"
+            cache_lookups.inc(cache="result", result=hit)
+        if cached is not None:
+            reused_from, status = cached
+            message = f"Reused the {status.value} result of job {reused_from}, which checked the same tree {tree_id}."
+            log_step(uuid, live_log, message)
+            logs += [message]
+            log_sections += ["cache"]
+            return
+
+        # Post a pending status to the commit, in the background
+        logging.info(f"[{uuid}] Posting a pending status to commit {commit_sha}...")
+        notifier.notify(repo_owner, repo_name, commit_sha, status, uuid)
+
+        # Initialize an ephemeral environment
+        ephemeral_folder = workspaces.allocate(uuid)
+
+        # Begin setting up the CI environment
+        log_step(uuid, live_log, f"Cloning the repository {repo_name}...")
+        with time_stage(stage_durations, "clone"):
+            if CLONE_STRATEGY in ("shallow", "blobless"):
+                logs += [
+                    fetch_commit(
+                        clone_url,
+                        ephemeral_folder,
+                        commit_sha,
+                        blobless=CLONE_STRATEGY == "blobless",
+                        group=group.child(STAGE_TIMEOUTS["clone"]),
+                    )
+                ]
+            else:
+                mirror_cache = (
+                    MIRROR_CACHE_FOLDER if CLONE_STRATEGY == "mirror" else None
+                )
+                logs += [
+                    clone_repo(
+                        clone_url,
+                        ephemeral_folder,
+                        mirror_cache,
+                        MIRROR_CACHE_MAX_BYTES,
+                        group.child(STAGE_TIMEOUTS["clone"]),
+                    )
+                ]
+        log_sections += ["clone"]
+        repo_folder = os.path.join(ephemeral_folder, repo_name)
+
+        log_step(uuid, live_log, f"Checking out the commit {commit_sha}...")
+        with time_stage(stage_durations, "checkout"):
+            checkout_group = group.child(STAGE_TIMEOUTS["checkout"])
+            logs += [checkout_ref(repo_folder, commit_sha, checkout_group)]
+        log_sections += ["checkout"]
+
+        log_step(uuid, live_log, "Setting up the dependencies...")
+        with time_stage(stage_durations, "setup"):
+            logs += [
+                setup_dependencies(
+                    repo_folder,
+                    VENV_CACHE_FOLDER,
+                    VENV_CACHE_MAX_BYTES,
+                    WHEELHOUSE_FOLDER,
+                    PIP_CACHE_FOLDER,
+                    group.child(STAGE_TIMEOUTS["setup"]),
+                )
+            ]
+        log_sections += ["setup"]
+
+        # Run the linter and tests, they only read the checkout so they can run together
+        durations_file = os.path.join(
+            TEST_DURATIONS_FOLDER, f"{repo_owner}-{repo_name}.json"
+        )
+        # Only lint the files changed by the push, if they are known
+        if INCREMENTAL_LINT:
+            lint_files = get_changed_python_files(repo_folder, payload, group)
+            if lint_files is not None:
+                log_step(
+                    uuid,
+                    live_log,
+                    f"Linting the {len(lint_files)} changed Python files.",
+                )
+
+        # Only run the tests affected by the push, with a full run every so often
+        impact_file = os.path.join(TEST_IMPACT_FOLDER, f"{repo_owner}-{repo_name}.json")
+        if TEST_IMPACT:
+            with time_stage(stage_durations, "impact"):
+                test_modules, reason = select_tests(
+                    repo_folder,
+                    get_changed_files(repo_folder, payload, group),
+                    impact_file,
+                    TEST_IMPACT_FULL_RUN_EVERY,
+                )
+            log_step(uuid, live_log, reason)
+
+        log_step(uuid, live_log, "Running the linter and tests...")
+        stages = [
+            Stage(
+                "lint",
+                lambda group: run_linter_check(repo_folder, group, lint_files),
+                FAIL_FAST,
+                STAGE_TIMEOUTS["lint"],
+            ),
+            Stage(
+                "test",
+                lambda group: run_tests(
+                    repo_folder, group, TEST_SHARDS, durations_file, test_modules
+                ),
+                timeout=STAGE_TIMEOUTS["test"],
+            ),
+        ]
+        try:
+            results = run_stages(stages, group, PARALLEL_STAGES)
+        finally:
+            for stage in stages:
+                if stage.duration is not None:
+                    stage_durations[stage.name] = stage.duration
+        logs += [stage_logs for _, stage_logs in results]
+        log_sections += [stage.name for stage in stages]
+
+        # Only tests that ran to the end count towards the next full run
+        test_stage = stages[-1]
+        if TEST_IMPACT and test_stage.completed and not group.cancelled:
+            record_test_run(impact_file, test_modules is not None)
+
+        # Update the status based on the CI checks
+        passed = all(stage_passed for stage_passed, _ in results)
+        status = Status.SUCCESS if passed else Status.FAILURE
+        if group.cancelled:
+            status = Status.CANCELLED
+
+    except JobCancelledError:
+        logging.info(f"[{uuid}] The CI check was cancelled.")
+        status = Status.CANCELLED
+
+    except StageTimeoutError as e:
+        log_step(uuid, live_log, str(e))
+        status = Status.ERROR
+
+    except Exception as e:
+        # Log the error and update the status
+        logging.error(f"[{uuid}] An error occurred during the CI check: {e}")
+        status = Status.ERROR
+
+    finally:
+        # Create the job metadata and store it as a log
+        log_step(uuid, live_log, f"CI check completed with status {status.value}.")
+        live_log.close()
+        time_ended = int(time.time())
+        job_metadata = JobMetadata(
+            id=uuid,
+            status=status,
+            repo_url=clone_url,
+            ref=ref,
+            head_commit=commit_sha,
+            author=author,
+            time_started=time_started,
+            time_ended=time_ended,
+            logs=logs,
+            log_sections=log_sections,
+            reused_from=reused_from,
+            queue_wait=queue_wait,
+            stage_durations=stage_durations,
+        )
+        write_job_log(uuid, job_metadata, LOGS_FOLDER)
+
+        # Post the final status to the commit right away, in the background
+        logging.info(f"[{uuid}] Posting the final status to commit {commit_sha}...")
+        notifier.notify(repo_owner, repo_name, commit_sha, status, uuid)
+
+        # Clean up the ephemeral environment, it is deleted in the background
+        if repo_folder is not None:
+            release_cached_venv(repo_folder)
+        if ephemeral_folder is not None:
+            workspaces.release(ephemeral_folder)
+
+        for name, duration in stage_durations.items():
+            stage_duration.observe(duration, stage=name)
+        job_duration.observe(time.perf_counter() - started, status=status.value)
+        if queue_wait is not None:
+            _, priority = get_priority(payload.ref, PRIORITY_CLASSES)
+            queue_wait_duration.observe(queue_wait, priority=priority)
+
+        # Only complete checks are cached, errors and cancellations may not happen again.
+        # Neither are checks that only linted or tested the changes, their result depends on the push.
+        if (
+            config_hash
+            and not reused_from
+            and lint_files is None
+            and test_modules is None
+            and status in (Status.SUCCESS, Status.FAILURE)
+        ):
+            store_cached_result(tree_id, config_hash, uuid, status, LOGS_FOLDER)
+
+        # The full output of the job is kept compressed, for `LIVE_LOG_RETENTION_DAYS`
+        archive_live_log(uuid, LOGS_FOLDER)
+        remove_expired_live_logs(LOGS_FOLDER, LIVE_LOG_RETENTION_DAYS)
+
+
+def close_job(job: Job) -> None:
+    """
+    Completes a job that is not run again with its `final_status`, e.g. a job of a broker
+    whose runners kept dying. Its commit may show the pending status of an earlier run,
+    so the final status is posted, and stored in the job store.
+    """
+    payload = job.payload
+    # No status was posted for the pushes that ci_check skips
+    if payload.deleted or (payload.created and payload.commits == []):
+        return
+
+    if job.final_status == Status.CANCELLED:
+        message = f"The job was superseded by {job.superseded_by or 'a newer job'} while its runner was not responding."
+    else:
+        message = "The runners of the job stopped responding too many times, it is not run again."
+    logging.warning(f"[{job.id}] {message}")
+
+    now = int(time.time())
+    repository = payload.repository
+    metadata = JobMetadata(
+        id=job.id,
+        status=job.final_status,
+        repo_url=repository["clone_url"],
+        ref=payload.ref,
+        head_commit=payload.after,
+        author=payload.pusher.name,
+        time_started=now,
+        time_ended=now,
+        logs=[message],
+        log_sections=["runner"],
+    )
+    write_job_log(job.id, metadata, LOGS_FOLDER)
+    notifier.notify(
+        repository["owner"]["login"],
+        repository["name"],
+        payload.after,
+        job.final_status,
+        job.id,
+    )
+
+
+def run_job(job: Job) -> None:
+    """
+    Runs a job taken from the queue by one of the scheduler's workers.
+    """
+    # A job resumed from the spool may have completed just before the restart,
+    # in which case only its final status might not have been posted yet
+    if check_if_job_log_exists(job.id, LOGS_FOLDER):
+        metadata = read_job_log(job.id, LOGS_FOLDER)
+        repository = job.payload.repository
+        notifier.notify(
+            repository["owner"]["login"],
+            repository["name"],
+            metadata.head_commit,
+            metadata.status,
+            job.id,
+        )
+        return
+
+    ci_check(job.payload, job.id, job.group, job.time_started - job.time_enqueued)
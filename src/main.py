@@ -1,32 +1,99 @@
+import hmac
 import logging
-import time
+import sqlite3
+import threading
 import uvicorn
+from contextlib import asynccontextmanager
 from typing import Union
-from uuid import uuid4
-from fastapi import FastAPI, BackgroundTasks, status, Response
-from src.modules.actions import (
-    checkout_ref,
-    clone_repo,
-    run_linter_check,
-    run_tests,
-    setup_dependencies,
+from fastapi import FastAPI, Header, Query, status, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from src.jobs import notifier, run_job, workspaces
+from src.modules.broker import Broker, LeaseLostError, get_job_queue
+from src.modules.config import (
+    BROKER,
+    LIVE_LOG_IDLE_SECONDS,
+    LOGS_FOLDER,
+    MAX_QUEUE_DEPTH,
+    MAX_WORKERS,
+    MODE,
+    PIP_CACHE_FOLDER,
+    PRIORITY_CLASSES,
+    QUEUE_FILE,
+    REPO_WEIGHTS,
+    RUNNER_LEASE_SECONDS,
+    RUNNER_TOKEN,
+    SUPERSEDE_JOBS,
+    WHEELHOUSE_FOLDER,
+    WHEELHOUSE_MIN_REQUESTS,
 )
-from src.modules.logs import get_job_logs, read_job_log, write_job_log
-from src.modules.notifications import add_commit_status
+from src.modules.logs import (
+    check_if_live_log_exists,
+    format_event,
+    list_jobs,
+    read_job_log,
+    read_log_section,
+    tail_log_section,
+    tail_live_log,
+)
+from src.modules.metrics import (
+    CONTENT_TYPE,
+    queue_depth,
+    render_metrics,
+    running_jobs,
+    status_outbox_size,
+)
+from src.modules.scheduler import JobQueue, JobScheduler, JobSpool, QueueFullError
 from src.modules.types import (
+    ClaimedJob,
     HealthCheckResponse,
+    HeartbeatResponse,
     JobMetadata,
     LogNotFoundResponse,
     LogsResponse,
     PushEventPayload,
+    QueueFullResponse,
+    QueueUnavailableResponse,
+    QueueResponse,
+    RunnerClaimRequest,
+    RunnerCompleteRequest,
+    RunnerErrorResponse,
+    RunnerRequest,
     Status,
     WebhookResponse,
 )
-from src.modules.utils import create_folder, remove_folder
+from src.modules.wheelhouse import prebuild_popular_wheels
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the CI workers and the status notifier with the server, and stops them on shutdown.
+    In broker mode, the statuses are posted by the runners that run the jobs.
+    """
+    if isinstance(scheduler, JobScheduler):
+        notifier.start()
+        workspaces.remove_stale()
+    scheduler.start()
+    if WHEELHOUSE_FOLDER and PIP_CACHE_FOLDER:
+        threading.Thread(target=prebuild_wheels, daemon=True).start()
+    yield
+    scheduler.stop()
+    notifier.stop()
+
+
+def prebuild_wheels() -> None:
+    """
+    Builds the wheels that jobs request often, so that they can be installed offline.
+    """
+    logs = prebuild_popular_wheels(
+        WHEELHOUSE_FOLDER, PIP_CACHE_FOLDER, WHEELHOUSE_MIN_REQUESTS
+    )
+    logging.info(logs.strip())
+
+
 app = FastAPI(
     title="CI/CD Service API for DD2480",
     description="This API is used to interact with the custom CI/CD service for DD2480 assignment 2.",
@@ -36,6 +103,7 @@ app = FastAPI(
         "url": "https://kth.name",
         "email": "thkam@kth.se",
     },
+    lifespan=lifespan,
 )
 logging.basicConfig(level=logging.INFO)
 
@@ -53,120 +121,251 @@ def health_check() -> HealthCheckResponse:
     }
 
 
-def ci_check(payload: PushEventPayload) -> None:
+def create_scheduler() -> JobQueue:
     """
-    This function is used to run the CI checks on the incoming payload.
+    Returns the queue that webhooks submit jobs to: the server's own workers, or
+    in broker mode, the broker that runners claim the jobs from.
+    :raises: ValueError if the broker is a URL, which only runners may connect to.
     """
-    # Skip CI checks in special cases:
-    # If a branch is created, but no commits are pushed.
-    if payload.created and payload.commits == []:
-        return
+    if MODE == "broker":
+        return get_job_queue(
+            BROKER,
+            LOGS_FOLDER,
+            max_queue_depth=MAX_QUEUE_DEPTH,
+            supersede=SUPERSEDE_JOBS,
+            lease=RUNNER_LEASE_SECONDS,
+        )
+    spool = JobSpool(QUEUE_FILE) if QUEUE_FILE else None
+    return JobScheduler(
+        run_job,
+        MAX_WORKERS,
+        MAX_QUEUE_DEPTH,
+        SUPERSEDE_JOBS,
+        spool,
+        PRIORITY_CLASSES,
+        REPO_WEIGHTS,
+    )
 
-    # If a branch is deleted, do not run CI checks on the non-existent branch.
-    if payload.deleted:
-        return
 
-    # Create a unique ID for the job
-    uuid = str(uuid4())
-    status = Status.PENDING
-    time_started = int(time.time())
-    logs: list[str] = []
+scheduler = create_scheduler()
 
-    try:
-        logging.info(f"[{uuid}] Starting CI check...")
-        # Extract some information from the payload
-        repo_owner = payload.repository["owner"]["login"]
-        repo_name = payload.repository["name"]
-        clone_url = payload.repository["clone_url"]
-        commit_sha = payload.after
-        author = payload.pusher.name
-        ref = payload.ref
-
-        # Post a pending status to the commit
-        logging.info(f"[{uuid}] Posting a pending status to commit {commit_sha}...")
-        add_commit_status(repo_owner, repo_name, commit_sha, status, uuid)
-
-        # Initialize an ephemeral environment
-        ephemeral_folder = f"./temp/{uuid}/"
-        create_folder(ephemeral_folder)
-
-        # Begin setting up the CI environment
-        logging.info(f"[{uuid}] Cloning the repository {repo_name}...")
-        logs += [clone_repo(clone_url, ephemeral_folder)]
-        repo_folder = ephemeral_folder + repo_name
-
-        logging.info(f"[{uuid}] Checking out the commit {commit_sha}...")
-        logs += [checkout_ref(repo_folder, commit_sha)]
-
-        logging.info(f"[{uuid}] Setting up the dependencies...")
-        logs += [setup_dependencies(repo_folder)]
-
-        # Run the linter and tests
-        logging.info(f"[{uuid}] Running the linter and tests...")
-        linter_passed, log_4 = run_linter_check(repo_folder)
-        logs += [log_4]
-
-        tests_passed, log_5 = run_tests(repo_folder)
-        logs += [log_5]
-
-        # Update the status based on the CI checks
-        status = Status.SUCCESS if linter_passed and tests_passed else Status.FAILURE
-
-    except Exception as e:
-        # Log the error and update the status
-        logging.error(f"[{uuid}] An error occurred during the CI check: {e}")
-        status = Status.ERROR
-
-    finally:
-        # Clean up the ephemeral environment
-        remove_folder(ephemeral_folder)
-
-        # Create the job metadata and store it as a log
-        logging.info(f"[{uuid}] CI check completed with status {status}.")
-        time_ended = int(time.time())
-        job_metadata = JobMetadata(
-            id=uuid,
-            status=status,
-            repo_url=clone_url,
-            ref=ref,
-            head_commit=commit_sha,
-            author=author,
-            time_started=time_started,
-            time_ended=time_ended,
-            logs=logs,
-        )
-        write_job_log(uuid, job_metadata)
 
-        # Post the final status to the commit
-        logging.info(f"[{uuid}] Posting the final status to commit {commit_sha}...")
-        add_commit_status(repo_owner, repo_name, commit_sha, status, uuid)
+# Seconds after which a webhook that the queue could not store should be sent again
+queue_unavailable_retry_after = 30
 
 
-@app.post("/webhook", status_code=status.HTTP_202_ACCEPTED)
+@app.post(
+    "/webhook",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=WebhookResponse,
+    responses={503: {"model": Union[QueueFullResponse, QueueUnavailableResponse]}},
+)
 def parse_incoming_webhook(
-    payload: PushEventPayload, background_tasks: BackgroundTasks
-) -> WebhookResponse:
+    payload: PushEventPayload,
+) -> Union[WebhookResponse, JSONResponse]:
     """
     This endpoint is used to receive and parse incoming webhooks.
 
     We currently only accept `push` events from GitHub.
+
+    If the job queue is full, or cannot store the job, e.g. because its database is
+    locked or the disk is full, the webhook is rejected with a `503` status and a
+    `Retry-After` header.
     """
-    background_tasks.add_task(ci_check, payload)
+    try:
+        job = scheduler.submit(payload)
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content=QueueFullResponse().model_dump(),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except sqlite3.Error as e:
+        logging.error(f"Failed to queue the push of commit {payload.after}: {e}")
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content=QueueUnavailableResponse().model_dump(),
+            headers={"Retry-After": str(queue_unavailable_retry_after)},
+        )
+
     return {
         "success": True,
         "message": "Webhook received successfully, the payload has been queued for processing.",
+        "id": job.id,
     }
 
 
+@app.get("/queue")
+def get_queue() -> QueueResponse:
+    """
+    Returns the jobs that are waiting in the queue, and the jobs that are running.
+    """
+    return scheduler.snapshot()
+
+
+@app.get("/metrics", response_class=Response)
+def get_metrics() -> Response:
+    """
+    Returns the metrics of the server in the Prometheus text format: the duration of
+    each stage and of whole jobs, the queue wait, the queue depth, the number of running
+    jobs, the lookups in each cache and whether they hit, and how long posting a commit
+    status to GitHub takes.
+    """
+    queue = scheduler.snapshot()
+    queue_depth.set(len(queue["pending"]))
+    running_jobs.set(len(queue["running"]))
+    status_outbox_size.set(notifier.pending())
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
+def authorize_runner(authorization: str | None) -> JSONResponse | None:
+    """
+    Checks that a request to the runner endpoints comes from a runner.
+    :param authorization: The `Authorization` header of the request, `Bearer <CI_RUNNER_TOKEN>`.
+    :return: The error response to send, or None if the runner is authorized.
+    """
+    if not RUNNER_TOKEN or not isinstance(scheduler, Broker):
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "The server does not run in broker mode."},
+        )
+    expected = f"Bearer {RUNNER_TOKEN}"
+    if not hmac.compare_digest((authorization or "").encode(), expected.encode()):
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "Invalid runner token."},
+        )
+    return None
+
+
+def lease_lost(error: LeaseLostError) -> JSONResponse:
+    """
+    Returns the response to a runner that no longer holds the job it reports on.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT, content={"message": str(error)}
+    )
+
+
+runner_errors = {
+    401: {"model": RunnerErrorResponse},
+    404: {"model": RunnerErrorResponse},
+}
+
+
+@app.post(
+    "/runner/claim",
+    response_model=ClaimedJob,
+    responses={204: {"description": "There is no job to run."}, **runner_errors},
+)
+def claim_job(
+    request: RunnerClaimRequest,
+    authorization: str | None = Header(default=None),
+) -> Union[ClaimedJob, Response]:
+    """
+    Gives the oldest pending job to a runner, in broker mode.
+
+    The runner holds the job for `CI_RUNNER_LEASE_SECONDS`, and must renew its
+    lease with heartbeats while it runs the job. Responds with `204` if there is
+    no job to run.
+    """
+    if (error := authorize_runner(authorization)) is not None:
+        return error
+
+    job = scheduler.claim(request.runner, request.capacity)
+    if job is None:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return {
+        "id": job.id,
+        "payload": job.payload,
+        "time_enqueued": job.time_enqueued,
+        "time_started": job.time_started,
+        "final_status": job.final_status,
+    }
+
+
+@app.post(
+    "/runner/jobs/{id}/heartbeat",
+    response_model=HeartbeatResponse,
+    responses={409: {"model": RunnerErrorResponse}, **runner_errors},
+)
+def heartbeat_job(
+    id: str,
+    request: RunnerRequest,
+    authorization: str | None = Header(default=None),
+) -> Union[HeartbeatResponse, JSONResponse]:
+    """
+    Renews the lease of a runner on a job, in broker mode.
+
+    Tells the runner to cancel the job if it was superseded. Responds with `409`
+    if the runner no longer holds the job, e.g. its lease expired and the job was
+    given to another runner.
+    """
+    if (error := authorize_runner(authorization)) is not None:
+        return error
+
+    try:
+        return {"cancelled": scheduler.heartbeat(id, request.runner)}
+    except LeaseLostError as e:
+        return lease_lost(e)
+
+
+@app.post(
+    "/runner/jobs/{id}/complete",
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+    responses={409: {"model": RunnerErrorResponse}, **runner_errors},
+)
+def complete_job(
+    id: str,
+    request: RunnerCompleteRequest,
+    authorization: str | None = Header(default=None),
+) -> Response:
+    """
+    Stores the result of a job that a runner has finished, in broker mode,
+    so that `/logs` shows it whichever runner ran the job.
+
+    Responds with `409` if the runner no longer holds the job.
+    """
+    if (error := authorize_runner(authorization)) is not None:
+        return error
+
+    try:
+        scheduler.complete(id, request.runner, request.result)
+    except LeaseLostError as e:
+        return lease_lost(e)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @app.get("/logs")
-def get_ci_logs() -> LogsResponse:
+def get_ci_logs(
+    cursor: int | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    repo: str | None = Query(default=None, description="The repository, `owner/name`."),
+    ref: str | None = None,
+    author: str | None = None,
+    status: Status | None = None,
+    since: int | None = Query(
+        default=None, description="Only jobs that ended at or after this Unix time."
+    ),
+    until: int | None = Query(
+        default=None, description="Only jobs that ended at or before this Unix time."
+    ),
+) -> LogsResponse:
     """
-    Returns a list of IDs for the logs that are available.
+    Returns a page of the logs that are available, newest first, with a summary of each job.
 
     Job logs are only stored after the CI job has been completed.
+    Pass the `next_cursor` of a page as `cursor` to get the page after it.
     """
-    logs = get_job_logs()
-    return {"logs": logs}
+    jobs, next_cursor = list_jobs(
+        LOGS_FOLDER, limit, cursor, repo, ref, author, status, since, until
+    )
+    return {
+        "logs": [job["id"] for job in jobs],
+        "jobs": jobs,
+        "next_cursor": next_cursor,
+    }
 
 
 @app.get(
@@ -181,7 +380,7 @@ def get_ci_log_details(
     Returns the log details for the given ID.
     """
     try:
-        job_metadata = read_job_log(id)
+        job_metadata = read_job_log(id, LOGS_FOLDER)
         return job_metadata
     except Exception:
         response.status_code = status.HTTP_404_NOT_FOUND
@@ -190,5 +389,135 @@ def get_ci_log_details(
         }
 
 
+@app.get(
+    "/logs/{id}/stream",
+    response_class=StreamingResponse,
+    response_model=None,
+    responses={404: {"model": LogNotFoundResponse}},
+)
+def stream_ci_log(id: str) -> Response:
+    """
+    Streams the output of a job as server-sent events, while the job is running.
+
+    Each line of output is sent as a `data` event. Once the job has completed and
+    all of its output has been sent, an `end` event is sent and the stream closes.
+    The output of a completed job is sent at once, until its live log expires.
+    If the output of a job that has not completed stops for `CI_LIVE_LOG_IDLE_SECONDS`,
+    e.g. because the process running it died, an `error` event is sent and the stream closes.
+    """
+    if not check_if_live_log_exists(id, LOGS_FOLDER):
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={
+                "message": "Log not found. Either the log ID is invalid, the CI job has not yet started, or its live log has expired."
+            },
+        )
+
+    async def events():
+        try:
+            async for line in tail_live_log(
+                id, LOGS_FOLDER, idle_timeout=LIVE_LOG_IDLE_SECONDS
+            ):
+                yield format_event(line)
+        except TimeoutError as e:
+            yield format_event(str(e), "error")
+            return
+        yield format_event("", "end")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parses a `Range` header with a single byte range, e.g. `bytes=0-99` or `bytes=-500`.
+    :param header: The value of the header.
+    :param size: The size of the whole content.
+    :return: The first byte and the byte after the last one in the range,
+    or None if the header is not a single byte range and should be ignored.
+    :raises: ValueError if the range does not overlap the content.
+    """
+    unit, _, ranges = header.partition("=")
+    first, dash, last = ranges.strip().partition("-")
+    if unit.strip() != "bytes" or not dash or "," in ranges:
+        return None
+    if not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+
+    if not first:
+        # A suffix range, the last bytes of the content
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    if start >= end:
+        raise ValueError(f"The range {header} does not overlap the content.")
+    return (start, end)
+
+
+@app.get(
+    "/logs/{id}/sections/{name}",
+    response_class=Response,
+    response_model=None,
+    responses={404: {"model": LogNotFoundResponse}},
+)
+def get_ci_log_section(
+    id: str,
+    name: str,
+    tail: int | None = Query(
+        default=None, ge=0, description="Only return the last lines of the section."
+    ),
+    range_header: str | None = Header(default=None, alias="range"),
+) -> Response:
+    """
+    Returns a section of the logs of a job as text, e.g. `test`.
+
+    The section names of a job are listed in the `log_sections` of its log details.
+    Use `?tail=N` to get the last N lines of the section, or a `Range` header
+    to get a range of its bytes. Only the part of the section that is returned
+    is decompressed.
+    """
+    media_type = "text/plain; charset=utf-8"
+    try:
+        if tail is not None:
+            return Response(
+                tail_log_section(id, name, tail, LOGS_FOLDER), media_type=media_type
+            )
+
+        _, size = read_log_section(id, name, LOGS_FOLDER, 0, 0)
+    except Exception:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={
+                "message": "Log not found. Either the log ID or the section name is invalid, or the CI job has not yet completed."
+            },
+        )
+
+    try:
+        byte_range = parse_byte_range(range_header, size) if range_header else None
+    except ValueError:
+        return Response(
+            status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    if byte_range is None:
+        content, _ = read_log_section(id, name, LOGS_FOLDER)
+        return Response(
+            content, media_type=media_type, headers={"Accept-Ranges": "bytes"}
+        )
+
+    start, end = byte_range
+    content, _ = read_log_section(id, name, LOGS_FOLDER, start, end)
+    return Response(
+        content,
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers={
+            "Accept-Ranges": "bytes",
+            "Content-Range": f"bytes {start}-{end - 1}/{size}",
+        },
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8001)
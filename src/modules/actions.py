@@ -1,21 +1,192 @@
+import hashlib
+import os
+import re
+import shlex
 import subprocess
-from src.modules.utils import check_if_folder_exists, create_folder
+import time
+from src.modules.git import get_repo_name, run_git
+from src.modules.mirrors import clone_from_mirror
+from src.modules.processes import ProcessGroup, run_command
+from src.modules.sharding import get_python, run_sharded_tests
+from src.modules.types import PushEventPayload
+from src.modules.utils import check_if_folder_exists, create_folder, get_folder_size
+from src.modules.venv_cache import build_venv, get_python_version, link_cached_venv
 
+# Followed by `.` to lint the whole project, or by the files to lint
+LINT_COMMAND = "flake8 --select E9,F63,F82,F7"
+# Above this many changed files, e.g. for a reformat, the whole project is linted instead
+LINT_MAX_FILES = 500
+# The changed files are linted in batches, so that a command line stays well within the system's limit
+LINT_BATCH_BYTES = 64 * 1024
 
-def clone_repo(url: str, destination: str) -> str:
+# The size of the pack in git's progress, e.g. `Receiving objects: 100% (5/5), 1.20 MiB | 3.00 MiB/s, done.`
+RECEIVED_PATTERN = re.compile(
+    r"Receiving objects: 100% \([^)]*\), ([\d.]+ (?:bytes|[KMG]iB))"
+)
+
+# GitHub stops listing the commits and the changed files of a commit at these numbers
+MAX_PAYLOAD_COMMITS = 2048
+MAX_PAYLOAD_FILES = 3000
+
+# Run with the interpreter of the project's `.venv`, followed by the test modules to run, if not all
+TEST_COMMAND = ["-m", "unittest"]
+
+
+def get_ci_config_hash() -> str:
+    """
+    Returns a hash of everything besides the repository that the result of a job depends on:
+    the linter and test commands, and the interpreter the environments are built with.
+    """
+    content = "\n".join([LINT_COMMAND, shlex.join(TEST_COMMAND), get_python_version()])
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+# The commands of the actions are shared with their asyncio versions in async_actions.py
+
+
+def get_clone_command(url: str) -> list[str]:
+    """
+    Returns the command that clones the repository into a folder named after it.
+    """
+    return ["git", "clone", "--", url, get_repo_name(url)]
+
+
+def get_checkout_command(ref: str) -> list[str]:
+    """
+    Returns the command that checks out the commit, run in the repository.
+    """
+    return ["git", "checkout", ref, "--"]
+
+
+def get_setup_commands() -> list[list[str]]:
+    """
+    Returns the commands that create `.venv` and install `requirements-dev.txt` into it,
+    one after the other, run in the root folder of the project.
+    """
+    venv_python = os.path.join(".venv", "bin", "python")
+    return [
+        ["python3", "-m", "venv", ".venv"],
+        [venv_python, "-m", "pip", "install", "-r", "requirements-dev.txt"],
+    ]
+
+
+def get_setup_error(
+    target_folder: str, result: subprocess.CompletedProcess
+) -> Exception:
+    """
+    Returns the exception raised when installing the dependencies fails.
+    """
+    err = Exception(f"Failed to install dependencies for {target_folder}.")
+    err.add_note(result.stderr.decode())
+    return err
+
+
+def split_in_batches(arguments: list[str], max_bytes: int) -> list[list[str]]:
+    """
+    Split the arguments into batches of at most `max_bytes`, counting a separator after each.
+    An argument longer than that is a batch of its own.
+    """
+    batches: list[list[str]] = []
+    size = 0
+    for argument in arguments:
+        if not batches or size + len(argument) + 1 > max_bytes:
+            batches.append([])
+            size = 0
+        batches[-1].append(argument)
+        size += len(argument) + 1
+    return batches
+
+
+def get_lint_commands(files: list[str] | None) -> list[list[str]]:
+    """
+    Returns the commands that lint the files, run in the root folder of the project.
+    The whole project is linted if `files` is None, or if there are more than `LINT_MAX_FILES`.
+    """
+    lint = shlex.split(LINT_COMMAND)
+    if files is None or len(files) > LINT_MAX_FILES:
+        return [[*lint, "."]]
+    return [
+        [*lint, "--", *batch] for batch in split_in_batches(files, LINT_BATCH_BYTES)
+    ]
+
+
+def get_lint_result(results: list[subprocess.CompletedProcess]) -> tuple[bool, str]:
+    """
+    Returns whether the linter passed, and its logs, from the commands of `get_lint_commands`.
+    """
+    success = all(result.returncode == 0 for result in results)
+    output = b"".join(result.stdout for result in results)
+
+    if output:
+        logs = "Linting Log: \n" + output.decode()
+    else:
+        logs = "Linting Log: No syntax errors found."
+
+    return (success, logs)
+
+
+def get_test_command(
+    target_folder: str, test_modules: list[str] | None = None
+) -> list[str]:
+    """
+    Returns the command that runs the tests of the modules, or all of them if None.
+    """
+    return [get_python(target_folder), *TEST_COMMAND, *(test_modules or [])]
+
+
+def get_test_environment(target_folder: str) -> dict | None:
+    """
+    Returns the environment variables of an activated `.venv`, so that the commands
+    that the tests run find its executables, or None if the project has no `.venv`.
+    """
+    venv = os.path.abspath(os.path.join(target_folder, ".venv"))
+    if not check_if_folder_exists(venv):
+        return None
+    path = os.path.join(venv, "bin") + os.pathsep + os.environ.get("PATH", "")
+    return {**os.environ, "VIRTUAL_ENV": venv, "PATH": path}
+
+
+def get_test_result(result: subprocess.CompletedProcess) -> tuple[bool, str]:
+    """
+    Returns whether the tests passed, and their logs, from the command of `get_test_command`.
+    """
+    success = result.returncode == 0
+
+    if result.stderr:
+        logs = "Test Log: \n" + result.stderr.decode()
+    else:
+        logs = "Test Log: No test results found."
+
+    return (success, logs)
+
+
+def clone_repo(
+    url: str,
+    destination: str,
+    mirror_cache: str | None = None,
+    mirror_cache_max_bytes: int | None = None,
+    group: ProcessGroup | None = None,
+) -> str:
     """
     Clone the repository from the given URL to the destination folder.
     Note that this function will create the destination folder if it does not exist.
     :param url: The URL of the repository to clone.
     :param destination: The destination folder to clone the repository to.
+    :param mirror_cache: The folder of the local mirror cache, if the clone should go through it.
+    :param mirror_cache_max_bytes: The size budget of the mirror cache.
+    :param group: The process group to run git in, so that it can be cancelled.
     :return: The CLI logs from the cloning process.
     :raises: Exception if the cloning fails.
     """
     if not check_if_folder_exists(destination):
         create_folder(destination)
 
-    command = f"git clone {url}"
-    ret = subprocess.run(command, capture_output=True, shell=True, cwd=destination)
+    if mirror_cache:
+        return clone_from_mirror(
+            url, destination, mirror_cache, mirror_cache_max_bytes, group
+        )
+
+    ret = run_command(get_clone_command(url), destination, group=group)
 
     if ret.returncode != 0:
         err = Exception(f"Failed cloning into repository {url}.")
@@ -27,19 +198,80 @@ def clone_repo(url: str, destination: str) -> str:
     return ret.stderr.decode()
 
 
-def checkout_ref(target_folder: str, ref: str) -> str:
+def fetch_commit(
+    url: str,
+    destination: str,
+    sha: str,
+    blobless: bool = False,
+    group: ProcessGroup | None = None,
+) -> str:
+    """
+    Fetch a single commit of the repository into the destination folder.
+    Instead of cloning every branch with its full history, an empty repository is
+    initialised and only the given commit is fetched, at depth 1 by default.
+    The commit still has to be checked out with `checkout_ref` afterwards.
+    Note that this function will create the destination folder if it does not exist.
+    :param url: The URL of the repository to fetch from.
+    :param destination: The destination folder, the repository is created in a subfolder named after it.
+    :param sha: The SHA of the commit to fetch.
+    :param blobless: Fetch the commit history without file contents (a partial clone) instead of a shallow one.
+    :param group: The process group to run git in, so that it can be cancelled.
+    :return: The CLI logs from the fetching process, including the size of the download and the time taken.
+    :raises: Exception if the fetch fails, e.g., the commit does not exist on the remote.
+    """
+    repo_folder = os.path.join(destination, get_repo_name(url))
+    create_folder(repo_folder)
+
+    time_started = time.monotonic()
+    run_git(["init", "--quiet"], repo_folder)
+    run_git(["remote", "add", "origin", url], repo_folder)
+
+    if blobless:
+        # File contents are downloaded lazily by git, when the commit is checked out
+        run_git(["config", "remote.origin.promisor", "true"], repo_folder)
+        run_git(
+            ["config", "remote.origin.partialclonefilter", "blob:none"], repo_folder
+        )
+        fetch_args = ["fetch", "--progress", "--filter=blob:none", "origin", sha]
+    else:
+        fetch_args = ["fetch", "--progress", "--depth=1", "origin", sha]
+
+    try:
+        logs = run_git(fetch_args, repo_folder, group)
+    except Exception as e:
+        raise Exception(f"Failed fetching the commit {sha} from {url}.") from e
+
+    time_taken = time.monotonic() - time_started
+    # Only the last state of each progress line is kept
+    logs = "\n".join(line.rsplit("\r", 1)[-1] for line in logs.split("\n"))
+    received = RECEIVED_PATTERN.findall(logs)
+    # Git does not report the size of small packs, which are unpacked into loose objects
+    if received:
+        size = f"{received[-1]} received"
+    else:
+        objects = get_folder_size(os.path.join(repo_folder, ".git", "objects"))
+        size = f"object store size {objects} bytes"
+    mode = "blobless" if blobless else "shallow"
+    logs += f"Fetched {sha} ({mode}): {size}, in {time_taken:.2f}s.\n"
+
+    return logs
+
+
+def checkout_ref(
+    target_folder: str, ref: str, group: ProcessGroup | None = None
+) -> str:
     """
     Checkout the given commit SHA in the repository.
     :param target_folder: The folder of the repository.
     :param ref: The commit reference to checkout.
+    :param group: The process group to run git in, so that it can be cancelled.
     :return: The CLI logs from the checkout process.
     :raises: Exception if the checkout fails, e.g., the commit SHA or the repo folder does not exist.
     """
     if not check_if_folder_exists(target_folder):
         raise Exception(f"The target folder ${target_folder} does not exist.")
 
-    command = f"git checkout {ref}"
-    ret = subprocess.run(command, capture_output=True, shell=True, cwd=target_folder)
+    ret = run_command(get_checkout_command(ref), target_folder, group=group)
 
     if ret.returncode != 0:
         err = Exception(f"Failed to checkout the commit {ref} in the repository.")
@@ -51,84 +283,203 @@ def checkout_ref(target_folder: str, ref: str) -> str:
     return ret.stderr.decode()
 
 
-def setup_dependencies(target_folder: str) -> str:
+def setup_dependencies(
+    target_folder: str,
+    venv_cache: str | None = None,
+    venv_cache_max_bytes: int | None = None,
+    wheelhouse: str | None = None,
+    pip_cache: str | None = None,
+    group: ProcessGroup | None = None,
+) -> str:
     """
     Setup and install dependencies for the project.
     This function will invoke python3 to create a virtual environment,
     then install the dependencies listed in `requirements-dev.txt`.
+    With a cache folder, environments are shared between jobs with the same
+    requirements and interpreter, and `.venv` is a link to the cached one. The cached
+    one is held until `release_cached_venv` is called for the target folder.
+    With a wheelhouse, packages are installed offline from prebuilt wheels where possible.
     :param destination: The root folder of the project.
+    :param venv_cache: The folder of the environment cache, if environments should be reused.
+    :param venv_cache_max_bytes: The size budget of the environment cache.
+    :param wheelhouse: The folder of the shared wheelhouse, if wheels should be reused.
+    :param pip_cache: The folder of the shared pip cache, used together with the wheelhouse.
+    :param group: The process group to run the installation in, so that it can be cancelled.
     :return: The CLI logs from the setup process.
     :raises: Exception if the target folder does not exist or if the installation fails.
     """
     if not check_if_folder_exists(target_folder):
         raise Exception(f"The target folder ${target_folder} does not exist.")
 
-    command = "python3 -m venv .venv && . .venv/bin/activate && pip install -r requirements-dev.txt"
-    ret = subprocess.run(command, capture_output=True, shell=True, cwd=target_folder)
+    if venv_cache:
+        logs = link_cached_venv(
+            target_folder,
+            venv_cache,
+            venv_cache_max_bytes,
+            wheelhouse,
+            pip_cache,
+            group,
+        )
+        if logs is not None:
+            return logs
 
-    if ret.returncode != 0:
-        err = Exception(f"Failed to install dependencies for {target_folder}.")
-        err.add_note(ret.stderr.decode())
-        raise err
+    if wheelhouse and pip_cache:
+        return build_venv(
+            os.path.abspath(os.path.join(target_folder, ".venv")),
+            os.path.abspath(os.path.join(target_folder, "requirements-dev.txt")),
+            wheelhouse,
+            pip_cache,
+            group,
+        )
+
+    logs = ""
+    for command in get_setup_commands():
+        ret = run_command(command, target_folder, group=group)
+        if ret.returncode != 0:
+            raise get_setup_error(target_folder, ret)
+        logs += ret.stdout.decode()
 
-    return ret.stdout.decode()
+    return logs
 
 
-def run_linter_check(target_folder: str) -> tuple[bool, str]:
+def get_changed_files(
+    target_folder: str,
+    payload: PushEventPayload,
+    group: ProcessGroup | None = None,
+) -> list[str] | None:
+    """
+    Returns the files that the push added, modified or removed.
+    The files are taken from the commits of the payload, or from `git diff` between
+    `before` and `after` if GitHub truncated the lists.
+    :param target_folder: The root folder of the project, with `after` checked out.
+    :param payload: The push event.
+    :param group: The process group to run git in, so that it can be cancelled.
+    :return: The paths of the files, relative to the root folder, or None if the changes
+    are not known, e.g. for a forced push, a new branch, or when `before` is not in the
+    checkout because it was fetched shallow.
+    :raises: JobCancelledError if the process group is cancelled.
+    """
+    if payload.forced or payload.created or not payload.before.strip("0"):
+        return None
+
+    truncated = not payload.commits or len(payload.commits) >= MAX_PAYLOAD_COMMITS
+    files: set[str] = set()
+    for commit in payload.commits:
+        changed = [*(commit.added or []), *(commit.modified or [])]
+        changed += commit.removed or []
+        if len(changed) >= MAX_PAYLOAD_FILES:
+            truncated = True
+        files.update(changed)
+
+    if truncated:
+        command = ["git", "diff", "--name-only", "--no-renames"]
+        result = run_command(
+            [*command, payload.before, payload.after],
+            target_folder,
+            group=group,
+            bounded=False,
+        )
+        if result.returncode != 0:
+            return None
+        files = set(result.stdout.decode().splitlines())
+
+    return sorted(files)
+
+
+def get_changed_python_files(
+    target_folder: str,
+    payload: PushEventPayload,
+    group: ProcessGroup | None = None,
+) -> list[str] | None:
+    """
+    Returns the Python files that the push added or modified, and that still exist after it.
+    The parameters are the ones of `get_changed_files`.
+    :return: The paths of the files, relative to the root folder, or None if the whole
+    project should be linted.
+    :raises: JobCancelledError if the process group is cancelled.
+    """
+    files = get_changed_files(target_folder, payload, group)
+    if files is None:
+        return None
+
+    # Files that the push removed are skipped
+    return [
+        file
+        for file in files
+        if file.endswith(".py") and os.path.isfile(os.path.join(target_folder, file))
+    ]
+
+
+def run_linter_check(
+    target_folder: str,
+    group: ProcessGroup | None = None,
+    files: list[str] | None = None,
+) -> tuple[bool, str]:
     """
     Run the linter on the project.
     This function will invoke the linter tool to check for syntax errors.
     :param target_folder: The root folder of the project.
+    :param group: The process group to run the linter in, so that it can be cancelled.
+    :param files: Only lint these files, e.g. the ones changed by the push. The whole project is linted
+    if None, or if there are more than `LINT_MAX_FILES`.
     :return: True if the linter passes, False if the linter fails. Also return the CLI logs from the linter process.
     :raises: Exception if the target folder does not exist.
+    :raises: JobCancelledError if the process group is cancelled.
     """
 
     if not check_if_folder_exists(target_folder):
         raise ValueError(f"The provided path {target_folder} is not a valid directory.")
 
-    flake_command = "flake8 --select E9,F63,F82,F7 ."
-    result = subprocess.run(
-        flake_command, capture_output=True, shell=True, cwd=target_folder
-    )
+    if files is not None and not files:
+        return (True, "Linting Log: No changed Python files to lint.")
 
-    success = result.returncode == 0
+    results = [
+        run_command(command, target_folder, group=group)
+        for command in get_lint_commands(files)
+    ]
+    return get_lint_result(results)
 
-    if result.stdout:
-        logs = "Linting Log: \n" + result.stdout.decode()
-    else:
-        logs = "Linting Log: No syntax errors found."
 
-    return (success, logs)
-
-
-def run_tests(target_folder: str) -> tuple[bool, str]:
+def run_tests(
+    target_folder: str,
+    group: ProcessGroup | None = None,
+    shards: int = 1,
+    durations_file: str | None = None,
+    test_modules: list[str] | None = None,
+) -> tuple[bool, str]:
     """
     Run the tests on the project.
     This function will invoke the test runner to execute the test suite.
+    With more than one shard, the test cases are split across that many processes,
+    balanced by the test durations of previous runs when they are known.
     :param target_folder: The root folder of the project.
+    :param group: The process group to run the tests in, so that they can be cancelled.
+    :param shards: The number of processes to run the tests in.
+    :param durations_file: The file that keeps the test durations between runs, used to balance the shards.
+    :param test_modules: Only run the tests of these modules, e.g. the ones affected by the push. All the tests run if None.
     :return: True if all the tests pass, False if some tests fail. Also return the CLI logs from the test process.
     :raises: Exception if the target folder does not exist.
+    :raises: JobCancelledError if the process group is cancelled.
     """
     if not check_if_folder_exists(target_folder):
         raise ValueError(f"The provided path {target_folder} is not a valid directory.")
 
-    # .venv might not exist if the setup_dependencies function was not called
-    test_command = """
-    if test -d .venv; then
-        . .venv/bin/activate
-    fi
-    python -m unittest
-    """
+    if test_modules is not None and not test_modules:
+        return (True, "Test Log: No tests are affected by the change.")
 
-    result = subprocess.run(
-        test_command, capture_output=True, shell=True, cwd=target_folder
-    )
+    if shards > 1:
+        result = run_sharded_tests(
+            target_folder, shards, group or ProcessGroup(), durations_file, test_modules
+        )
+        # Fall back to a single process if the tests could not be discovered
+        if result is not None:
+            success, logs = result
+            return (success, "Test Log: \n" + logs)
 
-    success = result.returncode == 0
-
-    if result.stderr:
-        logs = "Test Log: \n" + result.stderr.decode()
-    else:
-        logs = "Test Log: No test results found."
-
-    return (success, logs)
+    result = run_command(
+        get_test_command(target_folder, test_modules),
+        target_folder,
+        env=get_test_environment(target_folder),
+        group=group,
+    )
+    return get_test_result(result)
@@ -0,0 +1,182 @@
+import time
+from src.modules.actions import (
+    get_checkout_command,
+    get_clone_command,
+    get_lint_commands,
+    get_lint_result,
+    get_setup_commands,
+    get_setup_error,
+    get_test_command,
+    get_test_environment,
+    get_test_result,
+)
+from src.modules.config import STAGE_TIMEOUTS
+from src.modules.processes import LiveLog, run_command_async
+from src.modules.utils import check_if_folder_exists, create_folder
+
+
+async def clone_repo_async(
+    url: str,
+    destination: str,
+    timeout: float | None = STAGE_TIMEOUTS["clone"],
+    live_log: LiveLog | None = None,
+) -> str:
+    """
+    Clone the repository from the given URL to the destination folder, like `clone_repo`.
+    Note that this function will create the destination folder if it does not exist.
+    :param url: The URL of the repository to clone.
+    :param destination: The destination folder to clone the repository to.
+    :param timeout: The number of seconds the clone may take.
+    :param live_log: The live log to stream the output of git to.
+    :return: The CLI logs from the cloning process.
+    :raises: Exception if the cloning fails.
+    :raises: StageTimeoutError if the clone timed out.
+    """
+    if not check_if_folder_exists(destination):
+        create_folder(destination)
+
+    ret = await run_command_async(
+        get_clone_command(url), destination, timeout=timeout, live_log=live_log
+    )
+
+    if ret.returncode != 0:
+        err = Exception(f"Failed cloning into repository {url}.")
+        err.add_note(ret.stderr.decode())
+        raise err
+
+    # Git commands outputs information message on stderr
+    return ret.stderr.decode()
+
+
+async def checkout_ref_async(
+    target_folder: str,
+    ref: str,
+    timeout: float | None = STAGE_TIMEOUTS["checkout"],
+    live_log: LiveLog | None = None,
+) -> str:
+    """
+    Checkout the given commit SHA in the repository, like `checkout_ref`.
+    :param target_folder: The folder of the repository.
+    :param ref: The commit reference to checkout.
+    :param timeout: The number of seconds the checkout may take.
+    :param live_log: The live log to stream the output of git to.
+    :return: The CLI logs from the checkout process.
+    :raises: Exception if the checkout fails, e.g., the commit SHA or the repo folder does not exist.
+    :raises: StageTimeoutError if the checkout timed out.
+    """
+    if not check_if_folder_exists(target_folder):
+        raise Exception(f"The target folder ${target_folder} does not exist.")
+
+    ret = await run_command_async(
+        get_checkout_command(ref), target_folder, timeout=timeout, live_log=live_log
+    )
+
+    if ret.returncode != 0:
+        err = Exception(f"Failed to checkout the commit {ref} in the repository.")
+        err.add_note(ret.stderr.decode())
+        raise err
+
+    # Git commands outputs information message on stderr
+    return ret.stderr.decode()
+
+
+async def setup_dependencies_async(
+    target_folder: str,
+    timeout: float | None = STAGE_TIMEOUTS["setup"],
+    live_log: LiveLog | None = None,
+) -> str:
+    """
+    Create a virtual environment in `.venv`, and install `requirements-dev.txt` into it,
+    like `setup_dependencies` without caches. The caches of environments and wheels are
+    guarded by blocking file locks, which would stall the event loop.
+    :param target_folder: The root folder of the project.
+    :param timeout: The number of seconds the whole setup may take.
+    :param live_log: The live log to stream the output of pip to.
+    :return: The CLI logs from the setup process.
+    :raises: Exception if the target folder does not exist or if the installation fails.
+    :raises: StageTimeoutError if the setup timed out.
+    """
+    if not check_if_folder_exists(target_folder):
+        raise Exception(f"The target folder ${target_folder} does not exist.")
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    logs = ""
+
+    for command in get_setup_commands():
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        ret = await run_command_async(
+            command, target_folder, timeout=remaining, live_log=live_log
+        )
+        if ret.returncode != 0:
+            raise get_setup_error(target_folder, ret)
+        logs += ret.stdout.decode()
+
+    return logs
+
+
+async def run_linter_check_async(
+    target_folder: str,
+    files: list[str] | None = None,
+    timeout: float | None = STAGE_TIMEOUTS["lint"],
+    live_log: LiveLog | None = None,
+) -> tuple[bool, str]:
+    """
+    Run the linter on the project, like `run_linter_check`.
+    :param target_folder: The root folder of the project.
+    :param files: Only lint these files, e.g. the ones changed by the push. The whole project is linted
+    if None, or if there are more than `LINT_MAX_FILES`.
+    :param timeout: The number of seconds the linter may take.
+    :param live_log: The live log to stream the output of the linter to.
+    :return: True if the linter passes, False if the linter fails. Also return the CLI logs from the linter process.
+    :raises: Exception if the target folder does not exist.
+    :raises: StageTimeoutError if the linter timed out.
+    """
+    if not check_if_folder_exists(target_folder):
+        raise ValueError(f"The provided path {target_folder} is not a valid directory.")
+
+    if files is not None and not files:
+        return (True, "Linting Log: No changed Python files to lint.")
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    results = []
+    for command in get_lint_commands(files):
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        results.append(
+            await run_command_async(
+                command, target_folder, timeout=remaining, live_log=live_log
+            )
+        )
+
+    return get_lint_result(results)
+
+
+async def run_tests_async(
+    target_folder: str,
+    test_modules: list[str] | None = None,
+    timeout: float | None = STAGE_TIMEOUTS["test"],
+    live_log: LiveLog | None = None,
+) -> tuple[bool, str]:
+    """
+    Run the tests of the project with the interpreter of its `.venv`, like `run_tests` with one shard.
+    :param target_folder: The root folder of the project.
+    :param test_modules: Only run the tests of these modules. All the tests run if None.
+    :param timeout: The number of seconds the tests may take.
+    :param live_log: The live log to stream the output of the tests to.
+    :return: True if all the tests pass, False if some tests fail. Also return the CLI logs from the test process.
+    :raises: Exception if the target folder does not exist.
+    :raises: StageTimeoutError if the tests timed out.
+    """
+    if not check_if_folder_exists(target_folder):
+        raise ValueError(f"The provided path {target_folder} is not a valid directory.")
+
+    if test_modules is not None and not test_modules:
+        return (True, "Test Log: No tests are affected by the change.")
+
+    result = await run_command_async(
+        get_test_command(target_folder, test_modules),
+        target_folder,
+        env=get_test_environment(target_folder),
+        timeout=timeout,
+        live_log=live_log,
+    )
+    return get_test_result(result)
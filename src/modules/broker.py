@@ -0,0 +1,411 @@
+import abc
+import json
+import logging
+import math
+import os
+import requests
+import sqlite3
+import time
+from contextlib import closing
+from uuid import uuid4
+from src.modules.logs import write_job_log
+from src.modules.scheduler import Job, JobQueue, QueueFullError
+from src.modules.types import JobMetadata, PushEventPayload, Status
+from src.modules.utils import create_folder
+
+schema = """
+CREATE TABLE IF NOT EXISTS broker_jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    repo TEXT,
+    ref TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    runner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    superseded_by TEXT,
+    time_enqueued REAL NOT NULL,
+    time_started REAL
+);
+CREATE INDEX IF NOT EXISTS broker_jobs_key ON broker_jobs (repo, ref);
+CREATE TABLE IF NOT EXISTS runners (
+    name TEXT PRIMARY KEY,
+    capacity INTEGER NOT NULL,
+    last_seen REAL NOT NULL
+);
+"""
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when a runner reports on a job that it no longer holds, e.g. because its lease
+    expired and the job was given to another runner.
+    """
+
+
+class Broker(abc.ABC):
+    """
+    The runners' side of a job queue, that runners claim jobs from.
+
+    A runner claims a job for the duration of a lease, and renews the lease with
+    heartbeats while it runs the job. If a runner dies, its lease expires and the
+    job is claimed again by another runner.
+    """
+
+    @abc.abstractmethod
+    def claim(self, runner: str, capacity: int = 1) -> Job | None:
+        """
+        Take the oldest pending job, or a job whose lease has expired.
+
+        A job whose lease has expired is not run again if it was superseded, or if
+        its runners died `max_attempts` times. Its runner may have posted a pending
+        status, so it is given to the runner with a `final_status` to close it with.
+
+        :param runner: The name of the runner, unique across the nodes.
+        :param capacity: The number of jobs the runner may run at the same time.
+        :return: The claimed job, or None if there is nothing to run.
+        """
+
+    @abc.abstractmethod
+    def heartbeat(self, id: str, runner: str) -> bool:
+        """
+        Renew the lease of the runner on a job it runs.
+
+        :return: True if the job was superseded and the runner should cancel it.
+        :raises: LeaseLostError if the runner no longer holds the job.
+        """
+
+    @abc.abstractmethod
+    def complete(self, id: str, runner: str, result: JobMetadata | None) -> None:
+        """
+        Remove a job that the runner has finished, and store its result in the job store.
+
+        :param result: The metadata of the job, None if the job did not produce any,
+        e.g. because its push deleted the branch.
+        :raises: LeaseLostError if the runner no longer holds the job.
+        """
+
+
+class SQLiteBroker(JobQueue, Broker):
+    """
+    A broker in a SQLite database, both the job queue of the API and the one that
+    runners claim from, if they share a filesystem with the API, or through the API
+    over HTTP otherwise.
+
+    Like `JobScheduler`, it holds at most `max_queue_depth` pending jobs and,
+    with `supersede` set, a job replaces the older jobs for the same repository
+    and ref. Pending ones are dropped, and running ones are cancelled by their
+    runner on its next heartbeat.
+    """
+
+    # Used for the Retry-After estimate, the broker does not know how long jobs take
+    default_job_duration = 60.0
+
+    def __init__(
+        self,
+        database_file: str,
+        logs_folder: str = "./logs",
+        max_queue_depth: int = 50,
+        supersede: bool = False,
+        lease: float = 60.0,
+        max_attempts: int = 3,
+    ):
+        """
+        :param database_file: The SQLite file of the broker, created if it does not exist.
+        :param logs_folder: The folder of the job store that the results are written to.
+        :param max_queue_depth: The number of jobs that may wait for a runner.
+        :param supersede: Cancel the older jobs for the same repository and ref when a job is submitted.
+        :param lease: The seconds a runner holds a job without a heartbeat.
+        :param max_attempts: The number of times a job is claimed before it is dropped,
+        so that a job that kills its runners does not go around forever.
+        """
+        self.database_file = database_file
+        self.logs_folder = logs_folder
+        self.max_queue_depth = max_queue_depth
+        self.supersede = supersede
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        create_folder(os.path.dirname(os.path.abspath(database_file)))
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(schema)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.database_file, timeout=30, isolation_level=None)
+
+    def submit(self, payload: PushEventPayload, id: str | None = None) -> Job:
+        job = Job(id or str(uuid4()), payload)
+        repo, ref = job.key
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if self.supersede:
+                dropped = connection.execute(
+                    """
+                    DELETE FROM broker_jobs
+                    WHERE repo IS ? AND ref = ? AND runner IS NULL
+                    RETURNING id
+                    """,
+                    (repo, ref),
+                ).fetchall()
+                for (old_id,) in dropped:
+                    logging.info(
+                        f"[{old_id}] Dropped from the queue, superseded by {job.id}."
+                    )
+
+            depth = connection.execute(
+                "SELECT COUNT(*) FROM broker_jobs WHERE runner IS NULL"
+            ).fetchone()[0]
+            if depth >= self.max_queue_depth:
+                # Like in `JobScheduler`, the superseded jobs stay dropped
+                connection.commit()
+                raise QueueFullError(self._estimate_retry_after())
+
+            if self.supersede:
+                cancelled = connection.execute(
+                    """
+                    UPDATE broker_jobs SET superseded_by = ?
+                    WHERE repo IS ? AND ref = ? AND runner IS NOT NULL AND superseded_by IS NULL
+                    RETURNING id
+                    """,
+                    (job.id, repo, ref),
+                ).fetchall()
+                for (old_id,) in cancelled:
+                    logging.info(f"[{old_id}] Cancelled, superseded by {job.id}.")
+
+            connection.execute(
+                """
+                INSERT INTO broker_jobs (id, repo, ref, payload, time_enqueued)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (job.id, repo, ref, payload.model_dump_json(), job.time_enqueued),
+            )
+
+        return job
+
+    def _estimate_retry_after(self) -> int:
+        # A queue slot frees up whenever any of the runners finishes a job
+        return max(1, math.ceil(self.default_job_duration / max(self._capacity(), 1)))
+
+    def _capacity(self) -> int:
+        # The runners that have not been seen for a lease are presumed gone
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "SELECT COALESCE(SUM(capacity), 0) FROM runners WHERE last_seen >= ?",
+                (time.time() - self.lease,),
+            ).fetchone()[0]
+
+    def snapshot(self) -> dict:
+        with closing(self._connect()) as connection:
+            rows = connection.execute("""
+                SELECT id, repo, ref, payload, runner, lease_expires, time_enqueued, time_started
+                FROM broker_jobs ORDER BY seq
+                """).fetchall()
+
+        now = time.time()
+        pending, running = [], []
+        for id, repo, ref, payload, runner, lease_expires, enqueued, started in rows:
+            job = {
+                "id": id,
+                "repo": repo,
+                "ref": ref,
+                "head_commit": json.loads(payload)["after"],
+                "time_enqueued": enqueued,
+                "time_started": started,
+                "runner": runner,
+            }
+            # A job whose lease has expired waits to be claimed again
+            if runner is None or lease_expires < now:
+                pending.append({**job, "time_started": None, "runner": None})
+            else:
+                running.append(job)
+
+        return {
+            "pending": pending,
+            "running": running,
+            "max_workers": self._capacity(),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def claim(self, runner: str, capacity: int = 1) -> Job | None:
+        now = time.time()
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO runners VALUES (?, ?, ?)",
+                (runner, capacity, now),
+            )
+            row = connection.execute(
+                """
+                SELECT id, payload, runner, attempts, superseded_by, time_enqueued
+                FROM broker_jobs
+                WHERE runner IS NULL OR lease_expires < ?
+                ORDER BY seq LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            id, payload, previous_runner, attempts, superseded_by, enqueued = row
+            final_status = None
+            if previous_runner is not None:
+                logging.warning(
+                    f"[{id}] The lease of runner {previous_runner} expired."
+                )
+            # The job of a dead runner is not worth running again if it was superseded
+            if superseded_by is not None:
+                logging.info(
+                    f"[{id}] Closed as cancelled, superseded by {superseded_by}."
+                )
+                final_status = Status.CANCELLED
+            elif attempts >= self.max_attempts:
+                logging.error(f"[{id}] Closed as an error after {attempts} attempts.")
+                final_status = Status.ERROR
+
+            connection.execute(
+                """
+                UPDATE broker_jobs
+                SET runner = ?, lease_expires = ?, attempts = attempts + 1, time_started = ?
+                WHERE id = ?
+                """,
+                (runner, now + self.lease, now, id),
+            )
+
+        job = Job(id, PushEventPayload.model_validate_json(payload))
+        job.time_enqueued = enqueued
+        job.time_started = now
+        job.superseded_by = superseded_by
+        job.final_status = final_status
+        return job
+
+    def heartbeat(self, id: str, runner: str) -> bool:
+        now = time.time()
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                """
+                UPDATE broker_jobs SET lease_expires = ?
+                WHERE id = ? AND runner = ?
+                RETURNING superseded_by
+                """,
+                (now + self.lease, id, runner),
+            ).fetchone()
+            connection.execute(
+                "UPDATE runners SET last_seen = ? WHERE name = ?", (now, runner)
+            )
+
+        if row is None:
+            raise LeaseLostError(f"Runner {runner} does not hold the job {id}.")
+        return row[0] is not None
+
+    def complete(self, id: str, runner: str, result: JobMetadata | None) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "DELETE FROM broker_jobs WHERE id = ? AND runner = ? RETURNING id",
+                (id, runner),
+            ).fetchone()
+
+        if row is None:
+            raise LeaseLostError(f"Runner {runner} does not hold the job {id}.")
+        if result is not None:
+            write_job_log(id, result, self.logs_folder)
+
+
+class HTTPBroker(Broker):
+    """
+    The runners' side of the broker of an API server, through its `/runner` endpoints.
+    Jobs are submitted to the API through its webhook, not through this broker.
+    """
+
+    def __init__(self, url: str, token: str, timeout: float = 30.0):
+        """
+        :param url: The base URL of the API server.
+        :param token: The runner token of the API server, `CI_RUNNER_TOKEN`.
+        :param timeout: The seconds to wait for a response from the API.
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"Bearer {token}"
+
+    def _post(self, path: str, body: dict) -> requests.Response:
+        response = self._session.post(
+            f"{self.url}/runner{path}", json=body, timeout=self.timeout
+        )
+        if response.status_code == 409:
+            raise LeaseLostError(response.json()["message"])
+        if not response.ok:
+            err = Exception(f"The broker responded with status {response.status_code}.")
+            err.add_note(response.text)
+            raise err
+        return response
+
+    def claim(self, runner: str, capacity: int = 1) -> Job | None:
+        response = self._post("/claim", {"runner": runner, "capacity": capacity})
+        if response.status_code == 204:
+            return None
+
+        claimed = response.json()
+        job = Job(claimed["id"], PushEventPayload(**claimed["payload"]))
+        job.time_enqueued = claimed["time_enqueued"]
+        job.time_started = claimed["time_started"]
+        if claimed.get("final_status") is not None:
+            job.final_status = Status(claimed["final_status"])
+        return job
+
+    def heartbeat(self, id: str, runner: str) -> bool:
+        response = self._post(f"/jobs/{id}/heartbeat", {"runner": runner})
+        return response.json()["cancelled"]
+
+    def complete(self, id: str, runner: str, result: JobMetadata | None) -> None:
+        body = {
+            "runner": runner,
+            "result": None if result is None else result.model_dump(mode="json"),
+        }
+        self._post(f"/jobs/{id}/complete", body)
+
+
+def is_url(location: str) -> bool:
+    """
+    Returns True if the location of a broker is the URL of an API server.
+    """
+    return location.startswith(("http://", "https://"))
+
+
+def get_job_queue(location: str, logs_folder: str = "./logs", **kwargs) -> SQLiteBroker:
+    """
+    Returns the broker that the API submits jobs to, in broker mode.
+    :param location: The path of the SQLite file of the broker.
+    :param logs_folder: The folder of the job store.
+    :param kwargs: The other parameters of `SQLiteBroker`.
+    :raises: ValueError if the location is a URL, the API cannot submit jobs to another server.
+    """
+    if is_url(location):
+        raise ValueError(
+            f"The broker of the server must be a SQLite file, not the URL {location}. "
+            "Only runners on other nodes connect to the broker of a server by its URL."
+        )
+    return SQLiteBroker(location, logs_folder, **kwargs)
+
+
+def get_broker(
+    location: str, token: str | None = None, logs_folder: str = "./logs", **kwargs
+) -> Broker:
+    """
+    Returns the broker that a runner claims jobs from: the URL of an API server, or the path of a SQLite file.
+    :param location: `http://` or `https://` URL, or a file path.
+    :param token: The runner token of the API server, only used for URLs.
+    :param logs_folder: The folder of the job store, only used for SQLite files.
+    :param kwargs: The other parameters of `SQLiteBroker`.
+    :raises: ValueError if the location is a URL but no token is given.
+    """
+    if is_url(location):
+        if not token:
+            raise ValueError("A runner token is needed to connect to the API server.")
+        return HTTPBroker(location, token)
+    return SQLiteBroker(location, logs_folder, **kwargs)
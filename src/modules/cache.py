@@ -0,0 +1,105 @@
+import fcntl
+import os
+from contextlib import contextmanager
+from typing import Iterator
+from src.modules.utils import check_if_folder_exists, get_folder_size, remove_folder
+
+
+@contextmanager
+def lock_entry(entry_path: str) -> Iterator[int]:
+    """
+    Hold an exclusive lock on a cache entry for the duration of the `with` block.
+
+    The lock is a `flock` on a file next to the entry, so it also works across
+    processes, and can be downgraded to a shared lock with `flock` if needed.
+    """
+    fd = os.open(entry_path + ".lock", os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def hold_entry(entry_path: str) -> int:
+    """
+    Take a shared lock on a cache entry, so that it is not evicted while it is in use.
+    Waits while the entry is locked by `lock_entry`, e.g. while it is being built.
+    :return: The file descriptor of the lock, the lock is released once it is closed.
+    """
+    fd = os.open(entry_path + ".lock", os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def mark_entry_used(entry_path: str) -> None:
+    """
+    Record that the cache entry was just used, for least recently used eviction.
+    """
+    with open(entry_path + ".lock", "a"):
+        os.utime(entry_path + ".lock")
+
+
+def get_entry_last_used(entry_path: str) -> float:
+    """
+    Returns when the cache entry was last used, or 0 if it never was.
+    """
+    lock_file = entry_path + ".lock"
+    return os.path.getmtime(lock_file) if os.path.exists(lock_file) else 0
+
+
+def evict_entries(
+    cache_folder: str,
+    suffix: str,
+    max_bytes: int,
+    keep: str | None = None,
+) -> list[str]:
+    """
+    Remove the least recently used cache entries until the cache fits in `max_bytes`.
+
+    Entries that are locked, e.g. held by a running job, or that are at `keep`
+    are never evicted.
+    :param cache_folder: The folder that holds the entries.
+    :param suffix: The suffix of the entry folders, e.g. `.git`.
+    :param max_bytes: The size budget of the cache.
+    :param keep: The path of an entry that must not be evicted.
+    :return: The paths of the evicted entries.
+    """
+    if not check_if_folder_exists(cache_folder):
+        return []
+
+    entries = [
+        os.path.join(os.path.abspath(cache_folder), name)
+        for name in os.listdir(cache_folder)
+        if name.endswith(suffix)
+        and check_if_folder_exists(os.path.join(cache_folder, name))
+    ]
+    sizes = {entry: get_folder_size(entry) for entry in entries}
+    total = sum(sizes.values())
+
+    evicted = []
+    for entry in sorted(entries, key=get_entry_last_used):
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+
+        fd = os.open(entry + ".lock", os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        try:
+            remove_folder(entry)
+        finally:
+            os.close(fd)
+
+        total -= sizes[entry]
+        evicted.append(entry)
+
+    return evicted
@@ -0,0 +1,143 @@
+import os
+from dotenv import load_dotenv
+
+# normally this is loaded in main.py, but the modules read their settings on import
+load_dotenv()
+
+
+def get_int_setting(name: str, default: int) -> int:
+    """
+    Read an integer setting from the environment.
+
+    Falls back to the default if the variable is unset or empty.
+    """
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def get_bool_setting(name: str, default: bool) -> bool:
+    """
+    Read a boolean setting, such as `true` or `0`, from the environment.
+
+    Falls back to the default if the variable is unset or empty.
+    """
+    value = os.getenv(name)
+    return value.lower() in ("1", "true", "yes", "on") if value else default
+
+
+def get_mapping_setting(name: str, default: str) -> list[tuple[str, str]]:
+    """
+    Read a setting of `key=value` entries separated by semicolons, such as `a=1;b=2`, from the environment.
+
+    Falls back to the default if the variable is unset. The entries keep their order.
+    """
+    value = os.getenv(name, default)
+    entries = []
+    for entry in value.split(";"):
+        if entry.strip():
+            key, _, item = entry.partition("=")
+            entries.append((key.strip(), item.strip()))
+    return entries
+
+
+# Folder of the job logs
+LOGS_FOLDER = os.getenv("CI_LOGS_FOLDER", "./logs")
+
+# Job scheduling
+MAX_WORKERS = get_int_setting("CI_MAX_WORKERS", 2)
+MAX_QUEUE_DEPTH = get_int_setting("CI_MAX_QUEUE_DEPTH", 50)
+# Cancel the queued and running jobs of a branch when a newer push to it comes in
+SUPERSEDE_JOBS = get_bool_setting("CI_SUPERSEDE_JOBS", True)
+# File that keeps the accepted jobs until they complete, so they are resumed after a restart.
+# Leave it empty to keep the queue in memory only
+QUEUE_FILE = os.getenv("CI_QUEUE_FILE", "./cache/queue.db")
+# Priority classes, highest first, each with comma-separated ref patterns. Other refs are in the `default` class
+PRIORITY_CLASSES = [
+    (name, [pattern.strip() for pattern in patterns.split(",")])
+    for name, patterns in get_mapping_setting(
+        "CI_PRIORITY_CLASSES", "release=refs/heads/main,refs/heads/master,refs/tags/*"
+    )
+]
+# Share of the workers of each repository pattern, relative to the other repositories, 1 by default
+REPO_WEIGHTS = [
+    (pattern, float(weight))
+    for pattern, weight in get_mapping_setting("CI_REPO_WEIGHTS", "")
+]
+
+# Where jobs run: `local` in the server's own workers, or `broker` in runners that claim them from a shared broker
+MODE = os.getenv("CI_MODE", "local")
+# The SQLite file of the broker, or the URL of the API server for runners on other nodes
+BROKER = os.getenv("CI_BROKER", "./cache/broker.db")
+# The token that runners authenticate to the API server with, the runner endpoints are disabled without one
+RUNNER_TOKEN = os.getenv("CI_RUNNER_TOKEN", "")
+RUNNER_LEASE_SECONDS = get_int_setting("CI_RUNNER_LEASE_SECONDS", 60)
+RUNNER_POLL_SECONDS = get_int_setting("CI_RUNNER_POLL_SECONDS", 2)
+
+# Job workspaces, moved to a trash folder when the job ends and deleted by a background reaper
+WORKSPACES_FOLDER = os.getenv("CI_WORKSPACES_FOLDER", "./temp")
+# Files the reaper deletes per second, so that it does not slow down the running jobs (0 for no limit)
+REAPER_MAX_FILES_PER_SECOND = get_int_setting("CI_REAPER_MAX_FILES_PER_SECOND", 2000)
+# Pool of workspaces in memory, e.g. a folder in /dev/shm, with disk workspaces once it is full
+TMPFS_FOLDER = os.getenv("CI_TMPFS_FOLDER", "")
+TMPFS_MAX_BYTES = get_int_setting("CI_TMPFS_MAX_BYTES", 2 * 1024**3)
+TMPFS_WORKSPACE_BYTES = get_int_setting("CI_TMPFS_WORKSPACE_BYTES", 512 * 1024**2)
+
+# Seconds each stage of a job may take before its commands are killed, None for no limit
+STAGE_TIMEOUTS = {
+    "clone": get_int_setting("CI_CLONE_TIMEOUT_SECONDS", 600) or None,
+    "checkout": get_int_setting("CI_CHECKOUT_TIMEOUT_SECONDS", 60) or None,
+    "setup": get_int_setting("CI_SETUP_TIMEOUT_SECONDS", 1800) or None,
+    "lint": get_int_setting("CI_LINT_TIMEOUT_SECONDS", 600) or None,
+    "test": get_int_setting("CI_TEST_TIMEOUT_SECONDS", 3600) or None,
+}
+
+# Output of a command kept in memory, from its start and from its end. The rest is only in the job's live log
+OUTPUT_HEAD_BYTES = get_int_setting("CI_OUTPUT_HEAD_BYTES", 256 * 1024)
+OUTPUT_TAIL_BYTES = get_int_setting("CI_OUTPUT_TAIL_BYTES", 1024 * 1024)
+# Days the compressed live logs of completed jobs are kept for, 0 keeps them forever
+LIVE_LOG_RETENTION_DAYS = get_int_setting("CI_LIVE_LOG_RETENTION_DAYS", 14)
+# Seconds without output after which the stream of a job that has not completed is closed
+LIVE_LOG_IDLE_SECONDS = get_int_setting("CI_LIVE_LOG_IDLE_SECONDS", 900)
+
+# How job workspaces are created: `mirror`, `full`, `shallow` or `blobless`
+CLONE_STRATEGY = os.getenv("CI_CLONE_STRATEGY", "mirror")
+
+# Repository mirror cache, only used by the `mirror` clone strategy
+MIRROR_CACHE_FOLDER = os.getenv("CI_MIRROR_CACHE_FOLDER", "./cache/mirrors")
+MIRROR_CACHE_MAX_BYTES = get_int_setting("CI_MIRROR_CACHE_MAX_BYTES", 5 * 1024**3)
+
+# Virtual environment cache, leave the folder empty to build a new one for every job
+VENV_CACHE_FOLDER = os.getenv("CI_VENV_CACHE_FOLDER", "./cache/venvs")
+VENV_CACHE_MAX_BYTES = get_int_setting("CI_VENV_CACHE_MAX_BYTES", 10 * 1024**3)
+
+# Shared wheelhouse and pip cache, leave the folders empty to install from the index directly
+WHEELHOUSE_FOLDER = os.getenv("CI_WHEELHOUSE_FOLDER", "./cache/wheelhouse")
+PIP_CACHE_FOLDER = os.getenv("CI_PIP_CACHE_FOLDER", "./cache/pip")
+WHEELHOUSE_MIN_REQUESTS = get_int_setting("CI_WHEELHOUSE_MIN_REQUESTS", 3)
+
+# Reuse the result of an earlier job when the same tree is pushed again
+RESULT_CACHE = get_bool_setting("CI_RESULT_CACHE", True)
+
+# Run the linter and the tests at the same time, and stop the tests early if linting fails
+PARALLEL_STAGES = get_bool_setting("CI_PARALLEL_STAGES", True)
+FAIL_FAST = get_bool_setting("CI_FAIL_FAST", False)
+
+# Only lint the Python files changed by a push, instead of the whole project
+INCREMENTAL_LINT = get_bool_setting("CI_INCREMENTAL_LINT", False)
+
+# Split the tests across this many processes, with shards balanced by past test durations
+TEST_SHARDS = get_int_setting("CI_TEST_SHARDS", 1)
+TEST_DURATIONS_FOLDER = os.getenv("CI_TEST_DURATIONS_FOLDER", "./cache/test_durations")
+
+# Only run the test modules that import the files changed by a push, with a full run every so often
+TEST_IMPACT = get_bool_setting("CI_TEST_IMPACT", False)
+TEST_IMPACT_FOLDER = os.getenv("CI_TEST_IMPACT_FOLDER", "./cache/test_impact")
+TEST_IMPACT_FULL_RUN_EVERY = get_int_setting("CI_TEST_IMPACT_FULL_RUN_EVERY", 10)
+
+# Commit statuses, sent by a background worker from a durable outbox
+GITHUB_API_URL = os.getenv("CI_GITHUB_API_URL", "https://api.github.com")
+# Requests per hour to the GitHub API, and how many of them may be made at once
+GITHUB_RATE_LIMIT = get_int_setting("CI_GITHUB_RATE_LIMIT", 5000)
+GITHUB_BURST = get_int_setting("CI_GITHUB_BURST", 10)
+STATUS_OUTBOX_FILE = os.getenv("CI_STATUS_OUTBOX_FILE", "./cache/status_outbox.db")
+STATUS_MAX_ATTEMPTS = get_int_setting("CI_STATUS_MAX_ATTEMPTS", 10)
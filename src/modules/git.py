@@ -0,0 +1,29 @@
+import os
+from src.modules.processes import ProcessGroup, run_command
+
+
+def run_git(args: list[str], cwd: str, group: ProcessGroup | None = None) -> str:
+    """
+    Run a git command in the given folder.
+    :param args: The arguments to pass to git.
+    :param cwd: The folder to run the command in.
+    :param group: The process group to run the command in.
+    :return: The CLI logs from the command.
+    :raises: Exception if the command fails.
+    """
+    ret = run_command(["git", *args], cwd, group=group)
+
+    if ret.returncode != 0:
+        err = Exception(f"Failed to run git {args[0]} in {cwd}.")
+        err.add_note(ret.stderr.decode())
+        raise err
+
+    # Git commands outputs information message on stderr
+    return ret.stdout.decode() + ret.stderr.decode()
+
+
+def get_repo_name(url: str) -> str:
+    """
+    Returns the folder name that `git clone` would use for the given URL.
+    """
+    return os.path.basename(url.rstrip("/")).removesuffix(".git")
@@ -0,0 +1,237 @@
+import ast
+import fnmatch
+import hashlib
+import json
+import os
+from src.modules.cache import lock_entry
+from src.modules.utils import check_if_file_exists, create_folder
+
+# The files that `python -m unittest` discovers as test modules
+TEST_PATTERN = "test*.py"
+
+# Changes to these files cannot affect the tests, any other non-Python file might
+ignored_suffixes = (".md", ".rst")
+
+
+def get_module_name(path: str) -> str:
+    """
+    Returns the dotted module name of a Python file, relative to the root of the project.
+    e.g. `src/modules/actions.py` is `src.modules.actions`, and `src/__init__.py` is `src`.
+    """
+    parts = path[: -len(".py")].split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def find_python_files(target_folder: str) -> list[str]:
+    """
+    Returns the Python files of the project, relative to its root folder.
+    Hidden folders, e.g. `.venv` and `.git`, are skipped.
+    """
+    files = []
+    for root, folders, names in os.walk(target_folder):
+        folders[:] = [
+            folder
+            for folder in folders
+            if not folder.startswith(".") and folder != "__pycache__"
+        ]
+        relative = os.path.relpath(root, target_folder)
+        for name in names:
+            if name.endswith(".py"):
+                files.append(os.path.normpath(os.path.join(relative, name)))
+    return sorted(files)
+
+
+def get_imports(source: bytes, module: str, is_package: bool) -> list[str]:
+    """
+    Returns the names that a module imports, including the ones imported inside functions.
+    For `from a import b`, both `a` and `a.b` are returned, as `b` may be a module.
+    Relative imports are resolved against the module's package.
+    :param source: The source code of the module.
+    :param module: The dotted name of the module.
+    :param is_package: Whether the module is the `__init__.py` of a package.
+    :raises: SyntaxError if the module cannot be parsed.
+    """
+    package = module if is_package else module.rpartition(".")[0]
+    names = set()
+
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parts = package.split(".") if package else []
+                parts = parts[: len(parts) - node.level + 1]
+                base = ".".join(part for part in [*parts, base] if part)
+            if base:
+                names.add(base)
+            names.update(
+                f"{base}.{alias.name}" if base else alias.name for alias in node.names
+            )
+
+    return sorted(names)
+
+
+def build_test_map(
+    target_folder: str, parsed: dict[str, list] | None = None
+) -> tuple[dict[str, list[str]], dict[str, list]]:
+    """
+    Map every test module of the project to the files it depends on.
+
+    A test module depends on the files it imports, directly or through other modules
+    of the project, on the `__init__.py` of their packages, and on itself. Imports of
+    modules outside the project are ignored.
+    :param target_folder: The root folder of the project.
+    :param parsed: The imports of each file in a previous run, by file and content hash,
+    so that unchanged files are not parsed again.
+    :return: The files that each test module depends on, by test module name, and the
+    imports of each file, to be passed as `parsed` to the next run.
+    """
+    parsed = parsed or {}
+    modules: dict[str, str] = {}
+    imports: dict[str, list] = {}
+
+    for path in find_python_files(target_folder):
+        with open(os.path.join(target_folder, path), "rb") as file:
+            source = file.read()
+        digest = hashlib.sha1(source).hexdigest()
+        module = get_module_name(path)
+        modules[module] = path
+
+        if path in parsed and parsed[path][0] == digest:
+            imports[path] = parsed[path]
+            continue
+        try:
+            names = get_imports(source, module, path.endswith("__init__.py"))
+        except (SyntaxError, ValueError):
+            # The test will fail on it anyway, only the file itself is known to be affected
+            names = []
+        imports[path] = [digest, names]
+
+    def dependencies(name: str) -> list[str]:
+        # Importing `a.b.c` also runs the `__init__.py` of `a` and `a.b`
+        parts = name.split(".")
+        prefixes = [".".join(parts[:index]) for index in range(1, len(parts) + 1)]
+        return [modules[prefix] for prefix in prefixes if prefix in modules]
+
+    test_map = {}
+    for module, path in modules.items():
+        if not fnmatch.fnmatch(os.path.basename(path), TEST_PATTERN):
+            continue
+        seen = {path, *dependencies(module)}
+        stack = list(seen)
+        while stack:
+            for name in imports[stack.pop()][1]:
+                for dependency in dependencies(name):
+                    if dependency not in seen:
+                        seen.add(dependency)
+                        stack.append(dependency)
+        test_map[module] = sorted(seen)
+
+    return test_map, imports
+
+
+def get_affected_tests(
+    test_map: dict[str, list[str]], changed_files: list[str]
+) -> list[str] | None:
+    """
+    Returns the test modules that depend on any of the changed files.
+    :param test_map: The files that each test module depends on, from `build_test_map`.
+    :param changed_files: The files added, modified or removed, relative to the root folder.
+    :return: The names of the test modules, or None if all the tests should run because
+    a file that is not a Python module changed, e.g. a data file or the requirements.
+    """
+    for file in changed_files:
+        if not file.endswith((".py", *ignored_suffixes)):
+            return None
+
+    changed = set(changed_files)
+    return sorted(
+        module for module, paths in test_map.items() if changed.intersection(paths)
+    )
+
+
+def read_impact_state(state_file: str) -> dict:
+    """
+    Returns the state that `select_tests` keeps for a repository, or an empty one.
+    Must be called with the lock of the state file held.
+    """
+    if not check_if_file_exists(state_file):
+        return {"selective_runs": 0, "files": {}}
+    with open(state_file, "r") as file:
+        return json.load(file)
+
+
+def select_tests(
+    target_folder: str,
+    changed_files: list[str] | None,
+    state_file: str,
+    full_run_every: int,
+) -> tuple[list[str] | None, str]:
+    """
+    Select the test modules to run for a push, from the import graph of the checkout.
+
+    The state of the repository is kept in `state_file`: the imports of every file, so
+    that only changed files are parsed again, the files each test module depends on, and the number of selective runs since the
+    last full run. Once there were `full_run_every` selective runs in a row, all the tests
+    run again, as a safety net for dependencies that the imports do not show. The runs
+    are counted by `record_test_run`, once the tests have run.
+    :param target_folder: The root folder of the project, with the pushed commit checked out.
+    :param changed_files: The files changed by the push, or None if they are not known.
+    :param state_file: The file that keeps the state of the repository between runs.
+    :param full_run_every: The maximum number of selective runs in a row.
+    :return: The test modules to run, None to run all the tests, and the reason, for the logs.
+    """
+    create_folder(os.path.dirname(os.path.abspath(state_file)))
+    with lock_entry(state_file):
+        state = read_impact_state(state_file)
+        test_map, state["files"] = build_test_map(target_folder, state["files"])
+        state["tests"] = test_map
+        modules = None
+        if changed_files is None:
+            reason = "Running all the tests, the changed files are not known."
+        elif state["selective_runs"] >= full_run_every:
+            reason = (
+                f"Running all the tests after {state['selective_runs']} selective runs."
+            )
+        else:
+            modules = get_affected_tests(test_map, changed_files)
+            # A removed module does not show up in the imports, but the tests that import it fail
+            removed = [
+                file
+                for file in changed_files
+                if file.endswith(".py")
+                and not os.path.isfile(os.path.join(target_folder, file))
+            ]
+            if removed:
+                modules = None
+                reason = "Running all the tests, a Python module was removed."
+            elif modules is None:
+                reason = (
+                    "Running all the tests, a file that is not a Python module changed."
+                )
+            else:
+                reason = f"Running the {len(modules)} of {len(test_map)} test modules affected by the change."
+
+        with open(state_file, "w") as file:
+            json.dump(state, file)
+
+    return modules, reason
+
+
+def record_test_run(state_file: str, selective: bool) -> None:
+    """
+    Count a test run towards the periodic full run of `select_tests`.
+    Only runs that completed, whether the tests passed or failed, should be counted,
+    so that errors and cancellations do not put off the next full run.
+    :param state_file: The file that keeps the state of the repository between runs.
+    :param selective: Whether only the selected tests ran, or all of them.
+    """
+    create_folder(os.path.dirname(os.path.abspath(state_file)))
+    with lock_entry(state_file):
+        state = read_impact_state(state_file)
+        state["selective_runs"] = state["selective_runs"] + 1 if selective else 0
+        with open(state_file, "w") as file:
+            json.dump(state, file)
@@ -1,5 +1,20 @@
+import asyncio
+import glob
+import gzip
 import json
 import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator
+from src.modules.sections import (
+    get_section_size,
+    read_section_range,
+    read_section_tail,
+    write_sections,
+)
 from src.modules.types import JobMetadata, Status
 from src.modules.utils import (
     check_if_folder_exists,
@@ -8,29 +23,213 @@ from src.modules.utils import (
 )
 
 file_name = "log_list.json"
+database_name = "jobs.db"
+# The JSON store is moved to this folder once it has been imported
+migrated_folder = "migrated"
+# The live log is read by chunks of this size when it is tailed
+LIVE_LOG_CHUNK_BYTES = 64 * 1024
 
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    repo TEXT,
+    ref TEXT,
+    status TEXT,
+    author TEXT,
+    time_started INTEGER,
+    time_ended INTEGER,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_repo ON jobs (repo, seq);
+CREATE INDEX IF NOT EXISTS jobs_ref ON jobs (ref, seq);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq);
+CREATE INDEX IF NOT EXISTS jobs_author ON jobs (author, seq);
+CREATE INDEX IF NOT EXISTS jobs_time_ended ON jobs (time_ended);
+CREATE TABLE IF NOT EXISTS results (
+    tree_id TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (tree_id, config_hash)
+);
+CREATE TABLE IF NOT EXISTS log_sections (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    blocks TEXT NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+"""
 
-def get_job_logs(
-    directory: str = "./logs",
-) -> list[str]:
+# The job stores that were created and migrated by this process, by database file
+_initialized_stores: set[str] = set()
+_initialize_lock = threading.Lock()
+
+# The names of the sections of a job's logs, in the order they are written
+default_section_names = ["clone", "checkout", "setup", "lint", "test"]
+
+
+def get_section_names(metadata: JobMetadata) -> list[str]:
+    """
+    Returns the name of each section of the job's logs.
+    Sections without a name are named after the default sections, or after their position.
+    """
+    names = list(metadata.log_sections[: len(metadata.logs)])
+    for position in range(len(names), len(metadata.logs)):
+        if position < len(default_section_names):
+            names.append(default_section_names[position])
+        else:
+            names.append(str(position))
+    return names
+
+
+def get_sections_path(id: str, directory: str = "./logs") -> str:
+    """
+    Returns the path of the file that the compressed log sections of a job are stored in.
+    """
+    return os.path.join(directory, "sections", f"{id}.log.gz")
+
+
+def get_repo_full_name(repo_url: str) -> str:
+    """
+    Returns the `owner/name` of a repository from its URL.
     """
-    Returns a list of job log IDs that are available. Creates a directory for logs if one doesn't already exist.
+    path = repo_url.rstrip("/").removesuffix(".git")
+    return "/".join(path.replace(":", "/").split("/")[-2:])
+
+
+def insert_job(
+    connection: sqlite3.Connection, id: str, metadata: JobMetadata | None
+) -> bool:
+    """
+    Insert the job into the store, unless a job with the same ID is already stored.
+    Jobs without metadata are only listed, reading them fails like reading a missing log.
+    Returns whether the job was inserted.
+    """
+    if metadata is None:
+        connection.execute("INSERT OR IGNORE INTO jobs (id) VALUES (?)", (id,))
+        return False
+
+    cursor = connection.execute(
+        """
+        INSERT OR IGNORE INTO jobs
+        (id, repo, ref, status, author, time_started, time_ended, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            id,
+            get_repo_full_name(metadata.repo_url),
+            metadata.ref,
+            metadata.status.value,
+            metadata.author,
+            metadata.time_started,
+            metadata.time_ended,
+            metadata.model_dump_json(),
+        ),
+    )
+    return cursor.rowcount == 1
+
+
+def migrate_json_logs(connection: sqlite3.Connection, directory: str) -> None:
     """
+    Import the job logs of the JSON store into the database, once.
 
+    The IDs of `log_list.json` keep their order, followed by any other `<id>.json` file.
+    The list is renamed afterwards, so the migration does not run again, and
+    the `<id>.json` files are moved to the `migrated` folder once they have been
+    imported. Nothing is deleted, so the JSON store can be restored if needed.
+    """
     log_list_file = os.path.join(directory, file_name)
 
-    if not check_if_folder_exists(directory):
-        create_folder(directory)
+    with connection:
+        # Another process may have migrated the logs while waiting for the lock
+        connection.execute("BEGIN IMMEDIATE")
+        if not check_if_file_exists(log_list_file):
+            return
 
-    # reads the log list file
-    if check_if_file_exists(log_list_file):
         with open(log_list_file, "r") as openfile:
             file_content = openfile.read().strip()
             log_ids = json.loads(file_content) if file_content else []
-    else:
-        log_ids = []
 
-    return log_ids
+        for log_file in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            log_id = os.path.basename(log_file).removesuffix(".json")
+            if log_file != log_list_file and log_id not in log_ids:
+                log_ids.append(log_id)
+
+        for log_id in log_ids:
+            log_file = os.path.join(directory, f"{log_id}.json")
+            metadata = None
+            if check_if_file_exists(log_file):
+                with open(log_file, "r") as openfile:
+                    file_content = openfile.read().strip()
+                    metadata = JobMetadata(**json.loads(file_content))
+            insert_job(connection, log_id, metadata)
+
+        os.replace(log_list_file, log_list_file + ".migrated")
+
+    create_folder(os.path.join(directory, migrated_folder))
+    for log_id in log_ids:
+        log_file = os.path.join(directory, f"{log_id}.json")
+        if check_if_file_exists(log_file):
+            os.replace(
+                log_file, os.path.join(directory, migrated_folder, f"{log_id}.json")
+            )
+
+
+def initialize_job_store(directory: str) -> str:
+    """
+    Create the job store in the directory, or migrate the JSON store, if needed.
+    This is only done once per process, unless the database file has been removed since.
+    :return: The path of the database file.
+    """
+    database_file = os.path.abspath(os.path.join(directory, database_name))
+    if database_file in _initialized_stores and check_if_file_exists(database_file):
+        return database_file
+
+    with _initialize_lock:
+        if not check_if_folder_exists(directory):
+            create_folder(directory)
+        connection = sqlite3.connect(database_file, timeout=30, isolation_level=None)
+        try:
+            # The journal mode is kept in the database file
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(schema)
+            if check_if_file_exists(os.path.join(directory, file_name)):
+                migrate_json_logs(connection, directory)
+        finally:
+            connection.close()
+        _initialized_stores.add(database_file)
+
+    return database_file
+
+
+@contextmanager
+def open_job_store(directory: str) -> Iterator[sqlite3.Connection]:
+    """
+    Open the job store in the directory, creating it, or migrating the JSON store, if needed.
+
+    The database is in WAL mode, so listing and reading jobs never waits for a job being written.
+    """
+    connection = sqlite3.connect(
+        initialize_job_store(directory), timeout=30, isolation_level=None
+    )
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def get_job_logs(
+    directory: str = "./logs",
+) -> list[str]:
+    """
+    Returns a list of job log IDs that are available, oldest first. Creates a directory for logs if one doesn't already exist.
+    """
+    with open_job_store(directory) as connection:
+        rows = connection.execute("SELECT id FROM jobs ORDER BY seq").fetchall()
+
+    return [row[0] for row in rows]
 
 
 def write_job_log(
@@ -40,34 +239,104 @@ def write_job_log(
 ) -> None:
     """
     Given a job log ID and metadata, serialize and store the metadata. Creates a directory for logs if one doesn't already exist.
+    Nothing is stored if a job log with the same ID has already been written.
+
+    Each section of the logs is compressed separately, in a file next to the job store,
+    and the store keeps an index of where each section is in the file.
     """
+    with open_job_store(directory) as connection:
+        if connection.execute("SELECT 1 FROM jobs WHERE id = ?", (id,)).fetchone():
+            return
 
-    log_file = os.path.join(directory, f"{id}.json")
-    log_list_file = os.path.join(directory, file_name)
+        index = write_sections(get_sections_path(id, directory), metadata.logs)
+        names = get_section_names(metadata)
 
-    if not check_if_folder_exists(directory):
-        create_folder(directory)
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            summary = metadata.model_copy(update={"logs": []})
+            if insert_job(connection, id, summary):
+                connection.executemany(
+                    "INSERT INTO log_sections VALUES (?, ?, ?, ?)",
+                    [
+                        (id, position, name, json.dumps(blocks))
+                        for position, (name, blocks) in enumerate(zip(names, index))
+                    ],
+                )
 
-    if check_if_file_exists(log_file):
-        # Job log has already been written
-        return
 
-    # writes the metadata to a file
-    with open(log_file, "w") as outfile:
-        json.dump(metadata.model_dump(mode="json"), outfile, indent=4)
+def list_jobs(
+    directory: str = "./logs",
+    limit: int = 50,
+    cursor: int | None = None,
+    repo: str | None = None,
+    ref: str | None = None,
+    author: str | None = None,
+    status: Status | None = None,
+    since: int | None = None,
+    until: int | None = None,
+) -> tuple[list[dict], int | None]:
+    """
+    Returns a page of the stored jobs, newest first, with the summary fields of each job.
+    :param directory: The directory of the job store.
+    :param limit: The maximum number of jobs on the page.
+    :param cursor: The cursor returned with the previous page, None for the first page.
+    :param repo: Only list jobs of the repository, given as `owner/name`.
+    :param ref: Only list jobs for the ref, e.g. `refs/heads/main`.
+    :param author: Only list jobs of pushes by the author.
+    :param status: Only list jobs with the status.
+    :param since: Only list jobs that ended at or after this Unix time.
+    :param until: Only list jobs that ended at or before this Unix time.
+    :return: The jobs on the page, and the cursor of the next page, or None if this is the last one.
+    """
+    filters = {
+        "repo = ?": repo,
+        "ref = ?": ref,
+        "author = ?": author,
+        "status = ?": status.value if status is not None else None,
+        "time_ended >= ?": since,
+        "time_ended <= ?": until,
+        "seq < ?": cursor,
+    }
+    conditions = [
+        condition for condition, value in filters.items() if value is not None
+    ]
+    values = [value for value in filters.values() if value is not None]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with open_job_store(directory) as connection:
+        # One more row than needed, to know whether there is a next page
+        rows = connection.execute(
+            f"""
+            SELECT seq, id, status, repo, ref, json_extract(metadata, '$.head_commit'),
+            author, time_started, time_ended
+            FROM jobs {where} ORDER BY seq DESC LIMIT ?
+            """,
+            values + [limit + 1],
+        ).fetchall()
 
-    # updates the log list
-    if check_if_file_exists(log_list_file):
-        with open(log_list_file, "r") as openfile:
-            file_content = openfile.read().strip()
-            log_ids = json.loads(file_content) if file_content else []
-    else:
-        log_ids = []
+    jobs = []
+    for row in rows[:limit]:
+        _, id, status_value, repo, ref, head_commit, author, started, ended = row
+        jobs.append(
+            {
+                "id": id,
+                "status": status_value,
+                "repo": repo,
+                "ref": ref,
+                "head_commit": head_commit,
+                "author": author,
+                "time_started": started,
+                "time_ended": ended,
+                "duration": (
+                    ended - started
+                    if started is not None and ended is not None
+                    else None
+                ),
+            }
+        )
 
-    if id not in log_ids:
-        log_ids.append(id)
-        with open(log_list_file, "w") as outfile:
-            json.dump(log_ids, outfile, indent=4)
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return (jobs, next_cursor)
 
 
 def read_job_log(id: str, directory: str = "./logs") -> JobMetadata:
@@ -78,14 +347,264 @@ def read_job_log(id: str, directory: str = "./logs") -> JobMetadata:
 
     Raises an exception if the log ID is not found.
     """
-    log_file = os.path.join(directory, f"{id}.json")
+    with open_job_store(directory) as connection:
+        row = connection.execute(
+            "SELECT metadata FROM jobs WHERE id = ?", (id,)
+        ).fetchone()
+        sections = connection.execute(
+            "SELECT blocks FROM log_sections WHERE job_id = ? ORDER BY position", (id,)
+        ).fetchall()
 
-    if not check_if_file_exists(log_file):
+    if row is None or row[0] is None:
         raise ValueError(f"Log ID {id} not found.")
 
-    # Read the log file
-    with open(log_file, "r") as openfile:
-        file_content = openfile.read().strip()
-        log_data = json.loads(file_content) if file_content else {}
+    metadata = JobMetadata.model_validate_json(row[0])
+    if sections:
+        # Jobs imported from the JSON store keep their logs in the metadata
+        path = get_sections_path(id, directory)
+        metadata.logs = [
+            read_section_range(path, json.loads(blocks)).decode()
+            for (blocks,) in sections
+        ]
+    return metadata
+
+
+def find_log_section(
+    id: str, name: str, directory: str = "./logs"
+) -> tuple[str, list[list[int]]] | bytes:
+    """
+    Find a section of the job's logs.
+
+    Returns the file and the index of the section, or the section itself for
+    jobs imported from the JSON store, whose logs are not compressed.
+
+    Raises an exception if the job or the section is not found.
+    """
+    with open_job_store(directory) as connection:
+        row = connection.execute(
+            "SELECT blocks FROM log_sections WHERE job_id = ? AND name = ?", (id, name)
+        ).fetchone()
+
+    if row is not None:
+        return (get_sections_path(id, directory), json.loads(row[0]))
+
+    metadata = read_job_log(id, directory)
+    for section_name, section in zip(get_section_names(metadata), metadata.logs):
+        if section_name == name:
+            return section.encode()
+    raise ValueError(f"Log section {name} of job {id} not found.")
+
+
+def read_log_section(
+    id: str,
+    name: str,
+    directory: str = "./logs",
+    start: int = 0,
+    end: int | None = None,
+) -> tuple[bytes, int]:
+    """
+    Read a range of bytes of a section of the job's logs, e.g. `test`.
+    Only the compressed blocks that overlap the range are read.
+    :param id: The ID of the job.
+    :param name: The name of the section.
+    :param directory: The directory of the job store.
+    :param start: The first byte to read.
+    :param end: The byte after the last one to read, the end of the section if None.
+    :return: The bytes in the range, and the size of the whole section.
+    :raises: Exception if the job or the section is not found.
+    """
+    section = find_log_section(id, name, directory)
+    if isinstance(section, bytes):
+        return (section[start:end], len(section))
+
+    path, blocks = section
+    return (read_section_range(path, blocks, start, end), get_section_size(blocks))
+
+
+def tail_log_section(
+    id: str, name: str, lines: int, directory: str = "./logs"
+) -> bytes:
+    """
+    Read the last lines of a section of the job's logs, e.g. `test`.
+    Only the compressed blocks at the end of the section are read.
+    :raises: Exception if the job or the section is not found.
+    """
+    section = find_log_section(id, name, directory)
+    if isinstance(section, bytes):
+        return (
+            b"".join(section.splitlines(keepends=True)[-lines:]) if lines > 0 else b""
+        )
+
+    path, blocks = section
+    return read_section_tail(path, blocks, lines)
+
+
+def check_if_job_log_exists(id: str, directory: str = "./logs") -> bool:
+    """
+    Check if the log of the job has been stored, i.e. the job has completed.
+    """
+    with open_job_store(directory) as connection:
+        row = connection.execute(
+            "SELECT 1 FROM jobs WHERE id = ? AND metadata IS NOT NULL", (id,)
+        ).fetchone()
+
+    return row is not None
+
+
+def find_cached_result(
+    tree_id: str, config_hash: str, directory: str = "./logs"
+) -> tuple[str, Status] | None:
+    """
+    Find the result of an earlier job that checked the same tree with the same CI configuration.
+    :return: The ID of the job and its status, or None if the tree has not been checked yet.
+    """
+    with open_job_store(directory) as connection:
+        row = connection.execute(
+            "SELECT job_id, status FROM results WHERE tree_id = ? AND config_hash = ?",
+            (tree_id, config_hash),
+        ).fetchone()
+
+    return (row[0], Status(row[1])) if row is not None else None
+
+
+def store_cached_result(
+    tree_id: str, config_hash: str, id: str, status: Status, directory: str = "./logs"
+) -> None:
+    """
+    Store the result of a job, so that later jobs for the same tree can reuse it.
+    Only the first result of a tree and configuration is kept.
+    """
+    with open_job_store(directory) as connection:
+        connection.execute(
+            "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)",
+            (tree_id, config_hash, id, status.value),
+        )
+
+
+def get_live_log_path(id: str, directory: str = "./logs") -> str:
+    """
+    Returns the path of the file that the output of a job is streamed to while it runs.
+    """
+    return os.path.join(directory, "live", f"{id}.log")
+
+
+def check_if_live_log_exists(id: str, directory: str = "./logs") -> bool:
+    """
+    Returns True if the job has a live log, while it runs or compressed once it has completed.
+    """
+    live_log_file = get_live_log_path(id, directory)
+    return check_if_file_exists(live_log_file) or check_if_file_exists(
+        f"{live_log_file}.gz"
+    )
+
+
+def archive_live_log(id: str, directory: str = "./logs") -> None:
+    """
+    Compress the live log of a completed job to `{id}.log.gz`, and remove the original.
+    The compressed file is in place before the original is removed, so that the output
+    of the job can be streamed at any time.
+    """
+    live_log_file = get_live_log_path(id, directory)
+    if not check_if_file_exists(live_log_file):
+        return
+
+    temp_file = f"{live_log_file}.gz.tmp"
+    with open(live_log_file, "rb") as source, gzip.open(
+        temp_file, "wb", compresslevel=6
+    ) as target:
+        shutil.copyfileobj(source, target, LIVE_LOG_CHUNK_BYTES)
+    os.replace(temp_file, f"{live_log_file}.gz")
+    os.remove(live_log_file)
+
+
+def remove_expired_live_logs(
+    directory: str = "./logs", retention_days: int = 14
+) -> None:
+    """
+    Remove the compressed live logs of the jobs that completed more than `retention_days` ago.
+    :param retention_days: The number of days to keep the live logs for, 0 keeps them forever.
+    """
+    if not retention_days:
+        return
+
+    expiry = time.time() - retention_days * 24 * 3600
+    for path in glob.glob(os.path.join(directory, "live", "*.log.gz")):
+        try:
+            if os.path.getmtime(path) < expiry:
+                os.remove(path)
+        except FileNotFoundError:
+            # Removed by another job at the same time
+            pass
+
+
+def format_event(data: str, event: str | None = None) -> str:
+    """
+    Format a line of output as a server-sent event, of the given type if any.
+
+    A carriage return is a line break in server-sent events, and progress bars, e.g. the ones
+    of git and pip, rewrite their line with one. Only the text after the last carriage return
+    is sent, the final state of the line, like in the stored logs.
+    """
+    data = data.rstrip("\r").rsplit("\r", 1)[-1]
+    field = f"event: {event}\n" if event else ""
+    return f"{field}data: {data}\n\n"
+
+
+async def tail_live_log(
+    id: str,
+    directory: str = "./logs",
+    poll_interval: float = 0.5,
+    idle_timeout: float = 900.0,
+) -> AsyncIterator[str]:
+    """
+    Yield the lines of the job's live log, including the ones written after the call.
+
+    The iteration ends once the job has completed and every line has been yielded.
+    Raises an exception if the job has no live log, e.g. because it has not started yet.
+    Raises a TimeoutError if the live log of a job that has not completed has not changed
+    for `idle_timeout` seconds, e.g. because the process running the job died.
+    The job store and the file are read in a thread, so that the event loop is never blocked,
+    and in chunks, so that a large log is never held in memory. A line longer than a chunk
+    is yielded in pieces.
+    """
+    live_log_file = get_live_log_path(id, directory)
+
+    try:
+        openfile = await asyncio.to_thread(open, live_log_file, "rb")
+    except FileNotFoundError:
+        # The live log of a completed job is compressed
+        try:
+            openfile = await asyncio.to_thread(gzip.open, f"{live_log_file}.gz", "rb")
+        except FileNotFoundError:
+            raise ValueError(f"Live log for job {id} not found.")
+
+    with openfile:
+        partial_line = b""
+        while True:
+            # Check before reading, so that no line written before completion is missed
+            completed = await asyncio.to_thread(check_if_job_log_exists, id, directory)
+
+            while chunk := await asyncio.to_thread(openfile.read, LIVE_LOG_CHUNK_BYTES):
+                lines = (partial_line + chunk).split(b"\n")
+                # The rest of the last line has not been written yet
+                partial_line = lines.pop()
+                if len(partial_line) >= LIVE_LOG_CHUNK_BYTES:
+                    lines.append(partial_line)
+                    partial_line = b""
+                for line in lines:
+                    yield line.decode(errors="replace")
+
+            if completed:
+                if partial_line:
+                    yield partial_line.decode(errors="replace")
+                return
 
-    return JobMetadata(**log_data)
+            # The job of a process that died never completes, its live log stops changing
+            idle = time.time() - os.fstat(openfile.fileno()).st_mtime
+            if idle > idle_timeout:
+                if partial_line:
+                    yield partial_line.decode(errors="replace")
+                raise TimeoutError(
+                    f"The live log of job {id} has not changed for {int(idle)} seconds, the job may have been interrupted."
+                )
+            await asyncio.sleep(poll_interval)
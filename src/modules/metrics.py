@@ -0,0 +1,211 @@
+import abc
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# The Prometheus text exposition format, see https://prometheus.io/docs/instrumenting/exposition_formats/
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, from a quick checkout to a slow dependency installation
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric(abc.ABC):
+    """
+    A metric with a value for every combination of its labels, e.g. one per stage.
+    Its subclasses are the types of metrics, which render their own samples.
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        register: bool = True,
+    ):
+        """
+        :param name: The name of the metric, e.g. `ci_jobs_total`.
+        :param help: The description of the metric.
+        :param labels: The names of the labels of the metric.
+        :param register: Add the metric to the ones returned by `/metrics`.
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if register:
+            registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"The labels of {self.name} are {self.labels}.")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> list[str]:
+        """
+        Returns the lines of the samples of the metric, one per combination of its labels.
+        """
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples()) + "\n"
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. the number of completed jobs.
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, e.g. the number of running jobs.
+    """
+
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values in buckets, e.g. the durations of a stage.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        register: bool = True,
+    ):
+        """
+        :param buckets: The upper bounds of the buckets, `+Inf` is added.
+        """
+        super().__init__(name, help, labels, register)
+        self.buckets = (*sorted(buckets), math.inf)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted((key, (list(c), t)) for key, (c, t) in self._values.items())
+
+        lines = []
+        for key, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                labels = format_labels(
+                    (*self.labels, "le"), (*key, format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+registry: list[Metric] = []
+
+
+def render_metrics() -> str:
+    """
+    Returns every metric in the Prometheus text format.
+    """
+    return "".join(metric.render() for metric in registry)
+
+
+@contextmanager
+def time_stage(durations: dict[str, float], name: str) -> Iterator[None]:
+    """
+    Measure how long the `with` block takes, and store it in `durations` under `name`.
+    The duration is stored even if the block raises.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        durations[name] = time.perf_counter() - started
+
+
+stage_duration = Histogram(
+    "ci_stage_duration_seconds", "How long each stage of a job took.", ("stage",)
+)
+job_duration = Histogram(
+    "ci_job_duration_seconds",
+    "How long jobs took from start to end, by final status.",
+    ("status",),
+)
+queue_wait_duration = Histogram(
+    "ci_queue_wait_seconds",
+    "How long jobs waited in the queue before they started, by priority class.",
+    ("priority",),
+)
+queue_depth = Gauge("ci_queue_depth", "The number of jobs waiting in the queue.")
+running_jobs = Gauge("ci_running_jobs", "The number of jobs that are running.")
+cache_lookups = Counter(
+    "ci_cache_lookups_total",
+    "Lookups in the caches of the server, by cache and whether they hit.",
+    ("cache", "result"),
+)
+status_post_duration = Histogram(
+    "ci_status_post_duration_seconds",
+    "How long requests to post a commit status to GitHub took, by outcome.",
+    ("result",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+status_outbox_size = Gauge(
+    "ci_status_outbox_size", "The number of commit statuses waiting to be sent."
+)
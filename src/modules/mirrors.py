@@ -0,0 +1,121 @@
+import fcntl
+import hashlib
+import os
+from src.modules.cache import evict_entries, lock_entry, mark_entry_used
+from src.modules.git import get_repo_name, run_git
+from src.modules.metrics import cache_lookups
+from src.modules.processes import ProcessGroup
+from src.modules.utils import check_if_folder_exists, create_folder, remove_folder
+
+
+def get_mirror_path(url: str, cache_folder: str) -> str:
+    """
+    Returns the path of the mirror for the given clone URL.
+
+    Mirrors are keyed by a hash of the URL, the repository name is only kept for readability.
+    """
+    name = get_repo_name(url)
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return os.path.join(os.path.abspath(cache_folder), f"{name}-{key}.git")
+
+
+def update_mirror(url: str, mirror_path: str, group: ProcessGroup | None = None) -> str:
+    """
+    Create or update the bare mirror of the repository.
+    Only objects that are not in the mirror yet are downloaded.
+    The caller must hold an exclusive lock on the mirror.
+    :param url: The clone URL of the repository.
+    :param mirror_path: The path of the mirror.
+    :param group: The process group to run git in.
+    :return: The CLI logs from the fetch.
+    :raises: Exception if the fetch fails.
+    """
+    logs = ""
+    created = not check_if_folder_exists(mirror_path)
+
+    if created:
+        create_folder(mirror_path)
+        run_git(["init", "--bare", "--quiet"], mirror_path)
+        run_git(["remote", "add", "origin", url], mirror_path)
+        # Only branches and tags are mirrored, e.g. GitHub's pull request refs are not
+        run_git(
+            ["config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"],
+            mirror_path,
+        )
+        run_git(
+            ["config", "--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*"],
+            mirror_path,
+        )
+        logs += f"Created a mirror of {url}.\n"
+
+    try:
+        logs += run_git(["fetch", "--prune", "origin"], mirror_path, group)
+        # Point HEAD at the remote's default branch, so workspaces check it out
+        symref = run_git(
+            ["ls-remote", "--symref", "origin", "HEAD"], mirror_path, group
+        )
+        if symref.startswith("ref: "):
+            head = symref.split()[1]
+            run_git(["symbolic-ref", "HEAD", head], mirror_path)
+    except Exception:
+        # A mirror that never completed its first fetch is useless, start over next time
+        if created:
+            remove_folder(mirror_path)
+        raise
+
+    mark_entry_used(mirror_path)
+    return logs
+
+
+def evict_mirrors(
+    cache_folder: str, max_bytes: int, keep: str | None = None
+) -> list[str]:
+    """
+    Remove the least recently used mirrors until the cache fits in `max_bytes`.
+
+    Mirrors that are locked by a running job, and the mirror at `keep`, are never evicted.
+    :return: The paths of the evicted mirrors.
+    """
+    return evict_entries(cache_folder, ".git", max_bytes, keep)
+
+
+def clone_from_mirror(
+    url: str,
+    destination: str,
+    cache_folder: str,
+    max_bytes: int | None = None,
+    group: ProcessGroup | None = None,
+) -> str:
+    """
+    Clone the repository into the destination folder through the local mirror cache.
+
+    The mirror is fetched first, and the workspace is then cloned from it with
+    hardlinked objects, so it stays valid even if the mirror is evicted later on.
+    :param url: The URL of the repository to clone.
+    :param destination: The folder to clone the repository into.
+    :param cache_folder: The folder that holds the mirrors.
+    :param max_bytes: The size budget of the mirror cache, no eviction if not given.
+    :param group: The process group to run git in.
+    :return: The CLI logs from the fetching and cloning process.
+    :raises: Exception if the fetch or the clone fails.
+    """
+    create_folder(cache_folder)
+    mirror_path = get_mirror_path(url, cache_folder)
+    repo_name = get_repo_name(url)
+
+    with lock_entry(mirror_path) as fd:
+        hit = check_if_folder_exists(mirror_path)
+        cache_lookups.inc(cache="mirror", result="hit" if hit else "miss")
+        logs = update_mirror(url, mirror_path, group)
+        # Other jobs may clone from the mirror at the same time, but not update it
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        logs += run_git(["clone", mirror_path, repo_name], destination, group)
+
+    # Fetches from within the workspace should still go to the real remote
+    run_git(["remote", "set-url", "origin", url], os.path.join(destination, repo_name))
+
+    if max_bytes is not None:
+        for mirror in evict_mirrors(cache_folder, max_bytes, keep=mirror_path):
+            logs += f"Evicted the mirror {mirror} from the cache.\n"
+
+    return logs
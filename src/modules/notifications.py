@@ -1,12 +1,50 @@
+from src.modules.config import GITHUB_API_URL, GITHUB_BURST, GITHUB_RATE_LIMIT
+from src.modules.rate_limit import RateLimiter
 from src.modules.types import Status
+from collections import OrderedDict
 from fastapi import HTTPException
+from requests.adapters import HTTPAdapter
 import requests
 import os
+import threading
 from dotenv import load_dotenv
 
 # normally this is loaded in main.py, but we need it here for the tests
 load_dotenv()
 
+# Seconds to wait for GitHub to connect and to respond, so that a slow API cannot stall a worker
+REQUEST_TIMEOUT = (5, 30)
+
+# The context of the statuses that the CI server posts, a commit has one status per context
+STATUS_CONTEXT = "custom-ci/lint-and-test"
+
+# Shared by every request to the GitHub API, so that together they stay under the quota
+rate_limiter = RateLimiter(GITHUB_RATE_LIMIT / 3600, GITHUB_BURST)
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+# The ETag and state of the latest statuses read, by URL, the least recently used first
+_status_cache: OrderedDict[str, tuple[str, str]] = OrderedDict()
+_status_cache_size = 1024
+_status_cache_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by the requests to the GitHub API.
+
+    The session keeps its connections alive, so that consecutive requests
+    do not each pay for a new TCP and TLS handshake.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount("https://", HTTPAdapter(pool_maxsize=10))
+            _session.mount("http://", HTTPAdapter(pool_maxsize=10))
+        return _session
+
 
 def add_commit_status(
     owner: str,
@@ -14,6 +52,10 @@ def add_commit_status(
     sha: str,
     state: Status,
     id: str,
+    api_url: str = GITHUB_API_URL,
+    session: requests.Session | None = None,
+    context: str = STATUS_CONTEXT,
+    limiter: RateLimiter | None = None,
 ) -> None:
     """
     Add a new commit status.
@@ -21,10 +63,16 @@ def add_commit_status(
     :param owner: The account owner of the repository. The name is not case sensitive.
     :param repo: The name of the repository without the `.git` extension. The name is not case sensitive.
     :param sha: The SHA of the commit.
-    :param state: The state of the status. Can be one of `success`, `failure`, `pending`, or `error`.
+    :param state: The state of the status. Can be one of `success`, `failure`, `pending`, `error`, or `cancelled`, which is posted as `error`.
     :param id: The unique ID of the job.
+    :param api_url: The base URL of the GitHub API.
+    :param session: The HTTP session to send the request with, the shared one if not given.
+    :param context: The context of the status, a commit has one status per context.
+    :param limiter: The rate limiter to pace the request with, the shared one if not given.
+    :raises: ValueError if the token is not set, HTTPException if GitHub rejects the status.
+    :raises: requests.RequestException if GitHub cannot be reached.
     """
-    url = f"https://api.github.com/repos/{owner}/{repo}/statuses/{sha}"
+    url = f"{api_url}/repos/{owner}/{repo}/statuses/{sha}"
 
     GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
     if not GITHUB_TOKEN:
@@ -35,31 +83,55 @@ def add_commit_status(
         "Accept": "application/vnd.github.v3+json",
     }
     payload = {
-        "state": state.value,
-        "description": "Custom CI/CD job was ran. Job details and logs can be viewed in the URL.",
-        "context": "custom-ci/lint-and-test",
+        # GitHub has no cancelled state, the job did not complete so it is reported as an error
+        "state": Status.ERROR.value if state == Status.CANCELLED else state.value,
+        "description": (
+            "Custom CI/CD job was cancelled, a newer push superseded it."
+            if state == Status.CANCELLED
+            else "Custom CI/CD job was ran. Job details and logs can be viewed in the URL."
+        ),
+        "context": context,
         "target_url": f"https://secretly-native-ant.ngrok-free.app/logs/{id}",
     }
-    response = requests.post(url, headers=headers, json=payload)
+    limiter = limiter or rate_limiter
+    limiter.acquire()
+    response = (session or get_session()).post(
+        url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT
+    )
+    limiter.update(response.headers)
 
     if response.status_code != 201:
         err = HTTPException(
             status_code=response.status_code, detail="Failed to update commit status."
         )
-        err.add_note(response.json())
+        err.add_note(response.text)
         raise err
 
 
-def get_commit_status(owner: str, repo: str, ref: str) -> Status:
+def get_commit_status(
+    owner: str,
+    repo: str,
+    ref: str,
+    api_url: str = GITHUB_API_URL,
+    session: requests.Session | None = None,
+    limiter: RateLimiter | None = None,
+) -> Status:
     """
     Get the latest commit status for a given repository and commit reference.
 
     :param owner: The account owner of the repository. The name is not case sensitive.
     :param repo: The name of the repository without the `.git` extension. The name is not case sensitive.
     :param ref: The commit reference. Can be a commit SHA, branch name (`heads/BRANCH_NAME`), or tag name (`tags/TAG_NAME`). For more information, see "Git References" in the Git documentation.
+    :param api_url: The base URL of the GitHub API.
+    :param session: The HTTP session to send the request with, the shared one if not given.
+    :param limiter: The rate limiter to pace the request with, the shared one if not given.
+
+    The request is conditional on the ETag of the previous response for the same
+    commit, so that an unchanged status is not downloaded again, and does not count
+    against the rate limit.
     """
 
-    url = f"https://api.github.com/repos/{owner}/{repo}/commits/{ref}/status"
+    url = f"{api_url}/repos/{owner}/{repo}/commits/{ref}/status"
 
     GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
     if not GITHUB_TOKEN:
@@ -70,15 +142,37 @@ def get_commit_status(owner: str, repo: str, ref: str) -> Status:
         "Accept": "application/vnd.github.v3+json",
     }
 
-    response = requests.get(url, headers=headers)
+    with _status_cache_lock:
+        cached = _status_cache.get(url)
+    if cached is not None:
+        headers["If-None-Match"] = cached[0]
+
+    limiter = limiter or rate_limiter
+    limiter.acquire()
+    response = (session or get_session()).get(
+        url, headers=headers, timeout=REQUEST_TIMEOUT
+    )
+    limiter.update(response.headers)
+
+    if response.status_code == 304 and cached is not None:
+        with _status_cache_lock:
+            _status_cache.move_to_end(url)
+        return cached[1]
 
     if response.status_code != 200:
         err = HTTPException(
             status_code=response.status_code, detail="Failed to get commit status."
         )
-        err.add_note(response.json())
+        err.add_note(response.text)
         raise err
 
     status = response.json()["state"]
 
+    if response.headers.get("ETag"):
+        with _status_cache_lock:
+            _status_cache[url] = (response.headers["ETag"], status)
+            _status_cache.move_to_end(url)
+            if len(_status_cache) > _status_cache_size:
+                _status_cache.popitem(last=False)
+
     return status
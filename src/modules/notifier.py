@@ -0,0 +1,315 @@
+import logging
+import os
+import random
+import requests
+import sqlite3
+import threading
+import time
+from uuid import uuid4
+from contextlib import closing
+from fastapi import HTTPException
+from src.modules.config import GITHUB_API_URL
+from src.modules.metrics import status_post_duration
+from src.modules.notifications import (
+    STATUS_CONTEXT,
+    add_commit_status,
+    get_session,
+    rate_limiter,
+)
+from src.modules.rate_limit import RateLimiter
+from src.modules.types import Status
+from src.modules.utils import create_folder
+
+schema = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    context TEXT NOT NULL,
+    state TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claim_expires REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_commit ON outbox (owner, repo, sha, seq);
+"""
+
+# The columns added to the outbox since it was created, for the outboxes of earlier versions
+migrations = {
+    "claimed_by": "ALTER TABLE outbox ADD COLUMN claimed_by TEXT",
+    "claim_expires": "ALTER TABLE outbox ADD COLUMN claim_expires REAL",
+}
+
+# Responses that will not change by sending the same status again
+permanent_failures = {400, 401, 404, 410, 422}
+
+
+class StatusNotifier:
+    """
+    Sends commit statuses to GitHub from a background thread, off the path of the jobs.
+
+    Statuses are first stored in a durable outbox, so that they survive a restart
+    of the server, and are only removed once GitHub has accepted them. Failed
+    statuses are retried with exponential backoff. The statuses of a commit are
+    always sent in the order they were added, e.g. `pending` before `success`.
+
+    Requests are paced by the rate limiter shared with the other requests to GitHub.
+    A status that is added while an older one of the same commit and context is
+    still waiting replaces it, as only the latest one would be shown anyway.
+
+    Several processes may share an outbox, e.g. the runners of a node. A status is
+    claimed in the outbox before it is sent, so that it is sent by one process only,
+    and is not replaced while it is being sent. The claim of a process that died
+    expires after `claim_lease` seconds.
+    """
+
+    def __init__(
+        self,
+        outbox_file: str,
+        api_url: str = GITHUB_API_URL,
+        max_attempts: int = 10,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        limiter: RateLimiter = rate_limiter,
+        claim_lease: float = 60.0,
+    ):
+        """
+        :param outbox_file: The SQLite file of the outbox, created if it does not exist.
+        :param api_url: The base URL of the GitHub API.
+        :param max_attempts: The number of times a status is sent before it is dropped.
+        :param base_delay: The seconds to wait before the first retry, doubled for every retry after it.
+        :param max_delay: The maximum number of seconds to wait between retries.
+        :param limiter: The rate limiter of the requests to GitHub.
+        :param claim_lease: The seconds a status stays claimed by the process sending it.
+        """
+        self.outbox_file = outbox_file
+        self.api_url = api_url
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = limiter
+        self.claim_lease = claim_lease
+        # Identifies the statuses claimed by this notifier in the shared outbox
+        self.name = str(uuid4())
+
+        self._condition = threading.Condition()
+        self._worker: threading.Thread | None = None
+        self._stopping = False
+        # Set when a status is added, so that the worker does not sleep past it
+        self._added = False
+
+        create_folder(os.path.dirname(os.path.abspath(outbox_file)))
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(schema)
+            columns = {
+                row[1] for row in connection.execute("PRAGMA table_info(outbox)")
+            }
+            for column, statement in migrations.items():
+                if column not in columns:
+                    connection.execute(statement)
+
+    def start(self) -> None:
+        """
+        Start sending the statuses in the outbox, including the ones left from a previous run.
+        Calling this on a started notifier does nothing.
+        """
+        with self._condition:
+            if self._worker is not None:
+                return
+            self._stopping = False
+            self._worker = threading.Thread(
+                target=self._work, name="status-notifier", daemon=True
+            )
+            self._worker.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Stop the background thread once the status being sent is done.
+        The statuses still in the outbox are sent after the next start.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            worker = self._worker
+            self._worker = None
+
+        if worker is not None:
+            worker.join(timeout)
+
+    def notify(
+        self,
+        owner: str,
+        repo: str,
+        sha: str,
+        state: Status,
+        id: str,
+        context: str = STATUS_CONTEXT,
+    ) -> None:
+        """
+        Add a commit status to the outbox. It is sent in the background, this does not wait for GitHub.
+        The older statuses of the commit and context that are still waiting are dropped,
+        unless a process is sending them.
+        The parameters are the ones of `add_commit_status`.
+        """
+        with self._condition:
+            with closing(self._connect()) as connection, connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute(
+                    """
+                    DELETE FROM outbox
+                    WHERE owner = ? AND repo = ? AND sha = ? AND context = ?
+                    AND (claimed_by IS NULL OR claim_expires < ?)
+                    """,
+                    (owner, repo, sha, context, time.time()),
+                )
+                connection.execute(
+                    """
+                    INSERT INTO outbox (owner, repo, sha, context, state, job_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (owner, repo, sha, context, state.value, id),
+                )
+            self._added = True
+            self._condition.notify_all()
+
+    def pending(self) -> int:
+        """
+        Returns the number of statuses in the outbox.
+        """
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def flush(self, timeout: float) -> bool:
+        """
+        Wait for the outbox to be empty.
+        :return: False if there were still statuses in the outbox after the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while self.pending():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.outbox_file, timeout=30, isolation_level=None)
+
+    def _next_entry(self) -> tuple | None:
+        # Only the oldest status of each commit may be sent, the others wait for it,
+        # also while another process is sending it
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                """
+                SELECT seq, owner, repo, sha, context, state, job_id, attempts, next_attempt
+                FROM outbox AS entry
+                WHERE seq = (
+                    SELECT MIN(seq) FROM outbox
+                    WHERE owner = entry.owner AND repo = entry.repo AND sha = entry.sha
+                )
+                AND (claimed_by IS NULL OR claim_expires < ?)
+                ORDER BY next_attempt, seq LIMIT 1
+                """,
+                (time.time(),),
+            ).fetchone()
+
+    def _claim(self, seq: int) -> bool:
+        """
+        Claim a status before sending it, so that no other process sends or replaces it.
+        :return: False if the status was replaced, or claimed by another process, since it was read.
+        """
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                """
+                UPDATE outbox SET claimed_by = ?, claim_expires = ?
+                WHERE seq = ? AND (claimed_by IS NULL OR claim_expires < ?)
+                RETURNING seq
+                """,
+                (self.name, now + self.claim_lease, seq, now),
+            ).fetchone()
+        return row is not None
+
+    def _work(self) -> None:
+        session = get_session()
+
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                self._added = False
+            entry = self._next_entry()
+
+            if entry is None or entry[-1] > time.time():
+                delay = None if entry is None else entry[-1] - time.time()
+            else:
+                # While throttled, newer statuses may still replace this one
+                delay = self.limiter.wait_time() or None
+                if delay is None:
+                    with self._condition:
+                        if self._added:
+                            continue
+                    if self._claim(entry[0]):
+                        self._send(entry, session)
+                    continue
+
+            with self._condition:
+                if not self._stopping and not self._added:
+                    self._condition.wait(delay)
+
+    def _send(self, entry: tuple, session: requests.Session) -> None:
+        seq, owner, repo, sha, context, state, id, attempts, _ = entry
+        started = time.perf_counter()
+        try:
+            add_commit_status(
+                owner,
+                repo,
+                sha,
+                Status(state),
+                id,
+                self.api_url,
+                session,
+                context,
+                self.limiter,
+            )
+        except Exception as e:
+            status_post_duration.observe(
+                time.perf_counter() - started, result="failure"
+            )
+            attempts += 1
+            permanent = (
+                isinstance(e, HTTPException) and e.status_code in permanent_failures
+            )
+            if permanent or attempts >= self.max_attempts:
+                logging.error(
+                    f"[{id}] Dropped the {state} status of commit {sha} after {attempts} attempts: {e}"
+                )
+                self._remove(seq)
+                return
+
+            delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+            # Jitter, so that statuses that failed together are not retried together
+            delay *= random.uniform(0.5, 1.0)
+            logging.warning(
+                f"[{id}] Failed to send the {state} status of commit {sha}, retrying in {delay:.1f}s: {e}"
+            )
+            with closing(self._connect()) as connection:
+                connection.execute(
+                    """
+                    UPDATE outbox SET attempts = ?, next_attempt = ?, claimed_by = NULL
+                    WHERE seq = ?
+                    """,
+                    (attempts, time.time() + delay, seq),
+                )
+            return
+
+        status_post_duration.observe(time.perf_counter() - started, result="success")
+        self._remove(seq)
+
+    def _remove(self, seq: int) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
@@ -0,0 +1,419 @@
+import asyncio
+import codecs
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from src.modules.config import OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES
+from src.modules.utils import create_folder
+
+# The most output that is read from a command at once
+CHUNK_BYTES = 64 * 1024
+
+
+class JobCancelledError(Exception):
+    """
+    Raised when a command is run in, or was killed by, a cancelled process group.
+    """
+
+
+class StageTimeoutError(Exception):
+    """
+    Raised when a command runs for longer than the timeout of its stage. The command is killed.
+    """
+
+
+class LiveLog:
+    """
+    An append-only file that the output of a job's commands is written to as it is produced.
+    """
+
+    def __init__(self, path: str):
+        create_folder(os.path.dirname(os.path.abspath(path)))
+        self.path = path
+        self._file = open(path, "ab", buffering=0)
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes) -> None:
+        """
+        Append the data to the file. Writes from different threads are never interleaved.
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(data)
+
+    def write_line(self, message: str) -> None:
+        """
+        Append a line of text to the file, e.g. to mark the start of a stage.
+        """
+        self.write((message + "\n").encode())
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class OutputBuffer:
+    """
+    The captured output of a command, in bounded memory.
+
+    Only the first `head_bytes` and the last `tail_bytes` of the output are kept,
+    the output in between is replaced by a marker that says how much was left out.
+    The cuts are made on UTF-8 character boundaries, so that the captured output
+    still decodes. The whole output is kept if it fits, byte for byte.
+
+    With a live log, all of the output is also appended to it, so that it is kept in
+    full on disk. Lines are written whole where possible, so that the lines of
+    stdout and stderr do not interleave.
+    """
+
+    def __init__(
+        self,
+        live_log: LiveLog | None = None,
+        head_bytes: int | None = OUTPUT_HEAD_BYTES,
+        tail_bytes: int = OUTPUT_TAIL_BYTES,
+    ):
+        """
+        :param live_log: The live log to append the output to.
+        :param head_bytes: The number of bytes kept from the start of the output, the whole output is kept if None.
+        :param tail_bytes: The number of bytes kept from the end of the output.
+        """
+        self.live_log = live_log
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.size = 0
+
+        self._head = bytearray()
+        self._tail: deque[bytes] = deque()
+        self._tail_size = 0
+        self._partial_line = b""
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.live_log is not None:
+            self._write_lines(data)
+
+        if self.head_bytes is None:
+            self._head += data
+            return
+
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if not data:
+            return
+        self._tail.append(data)
+        self._tail_size += len(data)
+        # Keep whole chunks, as long as they are not needed for the tail
+        while self._tail and self._tail_size - len(self._tail[0]) >= self.tail_bytes:
+            self._tail_size -= len(self._tail.popleft())
+
+    def _write_lines(self, data: bytes) -> None:
+        data = self._partial_line + data
+        end = data.rfind(b"\n") + 1
+        # A line longer than a chunk is written in parts, so that it is not held in memory
+        if not end and len(data) >= CHUNK_BYTES:
+            end = len(data)
+        self.live_log.write(data[:end])
+        self._partial_line = data[end:]
+
+    def close(self) -> None:
+        """
+        Write the end of the last line to the live log, once the output has ended.
+        """
+        if self.live_log is not None and self._partial_line:
+            self.live_log.write(self._partial_line)
+        self._partial_line = b""
+
+    @property
+    def truncated(self) -> int:
+        """
+        The number of bytes of the output that were left out.
+        """
+        return self.size - len(self._head) - min(self._tail_size, self.tail_bytes)
+
+    def getvalue(self) -> bytes:
+        """
+        Returns the captured output, with a marker in place of the bytes that were left out.
+        """
+        tail = b"".join(self._tail)[-self.tail_bytes :] if self.tail_bytes else b""
+        if not self.truncated:
+            return bytes(self._head) + tail
+
+        # The head may end, and the tail start, in the middle of a character
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        head = decoder.decode(self._head)
+        # The bytes of a character cut at the end of the head are held by the decoder
+        skipped = len(decoder.getstate()[0])
+        start = 0
+        while start < min(3, len(tail)) and tail[start] & 0xC0 == 0x80:
+            start += 1
+        where = (
+            f", the full output is in {self.live_log.path}, gzipped once the job has completed"
+            if self.live_log
+            else ""
+        )
+        marker = f"\n[... {self.truncated + skipped + start} bytes of output truncated{where} ...]\n"
+        return (head + marker + tail[start:].decode(errors="replace")).encode()
+
+
+class ProcessGroup:
+    """
+    The subprocesses started for a job (or a part of it), so that they can be killed together.
+
+    Every command is started in its own session, so cancelling the group also kills
+    the processes that the command spawned itself, e.g. the test runner under a shell.
+    Cancelling a group cancels its children as well.
+
+    If the group has a live log, the output of its commands is appended to it line
+    by line while they run. Children write to the live log of their parent.
+
+    With a timeout, e.g. the one of a stage, the commands of the group are killed
+    once that many seconds have passed since the group was created. Children
+    are bound by the timeout of their parent as well.
+    """
+
+    def __init__(
+        self,
+        parent: "ProcessGroup | None" = None,
+        live_log: LiveLog | None = None,
+        timeout: float | None = None,
+    ):
+        self.cancelled = False
+        self.live_log = live_log
+        self.timeout = timeout
+        # The time.monotonic() at which the commands of the group are killed
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self._processes: set[subprocess.Popen] = set()
+        self._children: list[ProcessGroup] = []
+        self._lock = threading.Lock()
+
+        if parent is not None:
+            with parent._lock:
+                parent._children.append(self)
+                self.cancelled = parent.cancelled
+            self.live_log = live_log or parent.live_log
+            if parent.deadline is not None and (
+                self.deadline is None or parent.deadline < self.deadline
+            ):
+                self.timeout = parent.timeout
+                self.deadline = parent.deadline
+
+    def child(self, timeout: float | None = None) -> "ProcessGroup":
+        """
+        Create a group that is cancelled together with this one, but not the other way around.
+        :param timeout: The number of seconds the commands of the child may run for, in total.
+        """
+        return ProcessGroup(self, timeout=timeout)
+
+    def cancel(self) -> None:
+        """
+        Kill every running process in the group, and refuse to start new ones.
+        """
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+            children = list(self._children)
+
+        for process in processes:
+            kill_session(process.pid)
+
+        for child in children:
+            child.cancel()
+
+    def run(
+        self,
+        command: str | list[str],
+        cwd: str | None = None,
+        shell: bool = False,
+        env: dict | None = None,
+        bounded: bool = True,
+    ) -> subprocess.CompletedProcess:
+        """
+        Run the command in the group and wait for it to complete.
+        :param command: The command to run, a string if `shell` is set.
+        :param cwd: The folder to run the command in.
+        :param shell: Run the command through the shell.
+        :param env: The environment variables of the command.
+        :param bounded: Only capture the start and the end of long output, see `OutputBuffer`.
+        Commands whose output is parsed should capture all of it.
+        :return: The completed process, with the output captured as bytes.
+        :raises: JobCancelledError if the group is, or gets, cancelled.
+        :raises: StageTimeoutError if the timeout of the group is reached.
+        """
+        with self._lock:
+            if self.cancelled:
+                raise JobCancelledError("The job was cancelled.")
+            if self._remaining() == 0:
+                raise self._timeout_error(command)
+            process = subprocess.Popen(
+                command,
+                cwd=cwd,
+                shell=shell,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+            self._processes.add(process)
+
+        try:
+            stdout, stderr, timed_out = self._capture(process, bounded)
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+
+        if self.cancelled:
+            raise JobCancelledError("The job was cancelled.")
+        if timed_out:
+            raise self._timeout_error(command)
+
+        return subprocess.CompletedProcess(
+            process.args, process.returncode, stdout, stderr
+        )
+
+    def _remaining(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def _timeout_error(self, command: str | list[str]) -> StageTimeoutError:
+        program = command if isinstance(command, str) else command[0]
+        return StageTimeoutError(
+            f"{program.strip().split()[0]} was killed, the stage did not complete within {self.timeout} seconds."
+        )
+
+    def _capture(
+        self, process: subprocess.Popen, bounded: bool
+    ) -> tuple[bytes, bytes, bool]:
+        """
+        Wait for the process, capturing its output and copying it to the live log as it comes.
+        :return: The output of the process, and whether it was killed for reaching the timeout.
+        """
+        head_bytes = OUTPUT_HEAD_BYTES if bounded else None
+        stdout = OutputBuffer(self.live_log, head_bytes, OUTPUT_TAIL_BYTES)
+        stderr = OutputBuffer(self.live_log, head_bytes, OUTPUT_TAIL_BYTES)
+
+        def read(pipe, output: OutputBuffer) -> None:
+            for chunk in iter(lambda: pipe.read1(CHUNK_BYTES), b""):
+                output.write(chunk)
+            output.close()
+            pipe.close()
+
+        readers = [
+            threading.Thread(target=read, args=(process.stdout, stdout)),
+            threading.Thread(target=read, args=(process.stderr, stderr)),
+        ]
+        for reader in readers:
+            reader.start()
+
+        # The output ends once the processes that the command spawned have exited too
+        timed_out = False
+        try:
+            process.wait(self._remaining())
+            for reader in readers:
+                reader.join(self._remaining())
+            timed_out = any(reader.is_alive() for reader in readers)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+        if timed_out:
+            kill_session(process.pid)
+
+        for reader in readers:
+            reader.join()
+        process.wait()
+
+        return stdout.getvalue(), stderr.getvalue(), timed_out
+
+
+def kill_session(pid: int) -> None:
+    """
+    Kill the session of a command started with `start_new_session`, i.e. the command
+    and the processes it spawned.
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_command(
+    command: str | list[str],
+    cwd: str | None = None,
+    shell: bool = False,
+    env: dict | None = None,
+    group: ProcessGroup | None = None,
+    bounded: bool = True,
+) -> subprocess.CompletedProcess:
+    """
+    Run the command and capture its output, in the process group if one is given.
+    :param bounded: Only capture the start and the end of long output, see `OutputBuffer`.
+    :return: The completed process, with the output captured as bytes.
+    :raises: JobCancelledError if the group is, or gets, cancelled.
+    """
+    return (group or ProcessGroup()).run(command, cwd, shell, env, bounded)
+
+
+async def run_command_async(
+    command: list[str],
+    cwd: str | None = None,
+    env: dict | None = None,
+    timeout: float | None = None,
+    live_log: LiveLog | None = None,
+) -> subprocess.CompletedProcess:
+    """
+    Run the command as an asyncio subprocess, without a shell, and capture its output.
+
+    Unlike `run_command`, waiting for the command does not hold a thread, so a single
+    event loop can supervise many commands at once. The command is started in its own
+    session, and if it times out or the awaiting task is cancelled, it is killed together
+    with the processes it spawned.
+    :param command: The program and its arguments.
+    :param cwd: The folder to run the command in.
+    :param env: The environment variables of the command.
+    :param timeout: The number of seconds the command may run, no limit if None.
+    :param live_log: The live log to append the output to while the command runs.
+    :return: The completed process, with the start and the end of the output captured as bytes.
+    :raises: StageTimeoutError if the command timed out.
+    :raises: asyncio.CancelledError if the awaiting task was cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        cwd=cwd,
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    stdout = OutputBuffer(live_log, OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES)
+    stderr = OutputBuffer(live_log, OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES)
+
+    async def read(stream: asyncio.StreamReader, output: OutputBuffer) -> None:
+        while chunk := await stream.read(CHUNK_BYTES):
+            output.write(chunk)
+        output.close()
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(
+                read(process.stdout, stdout),
+                read(process.stderr, stderr),
+                process.wait(),
+            ),
+            timeout,
+        )
+    except BaseException as e:
+        kill_session(process.pid)
+        await process.wait()
+        if isinstance(e, TimeoutError):
+            raise StageTimeoutError(
+                f"{command[0]} did not complete within {timeout} seconds."
+            ) from None
+        raise
+
+    return subprocess.CompletedProcess(
+        command, process.returncode, stdout.getvalue(), stderr.getvalue()
+    )
@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Mapping
+
+
+class RateLimiter:
+    """
+    A token bucket that keeps the requests to an API under its rate limit.
+
+    Tokens are added at `rate` per second, up to `burst` of them, and every
+    request takes one. The bucket also follows the rate limit headers of the
+    API's responses. The remaining quota is spread over the time left until it
+    resets, and no request is made while the quota is exhausted, or during a
+    `Retry-After`.
+    """
+
+    def __init__(self, rate: float, burst: int = 10):
+        """
+        :param rate: The number of requests per second, on average.
+        :param burst: The number of requests that may be made at once after a quiet period.
+        """
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        # The rate that spreads the remaining quota until it resets, if the API reported one
+        self._quota_rate: float | None = None
+        self._quota_reset = 0.0
+        self._lock = threading.Lock()
+
+    def _current_rate(self, now: float) -> float:
+        if self._quota_rate is not None and now < self._quota_reset:
+            return min(self.rate, self._quota_rate)
+        return self.rate
+
+    def _refill(self, now: float) -> None:
+        rate = self._current_rate(now)
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+    def _wait_time(self, now: float) -> float:
+        self._refill(now)
+        wait = max(self._blocked_until - now, 0.0)
+        if self._tokens < 1:
+            rate = self._current_rate(now)
+            # With no quota left, the next token comes with the reset
+            refill = (1 - self._tokens) / rate if rate > 0 else self._quota_reset - now
+            wait = max(wait, refill)
+        return wait
+
+    def wait_time(self) -> float:
+        """
+        Returns the number of seconds until a request may be made, 0 if one may be made now.
+        """
+        with self._lock:
+            return self._wait_time(time.monotonic())
+
+    def acquire(self) -> float:
+        """
+        Wait until a request may be made, and take a token for it.
+        :return: The number of seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait = self._wait_time(time.monotonic())
+                if wait <= 0:
+                    self._tokens -= 1
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """
+        Adjust the bucket to the rate limit headers of a response.
+        Reads `X-RateLimit-Remaining`, `X-RateLimit-Reset` and `Retry-After`.
+        """
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        retry_after = headers.get("Retry-After")
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if retry_after and retry_after.isdigit():
+                self._blocked_until = max(self._blocked_until, now + int(retry_after))
+
+            if remaining is not None and reset is not None:
+                # The reset is a Unix time, the bucket keeps monotonic time
+                window = max(float(reset) - time.time(), 1.0)
+                self._quota_reset = now + window
+                self._quota_rate = int(remaining) / window
+                if int(remaining) <= 0:
+                    self._tokens = min(self._tokens, 0.0)
+                    self._blocked_until = max(self._blocked_until, self._quota_reset)
@@ -0,0 +1,145 @@
+import logging
+import threading
+from typing import Callable
+from src.modules.broker import Broker, LeaseLostError
+from src.modules.scheduler import Job
+from src.modules.types import JobMetadata
+
+
+class Runner:
+    """
+    Runs the jobs of a broker on this node, with a fixed pool of worker threads.
+
+    Each worker claims a job, runs it, and reports its result to the broker. While a
+    job runs, its lease is renewed by heartbeats. If the broker reports that the job
+    was superseded, or that the lease was lost to another runner, the job is cancelled
+    by killing its processes.
+    """
+
+    # The number of times a result is reported before the job is left to its lease
+    complete_attempts = 5
+
+    def __init__(
+        self,
+        broker: Broker,
+        handler: Callable[[Job], JobMetadata | None],
+        name: str,
+        max_workers: int = 2,
+        lease: float = 60.0,
+        poll_interval: float = 2.0,
+    ):
+        """
+        :param broker: The broker to claim the jobs from.
+        :param handler: The function that runs a job and returns its result. It is called
+        from a worker thread, and should run the job's commands in `job.group`.
+        :param name: The name of the runner, unique across the nodes.
+        :param max_workers: The number of jobs that may run at the same time.
+        :param lease: The seconds the broker holds a job for the runner without a heartbeat.
+        :param poll_interval: The seconds an idle worker waits before claiming again.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+
+        self.broker = broker
+        self.handler = handler
+        self.name = name
+        self.max_workers = max_workers
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+        self._stopping = threading.Event()
+        self._workers: list[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        Start the worker threads. Calling this on a started runner does nothing.
+        """
+        if self._workers:
+            return
+        self._stopping.clear()
+        for index in range(self.max_workers):
+            worker = threading.Thread(
+                target=self._work, name=f"ci-runner-{index}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Stop the worker threads once their current job is done.
+        """
+        self._stopping.set()
+        workers = self._workers
+        self._workers = []
+        for worker in workers:
+            worker.join(timeout)
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = self.broker.claim(self.name, self.max_workers)
+            except Exception as e:
+                logging.warning(f"Failed to claim a job from the broker: {e}")
+                job = None
+
+            if job is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+
+            self.run(job)
+
+    def run(self, job: Job) -> None:
+        """
+        Run a claimed job, with heartbeats, and report its result to the broker.
+        """
+        done = threading.Event()
+        lost = threading.Event()
+
+        def beat() -> None:
+            # A few heartbeats fit in a lease, so a slow one does not lose the job
+            while not done.wait(self.lease / 3):
+                try:
+                    if self.broker.heartbeat(job.id, self.name):
+                        logging.info(
+                            f"[{job.id}] Cancelled, superseded by a newer job."
+                        )
+                        job.group.cancel()
+                except LeaseLostError as e:
+                    logging.warning(f"[{job.id}] Cancelled, the lease was lost: {e}")
+                    lost.set()
+                    job.group.cancel()
+                    return
+                except Exception as e:
+                    logging.warning(f"[{job.id}] Failed to send a heartbeat: {e}")
+
+        heartbeat = threading.Thread(
+            target=beat, name=f"ci-heartbeat-{job.id}", daemon=True
+        )
+        heartbeat.start()
+        result = None
+        try:
+            result = self.handler(job)
+        except Exception as e:
+            logging.error(f"[{job.id}] The job failed unexpectedly: {e}")
+        finally:
+            done.set()
+            heartbeat.join()
+
+        # Another runner has the job now, its result is the one that counts
+        if lost.is_set():
+            return
+        for attempt in range(self.complete_attempts):
+            try:
+                self.broker.complete(job.id, self.name, result)
+                return
+            except LeaseLostError as e:
+                logging.warning(f"[{job.id}] The result was not accepted: {e}")
+                return
+            except Exception as e:
+                logging.warning(
+                    f"[{job.id}] Failed to report the result to the broker: {e}"
+                )
+                self._stopping.wait(self.poll_interval * 2**attempt)
+
+        # The lease expires and the job runs again on another runner
+        logging.error(f"[{job.id}] Gave up reporting the result to the broker.")
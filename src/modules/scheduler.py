@@ -0,0 +1,474 @@
+import abc
+import fnmatch
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import closing
+from typing import Callable
+from uuid import uuid4
+from src.modules.processes import ProcessGroup
+from src.modules.types import PushEventPayload, Status
+from src.modules.utils import create_folder
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue is at its maximum depth.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("The job queue is full.")
+        self.retry_after = retry_after
+
+
+# The priority class of the refs that match none of the configured classes, it comes last
+DEFAULT_PRIORITY = "default"
+
+
+def get_priority(ref: str, classes: list[tuple[str, list[str]]]) -> tuple[int, str]:
+    """
+    Returns the priority class of a ref.
+    :param ref: The full ref, e.g. `refs/heads/main`.
+    :param classes: The name and the ref patterns of each class, highest priority first.
+    The patterns are shell-style, e.g. `refs/tags/*`.
+    :return: The rank of the class, 0 for the highest, and its name.
+    """
+    for rank, (name, patterns) in enumerate(classes):
+        if any(fnmatch.fnmatchcase(ref, pattern) for pattern in patterns):
+            return (rank, name)
+    return (len(classes), DEFAULT_PRIORITY)
+
+
+def get_weight(repo: str | None, weights: list[tuple[str, float]]) -> float:
+    """
+    Returns the fair-share weight of a repository, the one of the first pattern it matches, or 1.
+    :param repo: The full name of the repository, `owner/name`.
+    :param weights: The shell-style pattern of repositories, e.g. `owner/*`, and the weight of each.
+    """
+    for pattern, weight in weights:
+        if fnmatch.fnmatchcase(repo or "", pattern):
+            return weight
+    return 1.0
+
+
+class Job:
+    """
+    A CI job waiting in, or taken from, the scheduler queue.
+    """
+
+    def __init__(self, id: str, payload: PushEventPayload):
+        self.id = id
+        self.payload = payload
+        self.time_enqueued = time.time()
+        self.time_started: float | None = None
+        # The processes of the job, killed when the job is superseded
+        self.group = ProcessGroup()
+        self.superseded_by: str | None = None
+        # Set by a broker for a started job that is not run again, it is only closed with this status
+        self.final_status: Status | None = None
+        # Set by the scheduler from the ref and the repository of the job
+        self.priority = DEFAULT_PRIORITY
+        self.rank = 0
+        self.weight = 1.0
+        # The duration the repository was charged when the job started
+        self.charged = 0.0
+
+    @property
+    def key(self) -> tuple[str | None, str]:
+        """
+        The repository and ref of the job, a newer job with the same key supersedes it.
+        """
+        repo = self.payload.repository.get("full_name") or self.payload.repository.get(
+            "name"
+        )
+        return (repo, self.payload.ref)
+
+    def supersede(self, job: "Job") -> None:
+        """
+        Cancel the job in favour of a newer job for the same repository and ref.
+        """
+        self.superseded_by = job.id
+        self.group.cancel()
+
+    def describe(self) -> dict:
+        """
+        Summarize the job for the `/queue` endpoint.
+        """
+        return {
+            "id": self.id,
+            "repo": self.key[0],
+            "ref": self.payload.ref,
+            "head_commit": self.payload.after,
+            "time_enqueued": self.time_enqueued,
+            "time_started": self.time_started,
+            "priority": self.priority,
+        }
+
+
+spool_schema = """
+CREATE TABLE IF NOT EXISTS spool (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    time_enqueued REAL NOT NULL,
+    time_started REAL
+);
+"""
+
+
+class JobQueue(abc.ABC):
+    """
+    The server's side of a job queue, that webhooks submit jobs to.
+    """
+
+    def start(self) -> None:
+        """
+        Start running the jobs of the queue, if they run in this process.
+        """
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Stop running the jobs of the queue, if they run in this process.
+        """
+
+    @abc.abstractmethod
+    def submit(self, payload: PushEventPayload, id: str | None = None) -> Job:
+        """
+        Add a job for the payload to the queue.
+
+        :param payload: The push event to run the CI checks on.
+        :param id: The job ID, a new one is generated if not given.
+        :return: The queued job.
+        :raises: QueueFullError if the queue is at its maximum depth.
+        """
+
+    @abc.abstractmethod
+    def snapshot(self) -> dict:
+        """
+        Returns the pending and running jobs, oldest first.
+        """
+
+
+class JobSpool:
+    """
+    The jobs accepted by the scheduler that have not completed yet, on disk.
+
+    A job is added before its webhook is acknowledged, and removed once it has
+    completed or was dropped from the queue. The jobs left in the spool after a
+    crash or a restart are the ones that the scheduler resumes on startup.
+    """
+
+    def __init__(self, spool_file: str):
+        """
+        :param spool_file: The SQLite file of the spool, created if it does not exist.
+        """
+        self.spool_file = spool_file
+
+        create_folder(os.path.dirname(os.path.abspath(spool_file)))
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(spool_schema)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.spool_file, timeout=30, isolation_level=None)
+
+    def add(self, job: Job) -> None:
+        """
+        Store the job, the call returns once it is on disk.
+        """
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO spool (id, payload, time_enqueued) VALUES (?, ?, ?)",
+                (job.id, job.payload.model_dump_json(), job.time_enqueued),
+            )
+
+    def mark_started(self, job: Job) -> None:
+        """
+        Record that a worker has started the job, i.e. it may have posted a pending status.
+        """
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE spool SET time_started = ? WHERE id = ?",
+                (job.time_started, job.id),
+            )
+
+    def remove(self, id: str) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM spool WHERE id = ?", (id,))
+
+    def load(self) -> list[Job]:
+        """
+        Returns the stored jobs, oldest first. The jobs that had been started keep
+        the time they were started, until a worker starts them again.
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT id, payload, time_enqueued, time_started FROM spool ORDER BY seq"
+            ).fetchall()
+
+        jobs = []
+        for id, payload, time_enqueued, time_started in rows:
+            job = Job(id, PushEventPayload.model_validate_json(payload))
+            job.time_enqueued = time_enqueued
+            job.time_started = time_started
+            jobs.append(job)
+        return jobs
+
+
+class JobScheduler(JobQueue):
+    """
+    A bounded job queue served by a fixed pool of worker threads.
+
+    At most `max_workers` jobs run at the same time, and at most `max_queue_depth`
+    jobs may wait for a worker. Submitting beyond that raises `QueueFullError`.
+
+    With `supersede` set, a job replaces the older jobs for the same repository
+    and ref: the ones still in the queue are dropped, and the running ones are
+    cancelled by killing their processes.
+
+    With a spool, every job is stored on disk before `submit` returns, and the
+    jobs that had not completed when the scheduler last stopped, or crashed,
+    are queued again when it starts.
+
+    Jobs are not run in order of arrival. A job of a higher priority class, found
+    from its ref, always runs before the jobs of lower classes. Within a class,
+    repositories get a share of the workers in proportion to their weight
+    (weighted fair queuing), so that a flood of pushes to one repository does
+    not hold up the others. Each repository is charged the time its jobs take,
+    divided by its weight, and the next job is the oldest one of the repository
+    that has been charged the least. A repository that was idle starts from the
+    charge of the last job started, so it cannot save up a share while idle.
+    """
+
+    # Used for the Retry-After estimate until the first job has completed
+    default_job_duration = 60.0
+
+    def __init__(
+        self,
+        handler: Callable[[Job], None],
+        max_workers: int = 2,
+        max_queue_depth: int = 50,
+        supersede: bool = False,
+        spool: JobSpool | None = None,
+        priority_classes: list[tuple[str, list[str]]] | None = None,
+        repo_weights: list[tuple[str, float]] | None = None,
+    ):
+        """
+        :param handler: The function that runs a job. It is called from a worker thread.
+        It should run the job's commands in `job.group`, so that they can be cancelled.
+        :param max_workers: The number of jobs that may run at the same time.
+        :param max_queue_depth: The number of jobs that may wait for a worker.
+        :param supersede: Cancel the older jobs for the same repository and ref when a job is submitted.
+        :param spool: The spool that keeps the accepted jobs on disk until they complete.
+        :param priority_classes: The name and ref patterns of each priority class, highest first, see `get_priority`.
+        :param repo_weights: The fair-share weight of repositories by pattern, see `get_weight`.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.supersede = supersede
+        self.spool = spool
+        self.priority_classes = priority_classes or []
+        self.repo_weights = repo_weights or []
+
+        self._pending: deque[Job] = deque()
+        self._running: dict[str, Job] = {}
+        self._condition = threading.Condition()
+        self._workers: list[threading.Thread] = []
+        self._stopping = False
+        self._average_duration = self.default_job_duration
+        # The time charged to each repository, and the charge of the last job started
+        self._usage: dict[str | None, float] = {}
+        self._virtual_time = 0.0
+
+    def start(self) -> None:
+        """
+        Start the worker threads, after queueing the jobs left in the spool.
+        Calling this on a started scheduler does nothing.
+        """
+        with self._condition:
+            if self._workers:
+                return
+            self._stopping = False
+            if self.spool is not None:
+                self._resume()
+            for index in range(self.max_workers):
+                worker = threading.Thread(
+                    target=self._work, name=f"ci-worker-{index}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _resume(self) -> None:
+        # Called with the condition held, before any worker has started
+        # The jobs of an earlier start may still be queued, or running past `stop`
+        known_ids = {job.id for job in self._pending} | set(self._running)
+        jobs = [job for job in self.spool.load() if job.id not in known_ids]
+        newest = {job.key: job for job in jobs} if self.supersede else {}
+
+        for job in jobs:
+            newer = newest.get(job.key, job)
+            if newer is not job and job.time_started is None:
+                self.spool.remove(job.id)
+                job.superseded_by = newer.id
+                logging.info(
+                    f"[{job.id}] Dropped from the queue, superseded by {newer.id}."
+                )
+                continue
+            if newer is not job:
+                # It may have posted a pending status, so it runs to the cancelled status
+                job.supersede(newer)
+            logging.info(f"[{job.id}] Resumed from the spool.")
+            self._classify(job)
+            self._pending.append(job)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Stop the worker threads once their current job is done.
+
+        Jobs still pending in the queue are not run, but are resumed by the next
+        start if the scheduler has a spool.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            workers = self._workers
+            self._workers = []
+
+        for worker in workers:
+            worker.join(timeout)
+
+    def submit(self, payload: PushEventPayload, id: str | None = None) -> Job:
+        """
+        Add a job for the payload to the queue.
+
+        :param payload: The push event to run the CI checks on.
+        :param id: The job ID, a new one is generated if not given.
+        :return: The queued job.
+        :raises: QueueFullError if the queue is at its maximum depth.
+        """
+        job = Job(id or str(uuid4()), payload)
+        self._classify(job)
+
+        with self._condition:
+            if self.supersede:
+                self._drop_superseded(job)
+            if len(self._pending) >= self.max_queue_depth:
+                raise QueueFullError(self._estimate_retry_after())
+            if self.supersede:
+                self._cancel_superseded(job)
+            if self.spool is not None:
+                self.spool.add(job)
+            self._pending.append(job)
+            self._condition.notify()
+
+        return job
+
+    def _drop_superseded(self, job: Job) -> None:
+        # Called with the condition held, so no older job can start in the meantime
+        for old_job in [old for old in self._pending if old.key == job.key]:
+            self._pending.remove(old_job)
+            old_job.superseded_by = job.id
+            if self.spool is not None:
+                self.spool.remove(old_job.id)
+            logging.info(
+                f"[{old_job.id}] Dropped from the queue, superseded by {job.id}."
+            )
+
+    def _cancel_superseded(self, job: Job) -> None:
+        for old_job in self._running.values():
+            if old_job.key == job.key and old_job.superseded_by is None:
+                old_job.supersede(job)
+                logging.info(f"[{old_job.id}] Cancelled, superseded by {job.id}.")
+
+    def snapshot(self) -> dict:
+        """
+        Returns the pending and running jobs, oldest first.
+        """
+        with self._condition:
+            pending = [job.describe() for job in self._pending]
+            running = [job.describe() for job in self._running.values()]
+
+        return {
+            "pending": pending,
+            "running": running,
+            "max_workers": self.max_workers,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def _classify(self, job: Job) -> None:
+        job.rank, job.priority = get_priority(job.payload.ref, self.priority_classes)
+        job.weight = get_weight(job.key[0], self.repo_weights)
+
+    def _usage_of(self, repo: str | None) -> float:
+        return max(self._usage.get(repo, 0.0), self._virtual_time)
+
+    def _take_next(self) -> Job:
+        # Called with the condition held, the highest class first, then the least charged
+        # repository. `min` keeps the first of equal jobs, i.e. the oldest one.
+        job = min(self._pending, key=lambda job: (job.rank, self._usage_of(job.key[0])))
+        self._pending.remove(job)
+
+        repo = job.key[0]
+        start = self._usage_of(repo)
+        self._virtual_time = max(self._virtual_time, start)
+        # Charge the expected duration now, so that the other workers see it,
+        # and correct it with the actual duration when the job completes
+        self._usage[repo] = start + self._average_duration / job.weight
+        job.charged = self._average_duration
+        # Repositories at or below the virtual time would be reset to it anyway
+        for idle in [r for r, u in self._usage.items() if u <= self._virtual_time]:
+            del self._usage[idle]
+        return job
+
+    def _update_spool(self, job: Job, started: bool) -> None:
+        # A failure only means that the job is run again after a restart, it must not stop the worker
+        if self.spool is None:
+            return
+        try:
+            if started:
+                self.spool.mark_started(job)
+            else:
+                self.spool.remove(job.id)
+        except sqlite3.Error as e:
+            logging.warning(f"[{job.id}] Failed to update the spool: {e}")
+
+    def _estimate_retry_after(self) -> int:
+        # A queue slot frees up whenever any of the workers finishes a job
+        return max(1, math.ceil(self._average_duration / self.max_workers))
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                job = self._take_next()
+                job.time_started = time.time()
+                self._running[job.id] = job
+
+            self._update_spool(job, started=True)
+            try:
+                self.handler(job)
+            except Exception as e:
+                logging.error(f"[{job.id}] The job failed unexpectedly: {e}")
+            finally:
+                duration = time.time() - job.time_started
+                self._update_spool(job, started=False)
+                with self._condition:
+                    del self._running[job.id]
+                    repo = job.key[0]
+                    if repo in self._usage:
+                        self._usage[repo] += (duration - job.charged) / job.weight
+                    # Exponential moving average, so old jobs fade out of the estimate
+                    self._average_duration = (
+                        0.8 * self._average_duration + 0.2 * duration
+                    )
@@ -0,0 +1,104 @@
+import gzip
+import os
+from src.modules.utils import create_folder
+
+# Sections are compressed in blocks, so that a part of a section can be read
+# without decompressing all of it
+BLOCK_SIZE = 256 * 1024
+
+
+def write_sections(path: str, sections: list[str]) -> list[list[list[int]]]:
+    """
+    Compress the sections into a file, each section in blocks of `BLOCK_SIZE` bytes.
+
+    Every block is a separate gzip member, so the file as a whole can still be
+    read with `gunzip`, which prints the sections one after the other.
+    The file is written to a temporary path first, and moved into place once complete.
+    :param path: The file to write the sections to.
+    :param sections: The text of each section.
+    :return: The index of the file. For each section, the offset in the file,
+    the compressed size and the uncompressed size of each of its blocks.
+    """
+    create_folder(os.path.dirname(os.path.abspath(path)))
+    index = []
+    offset = 0
+
+    with open(path + ".tmp", "wb") as file:
+        for section in sections:
+            data = section.encode()
+            blocks = []
+            for start in range(0, len(data), BLOCK_SIZE):
+                block = data[start : start + BLOCK_SIZE]
+                compressed = gzip.compress(block, mtime=0)
+                file.write(compressed)
+                blocks.append([offset, len(compressed), len(block)])
+                offset += len(compressed)
+            index.append(blocks)
+
+    os.replace(path + ".tmp", path)
+    return index
+
+
+def get_section_size(blocks: list[list[int]]) -> int:
+    """
+    Returns the uncompressed size in bytes of a section.
+    """
+    return sum(size for _, _, size in blocks)
+
+
+def read_block(file, block: list[int]) -> bytes:
+    offset, length, _ = block
+    file.seek(offset)
+    return gzip.decompress(file.read(length))
+
+
+def read_section_range(
+    path: str, blocks: list[list[int]], start: int = 0, end: int | None = None
+) -> bytes:
+    """
+    Read a range of bytes of a section, decompressing only the blocks that overlap it.
+    :param path: The file the section was written to.
+    :param blocks: The index of the section, as returned by `write_sections`.
+    :param start: The first byte to read.
+    :param end: The byte after the last one to read, the end of the section if None.
+    :return: The bytes of the section in the range.
+    """
+    size = get_section_size(blocks)
+    end = size if end is None else min(end, size)
+    chunks = []
+    block_start = 0
+
+    with open(path, "rb") as file:
+        for block in blocks:
+            block_end = block_start + block[2]
+            if block_end > start and block_start < end:
+                data = read_block(file, block)
+                chunks.append(data[max(start - block_start, 0) : end - block_start])
+            block_start = block_end
+
+    return b"".join(chunks)
+
+
+def read_section_tail(path: str, blocks: list[list[int]], lines: int) -> bytes:
+    """
+    Read the last lines of a section, decompressing blocks from the end until there are enough.
+    :param path: The file the section was written to.
+    :param blocks: The index of the section, as returned by `write_sections`.
+    :param lines: The number of lines to read.
+    :return: The last lines of the section.
+    """
+    if lines <= 0:
+        return b""
+
+    data = b""
+    with open(path, "rb") as file:
+        for block in reversed(blocks):
+            data = read_block(file, block) + data
+            # The newline that ends the last line does not start another one
+            if data.count(b"\n", 0, len(data) - 1) >= lines:
+                break
+
+    trailing_newline = data.endswith(b"\n")
+    body = data[:-1] if trailing_newline else data
+    tail = b"\n".join(body.split(b"\n")[-lines:])
+    return tail + b"\n" if trailing_newline else tail
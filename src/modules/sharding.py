@@ -0,0 +1,199 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from src.modules.cache import lock_entry
+from src.modules.processes import ProcessGroup
+from src.modules.utils import check_if_file_exists, create_folder
+
+# Prints the IDs of the tests that `python -m unittest` would discover
+discover_script = """
+import json, unittest
+
+def ids(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from ids(test)
+        else:
+            yield test.id()
+
+print(json.dumps(list(ids(unittest.defaultTestLoader.discover(".")))))
+"""
+
+# Runs the tests listed in a file, and stores how long each of them took
+shard_script = """
+import json, sys, time, unittest
+
+durations = {}
+
+class TimedResult(unittest.TextTestResult):
+    def startTest(self, test):
+        self.test_started = time.perf_counter()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        durations[test.id()] = time.perf_counter() - self.test_started
+        super().stopTest(test)
+
+with open(sys.argv[1]) as file:
+    names = json.load(file)
+suite = unittest.defaultTestLoader.loadTestsFromNames(names)
+result = unittest.TextTestRunner(resultclass=TimedResult).run(suite)
+with open(sys.argv[2], "w") as file:
+    json.dump(durations, file)
+sys.exit(not result.wasSuccessful())
+"""
+
+
+def get_python(target_folder: str) -> str:
+    """
+    Returns the interpreter of the project's `.venv`, or `python` if there is none.
+    The path is absolute, as the interpreter is run from within the project.
+    """
+    venv_python = os.path.abspath(os.path.join(target_folder, ".venv", "bin", "python"))
+    return venv_python if os.path.exists(venv_python) else "python"
+
+
+def discover_tests(target_folder: str, group: ProcessGroup) -> list[str] | None:
+    """
+    Returns the IDs of the tests in the project, or None if discovery failed.
+    """
+    python = get_python(target_folder)
+    # The test IDs are parsed from the output, so all of it is needed
+    result = group.run([python, "-c", discover_script], target_folder, bounded=False)
+    if result.returncode != 0:
+        return None
+
+    test_ids = json.loads(result.stdout.decode().strip().splitlines()[-1])
+    # Modules that fail to import show up as failed tests, only a full run reports them properly
+    if any(test_id.startswith("unittest.loader.") for test_id in test_ids):
+        return None
+    return test_ids
+
+
+def read_durations(durations_file: str | None) -> dict[str, float]:
+    """
+    Returns the duration in seconds of each test in the previous runs.
+    """
+    if not durations_file or not check_if_file_exists(durations_file):
+        return {}
+    with lock_entry(durations_file):
+        with open(durations_file, "r") as file:
+            return json.load(file)
+
+
+def store_durations(durations_file: str, durations: dict[str, float]) -> None:
+    """
+    Merge the durations of the latest run into the ones of the previous runs.
+    """
+    create_folder(os.path.dirname(os.path.abspath(durations_file)))
+    with lock_entry(durations_file):
+        stored = {}
+        if check_if_file_exists(durations_file):
+            with open(durations_file, "r") as file:
+                stored = json.load(file)
+        stored.update(durations)
+        with open(durations_file, "w") as file:
+            json.dump(stored, file)
+
+
+def split_into_shards(
+    test_ids: list[str], shards: int, durations: dict[str, float]
+) -> list[list[str]]:
+    """
+    Split the tests into shards of about the same total duration.
+
+    Tests of the same test case stay in the same shard, so their class fixtures
+    are only set up once. Test cases are handed out longest first, each to the
+    shard with the least work so far. Tests without a known duration count as
+    the average known duration.
+    """
+    cases: dict[str, list[str]] = {}
+    for test_id in test_ids:
+        cases.setdefault(test_id.rsplit(".", 1)[0], []).append(test_id)
+
+    known = [durations[test_id] for test_id in test_ids if test_id in durations]
+    default = sum(known) / len(known) if known else 1.0
+
+    def case_duration(case: str) -> float:
+        return sum(durations.get(test_id, default) for test_id in cases[case])
+
+    buckets: list[list[str]] = [[] for _ in range(min(shards, len(cases)))]
+    totals = [0.0] * len(buckets)
+    for case in sorted(cases, key=case_duration, reverse=True):
+        index = totals.index(min(totals))
+        buckets[index] += cases[case]
+        totals[index] += case_duration(case)
+
+    return buckets
+
+
+def run_shard(
+    target_folder: str, test_ids: list[str], group: ProcessGroup
+) -> tuple[bool, str, dict[str, float]]:
+    """
+    Run a shard of the tests in its own process.
+    :return: Whether the tests passed, the test runner's output, and the duration of each test.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        names_file = os.path.join(folder, "names.json")
+        durations_file = os.path.join(folder, "durations.json")
+        with open(names_file, "w") as file:
+            json.dump(test_ids, file)
+
+        python = get_python(target_folder)
+        result = group.run(
+            [python, "-c", shard_script, names_file, durations_file], target_folder
+        )
+
+        durations = {}
+        if check_if_file_exists(durations_file):
+            with open(durations_file, "r") as file:
+                durations = json.load(file)
+
+    return (result.returncode == 0, result.stderr.decode(), durations)
+
+
+def run_sharded_tests(
+    target_folder: str,
+    shards: int,
+    group: ProcessGroup,
+    durations_file: str | None = None,
+    test_modules: list[str] | None = None,
+) -> tuple[bool, str] | None:
+    """
+    Run the tests of the project split across several processes.
+    :param target_folder: The root folder of the project.
+    :param shards: The number of processes to run the tests in.
+    :param group: The process group to run the shards in.
+    :param durations_file: The file with the test durations of previous runs, used to balance the shards.
+    :param test_modules: Only run the tests of these modules. All the tests run if None.
+    :return: Whether all the tests passed and the merged logs of the shards,
+    or None if the tests could not be discovered and should be run in one process.
+    """
+    test_ids = discover_tests(target_folder, group)
+    if test_ids and test_modules is not None:
+        prefixes = tuple(f"{module}." for module in test_modules)
+        test_ids = [test_id for test_id in test_ids if test_id.startswith(prefixes)]
+    if not test_ids:
+        return None
+
+    buckets = split_into_shards(test_ids, shards, read_durations(durations_file))
+    with ThreadPoolExecutor(max_workers=len(buckets)) as executor:
+        results = list(
+            executor.map(lambda ids: run_shard(target_folder, ids, group), buckets)
+        )
+
+    durations = {}
+    logs = f"Ran {len(test_ids)} tests in {len(buckets)} shards.\n"
+    for index, (bucket, (_, output, shard_durations)) in enumerate(
+        zip(buckets, results)
+    ):
+        logs += f"\n--- Shard {index + 1}/{len(buckets)} ({len(bucket)} tests) ---\n"
+        logs += output
+        durations.update(shard_durations)
+
+    if durations_file:
+        store_durations(durations_file, durations)
+
+    return (all(passed for passed, _, _ in results), logs)
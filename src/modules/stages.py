@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from src.modules.processes import JobCancelledError, ProcessGroup
+
+
+class Stage:
+    """
+    A step of a CI job that passes or fails, e.g. the linter or the tests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[ProcessGroup], tuple[bool, str]],
+        fail_fast: bool = False,
+        timeout: float | None = None,
+    ):
+        """
+        :param name: The name of the stage, used in the logs.
+        :param run: The function that runs the stage in the given process group.
+        It returns whether the stage passed, and the CLI logs of the stage.
+        :param fail_fast: Cancel the other stages as soon as this one fails.
+        :param timeout: The number of seconds the commands of the stage may run for, no limit if None.
+        """
+        self.name = name
+        self.run = run
+        self.fail_fast = fail_fast
+        self.timeout = timeout
+        # How long the stage took in seconds, set once it has run
+        self.duration: float | None = None
+        # Whether the stage ran to the end, it did not if it was cancelled or raised
+        self.completed = False
+
+
+def run_stages(
+    stages: list[Stage], group: ProcessGroup | None = None, parallel: bool = True
+) -> list[tuple[bool, str]]:
+    """
+    Run independent stages, at the same time unless `parallel` is unset.
+
+    The results are returned in the order of the stages, no matter which stage
+    completed first. Stages that were cancelled because a fail-fast stage failed
+    count as failed.
+    :param stages: The stages to run.
+    :param group: The process group of the job, the stages run in a child of it.
+    :param parallel: Run the stages in parallel, or one after the other.
+    :return: Whether each stage passed, and its CLI logs.
+    :raises: Exception if a stage raises, after the other stages were cancelled.
+    :raises: StageTimeoutError if a stage reaches its timeout, after the other stages were cancelled.
+    """
+    stage_group = group.child() if group is not None else ProcessGroup()
+    results: list[tuple[bool, str] | None] = [None] * len(stages)
+    failed_stage: Stage | None = None
+
+    def run_stage(index: int) -> None:
+        nonlocal failed_stage
+        stage = stages[index]
+        started = time.perf_counter()
+        try:
+            passed, logs = stage.run(stage_group.child(stage.timeout))
+        except JobCancelledError:
+            if failed_stage is None:
+                raise
+            reason = f"Cancelled because the {failed_stage.name} stage failed."
+            results[index] = (False, f"{stage.name.capitalize()} Log: {reason}")
+            return
+        except Exception:
+            stage_group.cancel()
+            raise
+        finally:
+            stage.duration = time.perf_counter() - started
+
+        results[index] = (passed, logs)
+        stage.completed = True
+        if not passed and stage.fail_fast and failed_stage is None:
+            failed_stage = stage
+            stage_group.cancel()
+
+    if parallel and len(stages) > 1:
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = [executor.submit(run_stage, i) for i in range(len(stages))]
+        # The error of a stage comes before the cancellation of the others that it caused
+        for future in sorted(
+            futures,
+            key=lambda future: isinstance(future.exception(), JobCancelledError),
+        ):
+            future.result()
+    else:
+        for index in range(len(stages)):
+            run_stage(index)
+
+    return results
@@ -10,11 +10,9 @@ class Author(BaseModel):
 
 
 class Commit(BaseModel):
-    added: list[str] | None = (
-        Field(
-            default=None,
-            description="An array of files added in the commit. A maximum of 3000 changed files will be reported per commit.",
-        ),
+    added: list[str] | None = Field(
+        default=None,
+        description="An array of files added in the commit. A maximum of 3000 changed files will be reported per commit.",
     )
     author: Author = Field(
         description="Metaproperties for Git author/committer information.",
@@ -96,14 +94,67 @@ class WebhookResponse(BaseModel):
     message: str = (
         "Webhook received successfully, the payload has been queued for processing."
     )
+    id: str | None = Field(default=None, description="The ID of the queued job.")
 
 
-class LogsResponse(BaseModel):
-    logs: list[str] = Field(
-        description="A list of IDs for the logs that are available."
+class QueueFullResponse(BaseModel):
+    success: bool = False
+    message: str = "The job queue is full, please retry later."
+
+
+class QueueUnavailableResponse(BaseModel):
+    success: bool = False
+    message: str = "The job queue could not store the job, please retry later."
+
+
+class QueuedJob(BaseModel):
+    id: str
+    repo: str | None = None
+    ref: str
+    head_commit: str = Field(
+        description="The SHA of the most recent commit on `ref` after the push."
+    )
+    time_enqueued: float
+    time_started: float | None = Field(
+        default=None, description="When a worker picked up the job, if it has."
+    )
+    runner: str | None = Field(
+        default=None, description="The runner that runs the job, in broker mode."
+    )
+    priority: str | None = Field(
+        default=None, description="The priority class of the job, from its ref."
     )
 
 
+class QueueResponse(BaseModel):
+    pending: list[QueuedJob] = Field(
+        description="Jobs waiting for a worker, oldest first."
+    )
+    running: list[QueuedJob] = Field(description="Jobs currently being run.")
+    max_workers: int
+    max_queue_depth: int
+
+
+class RunnerRequest(BaseModel):
+    runner: str = Field(description="The name of the runner, unique across the nodes.")
+
+
+class RunnerClaimRequest(RunnerRequest):
+    capacity: int = Field(
+        default=1, ge=1, description="The number of jobs the runner may run at once."
+    )
+
+
+class HeartbeatResponse(BaseModel):
+    cancelled: bool = Field(
+        description="Whether the job was superseded, and the runner should cancel it."
+    )
+
+
+class RunnerErrorResponse(BaseModel):
+    message: str
+
+
 class LogNotFoundResponse(BaseModel):
     message: str = (
         "Log not found. Either the log ID is invalid, or the CI job has not yet completed."
@@ -115,6 +166,18 @@ class Status(Enum):
     FAILURE = "failure"
     PENDING = "pending"
     ERROR = "error"
+    CANCELLED = "cancelled"
+
+
+class ClaimedJob(BaseModel):
+    id: str
+    payload: PushEventPayload
+    time_enqueued: float
+    time_started: float = Field(description="When the runner claimed the job.")
+    final_status: Status | None = Field(
+        default=None,
+        description="Set if the job is not run again, e.g. because its runners kept dying. The runner only closes it with this status.",
+    )
 
 
 class JobMetadata(BaseModel):
@@ -134,3 +197,57 @@ class JobMetadata(BaseModel):
     logs: list[str] = Field(
         description="The CLI logs for the job, split into four sections: `clone`, `setup`, `lint`, `test`."
     )
+    log_sections: list[str] = Field(
+        default=[],
+        description="The name of each section of `logs`, used to read a single section with `/logs/{id}/sections/{name}`.",
+    )
+    reused_from: str | None = Field(
+        default=None,
+        description="The ID of the job whose result was reused, if the same tree had already been checked.",
+    )
+    queue_wait: float | None = Field(
+        default=None,
+        description="How long the job waited in the queue before it started, in seconds.",
+    )
+    stage_durations: dict[str, float] = Field(
+        default={},
+        description="How long each stage of the job took, in seconds, e.g. `clone` or `test`. The `lint` and `test` stages may overlap.",
+    )
+
+
+class JobSummary(BaseModel):
+    id: str
+    status: Status | None = Field(
+        default=None, description="None for jobs imported without their metadata."
+    )
+    repo: str | None = Field(
+        default=None, description="The full name of the repository, `owner/name`."
+    )
+    ref: str | None = None
+    head_commit: str | None = None
+    author: str | None = None
+    time_started: int | None = None
+    time_ended: int | None = None
+    duration: int | None = Field(
+        default=None, description="How long the job took, in seconds."
+    )
+
+
+class LogsResponse(BaseModel):
+    logs: list[str] = Field(
+        description="The IDs of the logs on this page, newest first."
+    )
+    jobs: list[JobSummary] = Field(
+        description="A summary of each job on this page, in the same order as `logs`."
+    )
+    next_cursor: int | None = Field(
+        default=None,
+        description="Pass as `cursor` to get the next page, None on the last page.",
+    )
+
+
+class RunnerCompleteRequest(RunnerRequest):
+    result: JobMetadata | None = Field(
+        default=None,
+        description="The metadata of the job, None if the job was skipped, e.g. because the push deleted the branch.",
+    )
@@ -1,5 +1,6 @@
 import os
 import shutil
+import stat
 
 
 def check_if_folder_exists(folder_path: str) -> bool:
@@ -44,9 +45,35 @@ def remove_folder(folder_path: str) -> None:
     Remove the folder (and its content) at the given path.
 
     If the folder does not exist, this function will do nothing.
+    Read-only content, e.g. a cached environment, is removed as well.
     """
     if check_if_folder_exists(folder_path):
-        shutil.rmtree(folder_path)
+        shutil.rmtree(folder_path, onerror=_remove_read_only)
+
+
+def _remove_read_only(function, path: str, _) -> None:
+    # The content of a read-only folder can only be removed once it is writable
+    parent = os.path.dirname(path)
+    os.chmod(parent, os.stat(parent).st_mode | stat.S_IWUSR)
+    function(path)
+
+
+def make_read_only(folder_path: str) -> None:
+    """
+    Remove the write permissions of the folder and of its content.
+    Symbolic links are not followed.
+    """
+    for root, folders, files in os.walk(folder_path):
+        for name in folders + files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                _remove_write_permissions(path)
+    _remove_write_permissions(folder_path)
+
+
+def _remove_write_permissions(path: str) -> None:
+    mode = os.stat(path).st_mode
+    os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
 
 
 def remove_file(file_path: str) -> None:
@@ -57,3 +84,18 @@ def remove_file(file_path: str) -> None:
     """
     if check_if_file_exists(file_path):
         os.remove(file_path)
+
+
+def get_folder_size(folder_path: str) -> int:
+    """
+    Returns the total size in bytes of the files in the folder (and its subfolders).
+
+    Symbolic links are not followed. If the folder does not exist, this function returns 0.
+    """
+    total = 0
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+    return total
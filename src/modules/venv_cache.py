@@ -0,0 +1,191 @@
+import hashlib
+import os
+import subprocess
+import threading
+from src.modules.cache import evict_entries, hold_entry, lock_entry, mark_entry_used
+from src.modules.metrics import cache_lookups
+from src.modules.processes import ProcessGroup, run_command
+from src.modules.utils import (
+    check_if_file_exists,
+    make_read_only,
+    remove_file,
+    remove_folder,
+)
+from src.modules.wheelhouse import install_requirements
+
+# The locks on the cached environments linked into workspaces, by workspace
+_held_venvs: dict[str, int] = {}
+_held_venvs_lock = threading.Lock()
+
+
+def is_requirements_cacheable(requirements: str) -> bool:
+    """
+    Check whether an environment built from the requirements can be shared between jobs.
+
+    Requirements that point at other files or at the project itself (e.g. `-e .`)
+    depend on more than the file's content, so they are always installed from scratch.
+    """
+    for line in requirements.splitlines():
+        line = line.strip()
+        if line.startswith(("-r", "-c", "-e", "--requirement", "--editable")):
+            return False
+        if line.startswith((".", "/", "file:")):
+            return False
+    return True
+
+
+def get_python_version(python: str = "python3") -> str:
+    """
+    Returns the full version string of the interpreter used to build environments.
+    """
+    ret = subprocess.run(
+        [python, "-c", "import sys; print(sys.version)"], capture_output=True
+    )
+    return ret.stdout.decode().strip()
+
+
+def get_venv_key(requirements: str, python_version: str) -> str:
+    """
+    Returns the cache key of an environment, a hash of its requirements and interpreter.
+    """
+    content = python_version + "\n" + requirements
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+def build_venv(
+    venv_path: str,
+    requirements_file: str,
+    wheelhouse: str | None = None,
+    pip_cache: str | None = None,
+    group: ProcessGroup | None = None,
+) -> str:
+    """
+    Create a virtual environment at the path and install the requirements into it.
+    :param venv_path: The path of the virtual environment.
+    :param requirements_file: The requirements file to install.
+    :param wheelhouse: The folder of the shared wheelhouse, if wheels should be reused.
+    :param pip_cache: The folder of the shared pip cache, used together with the wheelhouse.
+    :param group: The process group to run the installation in.
+    :return: The CLI logs from the installation.
+    :raises: Exception if the installation fails.
+    """
+    command = ["python3", "-m", "venv", venv_path]
+    ret = run_command(command, group=group)
+    pip = os.path.join(venv_path, "bin", "pip")
+
+    if ret.returncode == 0 and wheelhouse and pip_cache:
+        try:
+            return install_requirements(
+                [pip], requirements_file, wheelhouse, pip_cache, group
+            )
+        except Exception:
+            remove_folder(venv_path)
+            raise
+
+    if ret.returncode == 0:
+        ret = run_command([pip, "install", "-r", requirements_file], group=group)
+
+    if ret.returncode != 0:
+        remove_folder(venv_path)
+        err = Exception(f"Failed to install dependencies from {requirements_file}.")
+        err.add_note(ret.stderr.decode())
+        raise err
+
+    return ret.stdout.decode()
+
+
+def link_cached_venv(
+    target_folder: str,
+    cache_folder: str,
+    max_bytes: int | None = None,
+    wheelhouse: str | None = None,
+    pip_cache: str | None = None,
+    group: ProcessGroup | None = None,
+) -> str | None:
+    """
+    Link a cached virtual environment for the project's requirements into `.venv`.
+
+    The environment is built in the cache first if there is none for the
+    requirements yet. Jobs with the same requirements wait for each other, so the
+    environment is only ever built once. Once built, the environment is made
+    read-only, so that a job cannot change it for the jobs after it.
+
+    The environment is held with a shared lock, so that it is not evicted while
+    the job uses it, until `release_cached_venv` is called for the project.
+    :param target_folder: The root folder of the project.
+    :param cache_folder: The folder that holds the cached environments.
+    :param max_bytes: The size budget of the cache, no eviction if not given.
+    :param wheelhouse: The folder of the shared wheelhouse, used when building the environment.
+    :param pip_cache: The folder of the shared pip cache, used together with the wheelhouse.
+    :param group: The process group to run the installation in.
+    :return: The CLI logs, or None if the requirements cannot be cached.
+    :raises: Exception if building the environment fails.
+    """
+    requirements_file = os.path.abspath(
+        os.path.join(target_folder, "requirements-dev.txt")
+    )
+    if not check_if_file_exists(requirements_file):
+        return None
+
+    with open(requirements_file, "r") as file:
+        requirements = file.read()
+    if not is_requirements_cacheable(requirements):
+        return None
+
+    key = get_venv_key(requirements, get_python_version())
+    venv_path = os.path.join(os.path.abspath(cache_folder), f"{key}.venv")
+    os.makedirs(cache_folder, exist_ok=True)
+
+    # The marker is only written once the environment is complete
+    marker = os.path.join(venv_path, ".complete")
+    # Held before building, so that the environment cannot be evicted in between
+    fd = hold_entry(venv_path)
+    link = os.path.join(target_folder, ".venv")
+    try:
+        logs = None
+        # Builds have their own lock, the entry's lock is shared by the jobs using it
+        if not check_if_file_exists(marker):
+            with lock_entry(f"{venv_path}.build"):
+                if not check_if_file_exists(marker):
+                    cache_lookups.inc(cache="venv", result="miss")
+                    remove_folder(venv_path)
+                    logs = build_venv(
+                        venv_path, requirements_file, wheelhouse, pip_cache, group
+                    )
+                    open(marker, "w").close()
+                    make_read_only(venv_path)
+                    logs += f"Stored the environment {key} in the cache.\n"
+        if logs is None:
+            cache_lookups.inc(cache="venv", result="hit")
+            logs = f"Reusing the cached environment {key}.\n"
+        mark_entry_used(venv_path)
+
+        # A `.venv` committed to the repository is replaced
+        if os.path.islink(link):
+            os.unlink(link)
+        remove_folder(link)
+        remove_file(link)
+        os.symlink(venv_path, link)
+    except BaseException:
+        os.close(fd)
+        raise
+    with _held_venvs_lock:
+        _held_venvs[os.path.abspath(target_folder)] = fd
+
+    if max_bytes is not None:
+        for entry in evict_entries(cache_folder, ".venv", max_bytes, venv_path):
+            logs += f"Evicted the environment {entry} from the cache.\n"
+
+    return logs
+
+
+def release_cached_venv(target_folder: str) -> None:
+    """
+    Release the cached environment linked into the project by `link_cached_venv`,
+    so that it may be evicted. Does nothing if no environment was linked.
+    :param target_folder: The root folder of the project.
+    """
+    with _held_venvs_lock:
+        fd = _held_venvs.pop(os.path.abspath(target_folder), None)
+    if fd is not None:
+        os.close(fd)
@@ -0,0 +1,236 @@
+import json
+import os
+import re
+import subprocess
+import tempfile
+from src.modules.cache import lock_entry
+from src.modules.metrics import cache_lookups
+from src.modules.processes import ProcessGroup, run_command
+from src.modules.utils import check_if_file_exists, create_folder, remove_folder
+
+stats_file_name = "requests.json"
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize a package name as in PEP 503, e.g. `Foo_Bar` becomes `foo-bar`.
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_requirements(requirements: str) -> list[str]:
+    """
+    Returns the requirement specifiers in a requirements file, without options and comments.
+    """
+    specifiers = []
+    for line in requirements.splitlines():
+        line = line.split(" #", 1)[0].strip()
+        if line and not line.startswith(("#", "-")):
+            specifiers.append(line)
+    return specifiers
+
+
+def get_requirement_name(specifier: str) -> str:
+    """
+    Returns the normalized package name of a specifier, e.g. `uvicorn` for `uvicorn[standard]>=0.30`.
+    """
+    match = re.match(r"[A-Za-z0-9][A-Za-z0-9._-]*", specifier)
+    return normalize_name(match.group(0)) if match else specifier
+
+
+def is_pinned(specifier: str) -> bool:
+    """
+    Check whether a specifier allows a single version only, e.g. `requests==2.32.0`.
+    Environment markers are allowed, wildcards such as `==2.*` are not.
+    """
+    version = specifier.split(";", 1)[0]
+    return bool(re.fullmatch(r"[^=<>!~,]+===?\s*[^=<>!~,*\s]+\s*", version))
+
+
+def get_wheel_names(wheelhouse_folder: str) -> set[str]:
+    """
+    Returns the normalized package names of the wheels in the wheelhouse.
+    """
+    if not os.path.isdir(wheelhouse_folder):
+        return set()
+    return {
+        normalize_name(file.split("-", 1)[0])
+        for file in os.listdir(wheelhouse_folder)
+        if file.endswith(".whl")
+    }
+
+
+def record_requests(wheelhouse_folder: str, specifiers: list[str]) -> None:
+    """
+    Count how often each requirement was requested, to know which wheels to pre-build.
+    """
+    stats_file = os.path.join(wheelhouse_folder, stats_file_name)
+    create_folder(wheelhouse_folder)
+
+    with lock_entry(stats_file):
+        stats = {}
+        if check_if_file_exists(stats_file):
+            with open(stats_file, "r") as file:
+                stats = json.load(file)
+        for specifier in specifiers:
+            stats[specifier] = stats.get(specifier, 0) + 1
+        with open(stats_file, "w") as file:
+            json.dump(stats, file, indent=4)
+
+
+def run_pip(
+    args: list[str], pip_cache_folder: str, group: ProcessGroup | None = None
+) -> subprocess.CompletedProcess:
+    """
+    Run pip with the shared cache folder.
+    :param args: The pip command, starting with the pip executable.
+    :param pip_cache_folder: The folder of the shared pip cache.
+    :param group: The process group to run pip in.
+    :return: The completed process.
+    """
+    env = {**os.environ, "PIP_CACHE_DIR": os.path.abspath(pip_cache_folder)}
+    return run_command(args, env=env, group=group)
+
+
+def build_wheels(
+    pip: list[str],
+    args: list[str],
+    wheelhouse_folder: str,
+    pip_cache_folder: str,
+    group: ProcessGroup | None = None,
+) -> subprocess.CompletedProcess:
+    """
+    Build (or download) wheels and add them to the wheelhouse.
+    The wheels are built in a folder of their own, and moved into the wheelhouse
+    once complete, so that concurrent jobs never install a partly written wheel.
+    :param pip: The command to run pip with, e.g. `[".venv/bin/pip"]`.
+    :param args: The requirements to build, e.g. `["-r", "requirements-dev.txt"]`.
+    :param wheelhouse_folder: The folder of the shared wheelhouse.
+    :param pip_cache_folder: The folder of the shared pip cache.
+    :param group: The process group to run pip in.
+    :return: The completed pip process.
+    """
+    # In the wheelhouse, so that the wheels are moved on the same file system
+    build_folder = tempfile.mkdtemp(prefix=".build-", dir=wheelhouse_folder)
+    try:
+        command = [*pip, "wheel", "--wheel-dir", build_folder]
+        ret = run_pip(
+            [*command, "--find-links", wheelhouse_folder, *args],
+            pip_cache_folder,
+            group,
+        )
+        if ret.returncode == 0:
+            for file in os.listdir(build_folder):
+                os.replace(
+                    os.path.join(build_folder, file),
+                    os.path.join(wheelhouse_folder, file),
+                )
+        return ret
+    finally:
+        remove_folder(build_folder)
+
+
+def install_requirements(
+    pip: list[str],
+    requirements_file: str,
+    wheelhouse_folder: str,
+    pip_cache_folder: str,
+    group: ProcessGroup | None = None,
+) -> str:
+    """
+    Install the requirements offline from the shared wheelhouse, if possible.
+    If some of the wheels are missing, they are built (or downloaded) into the
+    wheelhouse first, so that the next job with the same requirements can
+    install them without network access.
+    Only requirements pinned to a single version are installed offline right away.
+    Otherwise a wheel in the wheelhouse could satisfy them forever, and newer
+    releases would never be installed, so they are resolved online first.
+    :param pip: The command to run pip with, e.g. `[".venv/bin/pip"]`.
+    :param requirements_file: The requirements file to install.
+    :param wheelhouse_folder: The folder of the shared wheelhouse.
+    :param pip_cache_folder: The folder of the shared pip cache.
+    :param group: The process group to run pip in.
+    :return: The CLI logs from the installation, including the wheelhouse hits and misses.
+    :raises: Exception if the installation fails.
+    """
+    create_folder(wheelhouse_folder)
+    create_folder(pip_cache_folder)
+
+    with open(requirements_file, "r") as file:
+        specifiers = parse_requirements(file.read())
+    record_requests(wheelhouse_folder, specifiers)
+
+    wheels = get_wheel_names(wheelhouse_folder)
+    hits = sum(get_requirement_name(specifier) in wheels for specifier in specifiers)
+    misses = len(specifiers) - hits
+    cache_lookups.inc(hits, cache="wheelhouse", result="hit")
+    cache_lookups.inc(misses, cache="wheelhouse", result="miss")
+
+    offline_install = [
+        *pip,
+        "install",
+        "--no-index",
+        "--find-links",
+        wheelhouse_folder,
+        "-r",
+        requirements_file,
+    ]
+    pinned = all(is_pinned(specifier) for specifier in specifiers)
+    ret = run_pip(offline_install, pip_cache_folder, group) if pinned else None
+    mode = "offline"
+
+    if ret is None or ret.returncode != 0:
+        # Fill the wheelhouse with the missing wheels, then install offline again
+        ret = build_wheels(
+            pip, ["-r", requirements_file], wheelhouse_folder, pip_cache_folder, group
+        )
+        if ret.returncode == 0:
+            ret = run_pip(offline_install, pip_cache_folder, group)
+        mode = "online"
+
+    if ret.returncode != 0:
+        err = Exception(f"Failed to install dependencies from {requirements_file}.")
+        err.add_note(ret.stderr.decode())
+        raise err
+
+    return (
+        ret.stdout.decode()
+        + f"Wheelhouse: {hits} hits, {misses} misses ({mode} install).\n"
+    )
+
+
+def prebuild_popular_wheels(
+    wheelhouse_folder: str,
+    pip_cache_folder: str,
+    min_requests: int = 3,
+    python: str = "python3",
+) -> str:
+    """
+    Build wheels for the requirements that were requested at least `min_requests` times.
+    Requirements that already have a wheel in the wheelhouse are skipped.
+    :return: The CLI logs from building the wheels.
+    """
+    stats_file = os.path.join(wheelhouse_folder, stats_file_name)
+    if not check_if_file_exists(stats_file):
+        return "Wheelhouse: no requests recorded yet.\n"
+
+    with lock_entry(stats_file):
+        with open(stats_file, "r") as file:
+            stats = json.load(file)
+
+    wheels = get_wheel_names(wheelhouse_folder)
+    popular = [
+        specifier
+        for specifier, count in sorted(stats.items(), key=lambda item: -item[1])
+        if count >= min_requests and get_requirement_name(specifier) not in wheels
+    ]
+    if not popular:
+        return "Wheelhouse: all popular wheels are built.\n"
+
+    ret = build_wheels(
+        [python, "-m", "pip"], popular, wheelhouse_folder, pip_cache_folder
+    )
+
+    if ret.returncode != 0:
+        return f"Wheelhouse: failed to pre-build wheels.\n{ret.stderr.decode()}"
+    return f"Wheelhouse: pre-built wheels for {', '.join(popular)}.\n"
@@ -0,0 +1,203 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from src.modules.utils import check_if_folder_exists, create_folder, remove_folder
+
+# The folder in each root that finished workspaces are moved to until they are deleted
+TRASH_FOLDER = ".trash"
+
+
+class WorkspaceManager:
+    """
+    Creates the workspaces of jobs, and deletes them off the critical path of the jobs.
+
+    A finished workspace is renamed into the trash folder of its root, which is
+    instant, and deleted by a background reaper. The reaper deletes at most
+    `max_files_per_second` files per second, so that a large workspace does not
+    starve the running jobs of disk I/O.
+
+    With a tmpfs folder, workspaces are created in memory while the pool has room:
+    the pool holds at most `tmpfs_max_bytes`, and each workspace reserves
+    `tmpfs_workspace_bytes` of it until it has been deleted. Other workspaces
+    fall back to the disk.
+    """
+
+    def __init__(
+        self,
+        root: str = "./temp",
+        tmpfs_folder: str | None = None,
+        tmpfs_max_bytes: int = 0,
+        tmpfs_workspace_bytes: int = 512 * 1024**2,
+        max_files_per_second: int = 0,
+    ):
+        """
+        :param root: The folder of the workspaces on disk.
+        :param tmpfs_folder: The folder of the workspaces in memory, e.g. `/dev/shm/ci`. Disabled if None.
+        Its content is removed by `remove_stale`, so it must not be shared with anything else.
+        :param tmpfs_max_bytes: The size of the tmpfs pool.
+        :param tmpfs_workspace_bytes: The size that a workspace is expected to reach, reserved in the pool.
+        :param max_files_per_second: The number of files the reaper deletes per second, no limit if 0.
+        """
+        self.root = root
+        self.tmpfs_folder = tmpfs_folder
+        self.tmpfs_max_bytes = tmpfs_max_bytes
+        self.tmpfs_workspace_bytes = tmpfs_workspace_bytes
+        self.max_files_per_second = max_files_per_second
+
+        # The workspaces that reserve room in the tmpfs pool, until they are deleted
+        self._in_memory: set[str] = set()
+        self._trash: deque[tuple[str, str]] = deque()
+        self._condition = threading.Condition()
+        self._reaper: threading.Thread | None = None
+        # Set while the reaper deletes a workspace that has left the trash queue
+        self._deleting = False
+
+    def allocate(self, id: str) -> str:
+        """
+        Create the workspace of a job, in the tmpfs pool if it has room.
+        :param id: The ID of the job.
+        :return: The path of the empty workspace.
+        """
+        with self._condition:
+            in_memory = self._has_room()
+            if in_memory:
+                self._in_memory.add(id)
+
+        path = os.path.join(self.tmpfs_folder if in_memory else self.root, id)
+        try:
+            create_folder(path)
+        except OSError:
+            self._free(id)
+            raise
+        return path
+
+    def _has_room(self) -> bool:
+        # Called with the condition held
+        if not self.tmpfs_folder or not self.tmpfs_max_bytes:
+            return False
+        reserved = (len(self._in_memory) + 1) * self.tmpfs_workspace_bytes
+        if reserved > self.tmpfs_max_bytes:
+            return False
+        try:
+            create_folder(self.tmpfs_folder)
+            free = shutil.disk_usage(self.tmpfs_folder).free
+        except OSError as e:
+            logging.warning(f"The tmpfs folder {self.tmpfs_folder} is unusable: {e}")
+            return False
+        return free >= self.tmpfs_workspace_bytes
+
+    def release(self, path: str) -> None:
+        """
+        Move a finished workspace to the trash, to be deleted in the background.
+        The workspace is deleted right away if it cannot be moved.
+        """
+        id = os.path.basename(os.path.normpath(path))
+        trash = os.path.join(os.path.dirname(os.path.normpath(path)), TRASH_FOLDER)
+
+        if not check_if_folder_exists(path):
+            self._free(id)
+            return
+        try:
+            create_folder(trash)
+            # A unique name, in case a job is run again with the same ID
+            trashed = os.path.join(trash, f"{id}-{time.time_ns()}")
+            os.rename(path, trashed)
+        except OSError as e:
+            logging.warning(f"[{id}] Failed to move the workspace to the trash: {e}")
+            remove_folder(path)
+            self._free(id)
+            return
+
+        with self._condition:
+            self._trash.append((id, trashed))
+            self._condition.notify()
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap, name="workspace-reaper", daemon=True
+                )
+                self._reaper.start()
+
+    def _free(self, id: str) -> None:
+        with self._condition:
+            self._in_memory.discard(id)
+
+    def pending(self) -> int:
+        """
+        Returns the number of workspaces in the trash that have not been deleted yet.
+        """
+        with self._condition:
+            return len(self._trash)
+
+    def flush(self, timeout: float) -> bool:
+        """
+        Wait for the trash to be empty.
+        :return: False if there were still workspaces in the trash after the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._trash or self._deleting:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _reap(self) -> None:
+        while True:
+            with self._condition:
+                while not self._trash:
+                    self._condition.wait()
+                id, path = self._trash.popleft()
+                self._deleting = True
+
+            try:
+                self._delete(path)
+            except OSError as e:
+                logging.warning(f"[{id}] Failed to delete the workspace {path}: {e}")
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                with self._condition:
+                    self._in_memory.discard(id)
+                    self._deleting = False
+                    self._condition.notify_all()
+
+    def _delete(self, path: str) -> None:
+        # Delete the files one by one, pausing when they go faster than the limit
+        started = time.monotonic()
+        deleted = 0
+        for folder, folders, files in os.walk(path, topdown=False):
+            for name in files:
+                os.unlink(os.path.join(folder, name))
+                deleted += 1
+                if self.max_files_per_second and deleted % 100 == 0:
+                    ahead = deleted / self.max_files_per_second - (
+                        time.monotonic() - started
+                    )
+                    if ahead > 0:
+                        time.sleep(ahead)
+            for name in folders:
+                child = os.path.join(folder, name)
+                # Symbolic links to folders, e.g. `.venv`, are listed as folders
+                if os.path.islink(child):
+                    os.unlink(child)
+                else:
+                    os.rmdir(child)
+        os.rmdir(path)
+
+    def remove_stale(self) -> None:
+        """
+        Remove the workspaces and the trash left by jobs that were running when the
+        server last stopped or crashed. Must be called before any job starts.
+        """
+        for root in [self.root, self.tmpfs_folder]:
+            if not root or not check_if_folder_exists(root):
+                continue
+            for name in os.listdir(root):
+                if name != TRASH_FOLDER:
+                    logging.info(
+                        f"[{name}] Removing the workspace left by an interrupted job."
+                    )
+                remove_folder(os.path.join(root, name))
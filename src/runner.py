@@ -0,0 +1,96 @@
+"""
+Runs the CI jobs of a broker on this node, see `CI_MODE=broker` in the README.
+
+Usage: python -m src.runner [--name NAME] [--workers N]
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+from src.jobs import ci_check, close_job, notifier, workspaces
+from src.modules.broker import get_broker
+from src.modules.config import (
+    BROKER,
+    LOGS_FOLDER,
+    MAX_QUEUE_DEPTH,
+    MAX_WORKERS,
+    RUNNER_LEASE_SECONDS,
+    RUNNER_POLL_SECONDS,
+    RUNNER_TOKEN,
+    SUPERSEDE_JOBS,
+)
+from src.modules.logs import check_if_job_log_exists, read_job_log
+from src.modules.runner import Runner
+from src.modules.scheduler import Job
+from src.modules.types import JobMetadata
+
+
+def run_claimed_job(job: Job) -> JobMetadata | None:
+    """
+    Runs a job claimed from the broker, and returns its result for the broker.
+    The job also stores its result in the local job store, like in the server's own workers.
+    """
+    if job.final_status is not None:
+        close_job(job)
+    else:
+        ci_check(job.payload, job.id, job.group, job.time_started - job.time_enqueued)
+    if not check_if_job_log_exists(job.id, LOGS_FOLDER):
+        return None
+    return read_job_log(job.id, LOGS_FOLDER)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.runner", description=__doc__.split("\n\n")[1]
+    )
+    parser.add_argument(
+        "--name",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="The name of the runner, unique across the nodes.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="The number of jobs to run at the same time.",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    broker = get_broker(
+        BROKER,
+        RUNNER_TOKEN,
+        LOGS_FOLDER,
+        max_queue_depth=MAX_QUEUE_DEPTH,
+        supersede=SUPERSEDE_JOBS,
+        lease=RUNNER_LEASE_SECONDS,
+    )
+    runner = Runner(
+        broker,
+        run_claimed_job,
+        args.name,
+        args.workers,
+        RUNNER_LEASE_SECONDS,
+        RUNNER_POLL_SECONDS,
+    )
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    # The runner posts the commit statuses of its jobs itself
+    notifier.start()
+    workspaces.remove_stale()
+    runner.start()
+    logging.info(f"Runner {args.name} is claiming jobs from {BROKER}.")
+    stopping.wait()
+    logging.info(f"Runner {args.name} is stopping after its current jobs.")
+    runner.stop()
+    notifier.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
+import os
+import subprocess
 import unittest
+from unittest.mock import patch
 from src.modules.actions import (
     checkout_ref,
     clone_repo,
+    fetch_commit,
+    get_changed_python_files,
+    split_in_batches,
     setup_dependencies,
     run_linter_check,
     run_tests,
@@ -10,7 +16,19 @@ from src.modules.utils import (
     check_if_file_exists,
     check_if_folder_exists,
     remove_folder,
+    write_to_file,
 )
+from src.modules.types import PushEventPayload
+
+
+def git(cwd: str, *args: str) -> str:
+    ret = subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@kth.se", *args],
+        capture_output=True,
+        check=True,
+        cwd=cwd,
+    )
+    return ret.stdout.decode().strip()
 
 
 class ActionsTest(unittest.TestCase):
@@ -114,5 +132,158 @@ class ActionsTest(unittest.TestCase):
         self.assertTrue("FAILED" in logs)
 
 
+class FetchCommitTest(unittest.TestCase):
+    # Set up a local origin repository with a few commits
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/fetch_commit_test/")
+        self.origin = os.path.join(self.ephemeral_folder, "origin", "sample-repo")
+        self.workspace = os.path.join(self.ephemeral_folder, "workspace")
+        self.repo_folder = os.path.join(self.workspace, "sample-repo")
+
+        write_to_file(os.path.join(self.origin, "README.md"), "sample")
+        git(self.origin, "init", "--quiet", "--initial-branch=main")
+        for file_name in ["first.txt", "second.txt", "third.txt"]:
+            write_to_file(os.path.join(self.origin, file_name), file_name)
+            git(self.origin, "add", ".")
+            git(self.origin, "commit", "--quiet", "-m", file_name)
+        self.middle_sha = git(self.origin, "rev-parse", "HEAD~1")
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def test_fetch_commit_shallow(self):
+        logs = fetch_commit(self.origin, self.workspace, self.middle_sha)
+        checkout_ref(self.repo_folder, self.middle_sha)
+
+        self.assertTrue(check_if_file_exists(self.repo_folder + "/second.txt"))
+        self.assertFalse(check_if_file_exists(self.repo_folder + "/third.txt"))
+        # Only the fetched commit is in the history
+        self.assertEqual(git(self.repo_folder, "rev-list", "--count", "HEAD"), "1")
+        self.assertIn("object store size", logs)
+        self.assertNotIn("\r", logs)
+
+    def test_fetch_commit_blobless(self):
+        logs = fetch_commit(self.origin, self.workspace, self.middle_sha, blobless=True)
+        checkout_ref(self.repo_folder, self.middle_sha)
+
+        self.assertTrue(check_if_file_exists(self.repo_folder + "/second.txt"))
+        # The commit history is fetched in full
+        self.assertEqual(git(self.repo_folder, "rev-list", "--count", "HEAD"), "2")
+        self.assertIn("(blobless)", logs)
+
+    def test_fetch_commit_failure(self):
+        with self.assertRaises(Exception):
+            fetch_commit(self.origin, self.workspace, "0" * 40)
+
+
+class IncrementalLintTest(unittest.TestCase):
+    # Set up a repository with a syntax error, and a push that does not touch it
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/incremental_lint_test/")
+        self.repo_folder = os.path.join(self.ephemeral_folder, "sample-repo")
+
+        write_to_file(os.path.join(self.repo_folder, "broken.py"), "def broken(:\n")
+        write_to_file(os.path.join(self.repo_folder, "other.py"), "x = 1\n")
+        git(self.repo_folder, "init", "--quiet", "--initial-branch=main")
+        git(self.repo_folder, "add", ".")
+        git(self.repo_folder, "commit", "--quiet", "-m", "base")
+        self.before = git(self.repo_folder, "rev-parse", "HEAD")
+
+        write_to_file(os.path.join(self.repo_folder, "good.py"), "y = 2\n")
+        write_to_file(os.path.join(self.repo_folder, "notes.txt"), "notes")
+        write_to_file(os.path.join(self.repo_folder, "other.py"), "x = 2\n")
+        git(self.repo_folder, "add", ".")
+        git(self.repo_folder, "commit", "--quiet", "-m", "push")
+        self.after = git(self.repo_folder, "rev-parse", "HEAD")
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def mock_payload(
+        self, commits: list[dict], forced: bool = False
+    ) -> PushEventPayload:
+        return PushEventPayload(
+            after=self.after,
+            before=self.before,
+            commits=commits,
+            compare="https://github.com/owner/sample-repo/compare",
+            created=False,
+            deleted=False,
+            forced=forced,
+            pusher={"name": "Joel90689"},
+            ref="refs/heads/main",
+            repository={},
+            sender={},
+        )
+
+    def mock_commit(self, added: list[str], modified: list[str]) -> dict:
+        return {
+            "added": added,
+            "author": {"name": "test"},
+            "committer": {"name": "test"},
+            "distinct": True,
+            "id": self.after,
+            "message": "push",
+            "modified": modified,
+            "removed": [],
+            "timestamp": "2025-02-11T12:00:00Z",
+            "tree_id": "0" * 40,
+            "url": "https://github.com/owner/sample-repo/commit",
+        }
+
+    def test_changed_files_from_payload(self):
+        commit = self.mock_commit(["good.py", "notes.txt", "gone.py"], ["other.py"])
+
+        files = get_changed_python_files(self.repo_folder, self.mock_payload([commit]))
+
+        self.assertEqual(files, ["good.py", "other.py"])
+
+    def test_changed_files_from_git_diff_when_truncated(self):
+        commit = self.mock_commit([f"file{index}.py" for index in range(3000)], [])
+
+        files = get_changed_python_files(self.repo_folder, self.mock_payload([commit]))
+
+        self.assertEqual(files, ["good.py", "other.py"])
+
+    def test_forced_push_is_linted_in_full(self):
+        commit = self.mock_commit(["good.py"], [])
+        payload = self.mock_payload([commit], forced=True)
+
+        self.assertIsNone(get_changed_python_files(self.repo_folder, payload))
+
+    def test_lint_only_changed_files(self):
+        passed, _ = run_linter_check(self.repo_folder, files=["good.py", "other.py"])
+        self.assertTrue(passed)
+
+        passed, _ = run_linter_check(self.repo_folder)
+        self.assertFalse(passed)
+
+        passed, logs = run_linter_check(self.repo_folder, files=[])
+        self.assertTrue(passed)
+        self.assertIn("No changed Python files", logs)
+
+    def test_lint_changed_files_in_batches(self):
+        files = ["good.py", "other.py", "broken.py"]
+        with patch("src.modules.actions.LINT_BATCH_BYTES", 10):
+            passed, logs = run_linter_check(self.repo_folder, files=files)
+
+        self.assertFalse(passed)
+        self.assertIn("broken.py", logs)
+        self.assertEqual(
+            split_in_batches(files, 18), [["good.py", "other.py"], ["broken.py"]]
+        )
+
+    def test_lint_whole_project_above_max_files(self):
+        with patch("src.modules.actions.LINT_MAX_FILES", 1):
+            passed, logs = run_linter_check(
+                self.repo_folder, files=["good.py", "other.py"]
+            )
+
+        self.assertFalse(passed)
+        self.assertIn("broken.py", logs)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import subprocess
+import time
+import unittest
+from src.modules.async_actions import (
+    checkout_ref_async,
+    clone_repo_async,
+    run_linter_check_async,
+    run_tests_async,
+)
+from src.modules.processes import StageTimeoutError, run_command_async
+from src.modules.utils import check_if_folder_exists, remove_folder, write_to_file
+
+
+def git(cwd: str, *args: str) -> str:
+    result = subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@localhost", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+    return result.stdout.decode().strip()
+
+
+class RunCommandAsyncTest(unittest.IsolatedAsyncioTestCase):
+    async def test_output_is_captured(self):
+        result = await run_command_async(["sh", "-c", "echo out; echo err >&2; exit 3"])
+
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.stdout, b"out\n")
+        self.assertEqual(result.stderr, b"err\n")
+
+    async def test_timeout_kills_the_command(self):
+        started = time.monotonic()
+
+        with self.assertRaises(StageTimeoutError):
+            # The shell waits for a child, which must be killed as well
+            await run_command_async(["sh", "-c", "sleep 30 & wait"], timeout=0.2)
+
+        self.assertLess(time.monotonic() - started, 5)
+
+    async def test_cancelling_the_task_kills_the_command(self):
+        task = asyncio.create_task(run_command_async(["sleep", "30"]))
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+
+        task.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertLess(time.monotonic() - started, 5)
+
+    async def test_commands_run_concurrently(self):
+        started = time.monotonic()
+
+        results = await asyncio.gather(
+            *[run_command_async(["sleep", "0.5"]) for _ in range(20)]
+        )
+
+        self.assertEqual({result.returncode for result in results}, {0})
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class AsyncActionsTest(unittest.IsolatedAsyncioTestCase):
+    # Set up a repository with a test module, to clone from
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/async_actions_test/")
+        self.origin = os.path.join(self.ephemeral_folder, "origin", "sample-repo")
+        self.destination = os.path.join(self.ephemeral_folder, "workspace")
+        write_to_file(
+            os.path.join(self.origin, "test_sample.py"),
+            "import unittest\n\n\nclass SampleTest(unittest.TestCase):\n"
+            "    def test_sample(self):\n        self.assertTrue(True)\n",
+        )
+        git(self.origin, "init", "--quiet", "--initial-branch=main")
+        git(self.origin, "add", ".")
+        git(self.origin, "commit", "--quiet", "-m", "first")
+        self.sha = git(self.origin, "rev-parse", "HEAD")
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    async def test_clone_checkout_and_test(self):
+        await clone_repo_async(self.origin, self.destination)
+        repo_folder = os.path.join(self.destination, "sample-repo")
+        await checkout_ref_async(repo_folder, self.sha)
+
+        passed, logs = await run_tests_async(repo_folder)
+
+        self.assertTrue(passed)
+        self.assertIn("Ran 1 test", logs)
+
+    async def test_checkout_of_missing_commit_fails(self):
+        await clone_repo_async(self.origin, self.destination)
+
+        with self.assertRaises(Exception):
+            await checkout_ref_async(
+                os.path.join(self.destination, "sample-repo"), "0" * 40
+            )
+
+    async def test_linting(self):
+        check, _ = await run_linter_check_async(
+            "tests/fixtures/flake8_tests/syntax_correct"
+        )
+        self.assertTrue(check)
+
+        check, logs = await run_linter_check_async(
+            "tests/fixtures/flake8_tests/trigger_E9"
+        )
+        self.assertFalse(check)
+        self.assertIn("E9", logs)
+
+    async def test_failing_tests(self):
+        check, _ = await run_tests_async("tests/fixtures/unittests_tests/failing_tests")
+
+        self.assertFalse(check)
+
+
+if __name__ == "__main__":
+    unittest.main()
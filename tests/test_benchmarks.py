@@ -0,0 +1,65 @@
+import os
+import subprocess
+import unittest
+from benchmarks.compare import compare
+from benchmarks.fixtures import generate_repository, git, push_commit
+from benchmarks.stats import percentile, summarize
+from src.modules.utils import check_if_folder_exists, remove_folder
+
+
+def mock_results(throughput: float, p50: float) -> dict:
+    summary = summarize([p50])
+    return {
+        "throughput_jobs_per_second": throughput,
+        "latency_seconds": summary,
+        "queue_wait_seconds": summarize([]),
+        "stage_seconds": {"test": summary},
+        "memory": {"server_peak_rss_bytes": None},
+    }
+
+
+class BenchmarksTest(unittest.TestCase):
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/benchmarks_test/")
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def test_percentile_interpolates(self):
+        values = [4, 1, 3, 2, 5]
+
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertAlmostEqual(percentile(values, 95), 4.8)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize_empty(self):
+        self.assertEqual(summarize([])["count"], 0)
+        self.assertIsNone(summarize([])["mean"])
+
+    def test_compare_relative_change(self):
+        table = compare(mock_results(2.0, 1.0), mock_results(3.0, 0.5))
+        rows = {name: change for name, _, _, change in table}
+
+        self.assertEqual(rows["throughput (jobs/s)"], "+50.0%")
+        self.assertEqual(rows["end-to-end p50 (s)"], "-50.0%")
+        self.assertEqual(rows["queue wait p50 (s)"], "-")
+
+    def test_generated_repository_passes_its_tests(self):
+        repo = os.path.join(self.ephemeral_folder, "sample")
+        base = generate_repository(repo, 2, 3)
+
+        commit = push_commit(repo, "feature", base, "app/module1.py", 7)
+
+        self.assertEqual(git(repo, "rev-parse", "feature"), commit["id"])
+        self.assertEqual(commit["modified"], ["app/module1.py"])
+        self.assertIn("app/module1.py", git(repo, "show", "--stat", "HEAD"))
+        tests = subprocess.run(
+            ["python", "-m", "unittest"], cwd=repo, capture_output=True
+        )
+        self.assertEqual(tests.returncode, 0)
+        self.assertIn("Ran 6 tests", tests.stderr.decode())
+
+
+if __name__ == "__main__":
+    unittest.main()
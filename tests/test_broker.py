@@ -0,0 +1,226 @@
+import os
+import tempfile
+import time
+import unittest
+from src.modules.broker import (
+    Broker,
+    HTTPBroker,
+    LeaseLostError,
+    SQLiteBroker,
+    get_broker,
+    get_job_queue,
+)
+from src.modules.logs import read_job_log
+from src.modules.scheduler import JobQueue, QueueFullError
+from src.modules.types import JobMetadata, Status
+from tests.test_scheduler import mock_payload
+
+
+def mock_result(id: str) -> JobMetadata:
+    return JobMetadata(
+        id=id,
+        status=Status.SUCCESS,
+        repo_url="https://github.com/dd2480-spring-2025-group-1/assignment-1.git",
+        ref="refs/heads/main",
+        head_commit="b7f1a1c",
+        author="Joel90689",
+        time_started=0,
+        time_ended=1,
+        logs=["clone", "checkout", "setup", "lint", "test"],
+    )
+
+
+class SQLiteBrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.logs_folder = os.path.join(self.folder.name, "logs")
+        self.broker = SQLiteBroker(
+            os.path.join(self.folder.name, "broker.db"),
+            self.logs_folder,
+            max_queue_depth=2,
+            supersede=True,
+            lease=60,
+        )
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_claims_jobs_in_order(self):
+        """
+        Test that runners claim the oldest job first, and each job only once.
+        """
+        first = self.broker.submit(mock_payload(ref="refs/heads/a"))
+        second = self.broker.submit(mock_payload(ref="refs/heads/b"))
+
+        claimed = self.broker.claim("runner-1")
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual(claimed.payload, first.payload)
+        self.assertAlmostEqual(claimed.time_enqueued, first.time_enqueued)
+        self.assertEqual(self.broker.claim("runner-2").id, second.id)
+        self.assertIsNone(self.broker.claim("runner-3"))
+
+    def test_snapshot(self):
+        """
+        Test that the snapshot lists the pending and running jobs, and the capacity of the runners.
+        """
+        first = self.broker.submit(mock_payload(ref="refs/heads/a"))
+        second = self.broker.submit(mock_payload(ref="refs/heads/b"))
+        self.broker.claim("runner-1", capacity=4)
+
+        snapshot = self.broker.snapshot()
+        self.assertEqual([job["id"] for job in snapshot["pending"]], [second.id])
+        self.assertEqual([job["id"] for job in snapshot["running"]], [first.id])
+        self.assertEqual(snapshot["running"][0]["runner"], "runner-1")
+        self.assertEqual(snapshot["running"][0]["head_commit"], "b7f1a1c")
+        self.assertEqual(snapshot["max_workers"], 4)
+        self.assertEqual(snapshot["max_queue_depth"], 2)
+
+    def test_queue_full(self):
+        """
+        Test that jobs are rejected when the pending jobs are at the maximum depth.
+        """
+        self.broker.submit(mock_payload(ref="refs/heads/a"))
+        self.broker.submit(mock_payload(ref="refs/heads/b"))
+        with self.assertRaises(QueueFullError) as context:
+            self.broker.submit(mock_payload(ref="refs/heads/c"))
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+
+        # Claimed jobs do not count towards the depth
+        self.broker.claim("runner-1")
+        self.broker.submit(mock_payload(ref="refs/heads/c"))
+
+    def test_complete_stores_result(self):
+        """
+        Test that a completed job leaves the queue, and its result is in the job store.
+        """
+        job = self.broker.submit(mock_payload())
+        self.broker.claim("runner-1")
+        self.broker.complete(job.id, "runner-1", mock_result(job.id))
+
+        self.assertEqual(self.broker.snapshot()["running"], [])
+        stored = read_job_log(job.id, self.logs_folder)
+        self.assertEqual(stored.status, Status.SUCCESS)
+        self.assertEqual(stored.logs, mock_result(job.id).logs)
+
+    def test_supersede_pending_job(self):
+        """
+        Test that a job drops the pending job of the same repository and ref.
+        """
+        self.broker.submit(mock_payload("1111111"))
+        newer = self.broker.submit(mock_payload("2222222"))
+
+        pending = self.broker.snapshot()["pending"]
+        self.assertEqual([job["id"] for job in pending], [newer.id])
+
+    def test_supersede_running_job(self):
+        """
+        Test that the runner of a superseded job is told to cancel it on its next heartbeat.
+        """
+        older = self.broker.submit(mock_payload("1111111"))
+        self.broker.claim("runner-1")
+        self.assertFalse(self.broker.heartbeat(older.id, "runner-1"))
+
+        self.broker.submit(mock_payload("2222222"))
+        self.assertTrue(self.broker.heartbeat(older.id, "runner-1"))
+
+    def test_expired_lease(self):
+        """
+        Test that the job of a runner whose lease expired is given to another runner,
+        and that the first runner can no longer report on it.
+        """
+        self.broker.lease = 0.05
+        job = self.broker.submit(mock_payload())
+        self.broker.claim("runner-1")
+        self.assertIsNone(self.broker.claim("runner-2"))
+
+        time.sleep(0.1)
+        self.assertEqual(self.broker.snapshot()["pending"][0]["id"], job.id)
+        self.assertEqual(self.broker.claim("runner-2").id, job.id)
+        with self.assertRaises(LeaseLostError):
+            self.broker.heartbeat(job.id, "runner-1")
+        with self.assertRaises(LeaseLostError):
+            self.broker.complete(job.id, "runner-1", mock_result(job.id))
+
+    def test_closes_job_after_max_attempts(self):
+        """
+        Test that a job whose runners keep dying is not run again, but given to a runner
+        to close with an error.
+        """
+        self.broker.lease = 0.01
+        self.broker.submit(mock_payload())
+        for _ in range(self.broker.max_attempts):
+            self.assertIsNone(self.broker.claim("runner-1").final_status)
+            time.sleep(0.02)
+
+        self.broker.lease = 60
+        job = self.broker.claim("runner-1")
+        self.assertEqual(job.final_status, Status.ERROR)
+        self.broker.complete(job.id, "runner-1", mock_result(job.id))
+        self.assertIsNone(self.broker.claim("runner-1"))
+
+    def test_closes_superseded_job_after_expired_lease(self):
+        """
+        Test that a superseded job whose runner died is given to a runner to close as cancelled,
+        as its runner may have posted a pending status.
+        """
+        self.broker.lease = 0.05
+        older = self.broker.submit(mock_payload("1111111"))
+        self.broker.claim("runner-1")
+        newer = self.broker.submit(mock_payload("2222222"))
+        time.sleep(0.1)
+
+        job = self.broker.claim("runner-2")
+        self.assertEqual(job.id, older.id)
+        self.assertEqual(job.final_status, Status.CANCELLED)
+        self.assertEqual(job.superseded_by, newer.id)
+        self.assertIsNone(self.broker.claim("runner-2").final_status)
+
+    def test_shared_between_instances(self):
+        """
+        Test that brokers opened on the same file, e.g. by the API and a runner, share the jobs.
+        """
+        job = self.broker.submit(mock_payload())
+        other = SQLiteBroker(self.broker.database_file, self.logs_folder)
+        self.assertEqual(other.claim("runner-1").id, job.id)
+
+
+class GetBrokerTest(unittest.TestCase):
+    def test_url(self):
+        broker = get_broker("http://ci.example.com:8001/", "token")
+        self.assertIsInstance(broker, HTTPBroker)
+        self.assertEqual(broker.url, "http://ci.example.com:8001")
+
+    def test_url_without_token(self):
+        with self.assertRaises(ValueError):
+            get_broker("https://ci.example.com")
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "broker.db")
+            broker = get_broker(path, lease=30)
+            self.assertIsInstance(broker, SQLiteBroker)
+            self.assertEqual(broker.lease, 30)
+            self.assertTrue(os.path.exists(path))
+
+    def test_job_queue(self):
+        with tempfile.TemporaryDirectory() as folder:
+            queue = get_job_queue(os.path.join(folder, "broker.db"), folder)
+            self.assertIsInstance(queue, JobQueue)
+            self.assertIsInstance(queue, Broker)
+
+    def test_job_queue_url(self):
+        """
+        Test that the server refuses to submit its jobs to the broker of another server.
+        """
+        with self.assertRaises(ValueError):
+            get_job_queue("http://ci.example.com:8001")
+
+    def test_runner_side_only(self):
+        broker = get_broker("http://ci.example.com:8001/", "token")
+        self.assertNotIsInstance(broker, JobQueue)
+        with self.assertRaises(TypeError):
+            Broker()
+
+
+if __name__ == "__main__":
+    unittest.main()
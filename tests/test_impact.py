@@ -0,0 +1,134 @@
+import json
+import os
+import unittest
+from src.modules.actions import run_tests
+from src.modules.impact import (
+    build_test_map,
+    get_imports,
+    record_test_run,
+    select_tests,
+)
+from src.modules.utils import check_if_folder_exists, remove_folder, write_to_file
+
+
+def mock_test_module(imports: str) -> str:
+    return f"""import unittest
+{imports}
+
+
+class MockTest(unittest.TestCase):
+    def test_import(self):
+        self.assertTrue(True)
+"""
+
+
+class ImpactTest(unittest.TestCase):
+    # Set up a project with two modules, one of them used by the other, and a test for each
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/impact_test/")
+        self.project = os.path.join(self.ephemeral_folder, "project")
+        self.state_file = os.path.join(self.ephemeral_folder, "state.json")
+        files = {
+            "app/__init__.py": "",
+            "app/utils.py": "def add(a, b):\n    return a + b\n",
+            "app/core.py": "from .utils import add\n",
+            "tests/__init__.py": "",
+            "tests/test_utils.py": mock_test_module("from app import utils"),
+            "tests/test_core.py": mock_test_module("import app.core"),
+            "README.md": "# Project",
+        }
+        for path, content in files.items():
+            write_to_file(os.path.join(self.project, path), content)
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def test_relative_imports(self):
+        imports = get_imports(
+            b"from ..utils import add\nfrom . import x", "a.b.c", False
+        )
+
+        self.assertEqual(imports, ["a.b", "a.b.x", "a.utils", "a.utils.add"])
+
+    def test_map_follows_transitive_imports(self):
+        test_map, _ = build_test_map(self.project)
+
+        self.assertEqual(
+            test_map["tests.test_core"],
+            [
+                "app/__init__.py",
+                "app/core.py",
+                "app/utils.py",
+                "tests/__init__.py",
+                "tests/test_core.py",
+            ],
+        )
+        self.assertNotIn("app/core.py", test_map["tests.test_utils"])
+
+    def test_select_affected_tests(self):
+        modules, _ = select_tests(self.project, ["app/core.py"], self.state_file, 10)
+        self.assertEqual(modules, ["tests.test_core"])
+
+        modules, _ = select_tests(self.project, ["app/utils.py"], self.state_file, 10)
+        self.assertEqual(modules, ["tests.test_core", "tests.test_utils"])
+
+        modules, _ = select_tests(self.project, ["README.md"], self.state_file, 10)
+        self.assertEqual(modules, [])
+
+    def test_all_tests_run_when_unsure(self):
+        for changed_files in [None, ["requirements.txt"], ["app/removed.py"]]:
+            modules, _ = select_tests(self.project, changed_files, self.state_file, 10)
+            self.assertIsNone(modules)
+
+    def test_periodic_full_run(self):
+        runs = []
+        for _ in range(4):
+            modules, _ = select_tests(self.project, ["app/core.py"], self.state_file, 2)
+            record_test_run(self.state_file, modules is not None)
+            runs.append(modules)
+
+        self.assertEqual(
+            runs, [["tests.test_core"], ["tests.test_core"], None, ["tests.test_core"]]
+        )
+
+    def test_only_recorded_runs_count(self):
+        """
+        Test that selections whose tests did not run to the end do not put off the full run.
+        """
+        for _ in range(3):
+            modules, _ = select_tests(self.project, ["app/core.py"], self.state_file, 1)
+            self.assertEqual(modules, ["tests.test_core"])
+
+        record_test_run(self.state_file, True)
+        modules, _ = select_tests(self.project, ["app/core.py"], self.state_file, 1)
+        self.assertIsNone(modules)
+
+    def test_unchanged_files_are_not_parsed_again(self):
+        select_tests(self.project, ["app/core.py"], self.state_file, 10)
+        with open(self.state_file, "r") as file:
+            state = json.load(file)
+        # A stale entry with the same hash is trusted, so it shows up in the next map
+        state["files"]["app/utils.py"][1] = ["app.core"]
+        with open(self.state_file, "w") as file:
+            json.dump(state, file)
+
+        modules, _ = select_tests(self.project, ["app/core.py"], self.state_file, 10)
+
+        self.assertEqual(modules, ["tests.test_core", "tests.test_utils"])
+
+    def test_run_selected_tests(self):
+        for shards in [1, 2]:
+            success, logs = run_tests(
+                self.project, shards=shards, test_modules=["tests.test_core"]
+            )
+            self.assertTrue(success)
+            self.assertIn("Ran 1 test", logs)
+
+        success, logs = run_tests(self.project, test_modules=[])
+        self.assertTrue(success)
+        self.assertIn("No tests are affected", logs)
+
+
+if __name__ == "__main__":
+    unittest.main()
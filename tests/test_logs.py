@@ -1,9 +1,30 @@
+import asyncio
 import unittest
 import os
 import json
-from src.modules.logs import get_job_logs, write_job_log, read_job_log
-from src.modules.utils import check_if_folder_exists, remove_folder
-from src.modules.types import JobMetadata
+import shutil
+import sqlite3
+import time
+from unittest.mock import patch
+from src.modules.logs import (
+    archive_live_log,
+    check_if_job_log_exists,
+    check_if_live_log_exists,
+    find_cached_result,
+    format_event,
+    get_job_logs,
+    get_live_log_path,
+    list_jobs,
+    read_log_section,
+    remove_expired_live_logs,
+    store_cached_result,
+    tail_log_section,
+    tail_live_log,
+    write_job_log,
+    read_job_log,
+)
+from src.modules.utils import check_if_folder_exists, remove_folder, write_to_file
+from src.modules.types import JobMetadata, Status
 from typing import Optional, List
 
 
@@ -17,6 +38,12 @@ class TestUtils(unittest.TestCase):
         if check_if_folder_exists(self.ephemeral_folder):
             remove_folder(self.ephemeral_folder)
 
+    # Copy a fixture, as reading it migrates it to the job store
+    def copy_fixture(self, name: str) -> str:
+        folder = os.path.join(self.ephemeral_folder, name)
+        shutil.copytree(os.path.join(self.fixture_folder, name), folder)
+        return folder
+
     # Function for creating mock JobMetadata
     def mock_metadata(
         self,
@@ -36,6 +63,7 @@ class TestUtils(unittest.TestCase):
             "Mocked log 3",
             "Mocked log 4",
         ],
+        log_sections: Optional[List[str]] = [],
     ) -> JobMetadata:
         return JobMetadata(
             id=id,
@@ -47,13 +75,14 @@ class TestUtils(unittest.TestCase):
             time_started=time_started,
             time_ended=time_ended,
             logs=logs,
+            log_sections=log_sections,
         )
 
     def test_get_job_logs(self):
         """
         Test getting multiple log ids and verifying what is returned.
         """
-        result = get_job_logs(os.path.join(self.fixture_folder, "multiple_log"))
+        result = get_job_logs(self.copy_fixture("multiple_log"))
 
         self.assertListEqual(result, ["ad21", "df44"])
 
@@ -61,7 +90,7 @@ class TestUtils(unittest.TestCase):
         """
         Test getting a single log id and verifying what has been returned.
         """
-        result = get_job_logs(os.path.join(self.fixture_folder, "single_log"))
+        result = get_job_logs(self.copy_fixture("single_log"))
 
         self.assertListEqual(result, ["ad21"])
 
@@ -116,7 +145,7 @@ class TestUtils(unittest.TestCase):
             Exception,
             read_job_log,
             "xxxx",
-            os.path.join(self.fixture_folder, "multiple_log"),
+            self.copy_fixture("multiple_log"),
         )
 
     def test_read_job_logs_and_write_job_logs_and_get_job_logs(self):
@@ -144,6 +173,370 @@ class TestUtils(unittest.TestCase):
         self.assertIn("bd34", logResult)
         self.assertEqual(len(logResult), 2)
 
+    def test_write_job_log_keeps_the_first_write(self):
+        """
+        Test that writing a log with an ID that is already stored does not overwrite it.
+        """
+        write_job_log("ad21", self.mock_metadata("ad21"), self.ephemeral_folder)
+        write_job_log(
+            "ad21", self.mock_metadata("ad21", status="failure"), self.ephemeral_folder
+        )
+
+        self.assertEqual(
+            read_job_log("ad21", self.ephemeral_folder), self.mock_metadata("ad21")
+        )
+        self.assertListEqual(get_job_logs(self.ephemeral_folder), ["ad21"])
+
+    def test_migrate_json_logs(self):
+        """
+        Test that the logs of the JSON store are imported once, keeping their order.
+        """
+        folder = self.copy_fixture("multiple_log")
+        for id in ["df44", "zz99"]:
+            with open(os.path.join(folder, f"{id}.json"), "w") as outfile:
+                json.dump(self.mock_metadata(id).model_dump(mode="json"), outfile)
+
+        self.assertListEqual(get_job_logs(folder), ["ad21", "df44", "zz99"])
+        self.assertEqual(read_job_log("df44", folder), self.mock_metadata("df44"))
+        self.assertFalse(check_if_job_log_exists("ad21", folder))
+        self.assertTrue(check_if_job_log_exists("zz99", folder))
+        self.assertListEqual(
+            sorted(name for name in os.listdir(folder) if name.endswith(".json")), []
+        )
+        # The JSON store is kept aside, so that it can be restored
+        self.assertListEqual(
+            sorted(os.listdir(os.path.join(folder, "migrated"))),
+            ["df44.json", "zz99.json"],
+        )
+        self.assertTrue(os.path.exists(os.path.join(folder, "log_list.json.migrated")))
+
+        write_job_log("ab12", self.mock_metadata("ab12"), folder)
+        self.assertListEqual(get_job_logs(folder), ["ad21", "df44", "zz99", "ab12"])
+
+    def test_list_jobs_pages_newest_first(self):
+        """
+        Test that following the cursors lists every job once, newest first.
+        """
+        for index in range(5):
+            write_job_log(
+                f"id{index}", self.mock_metadata(f"id{index}"), self.ephemeral_folder
+            )
+
+        first_page, cursor = list_jobs(self.ephemeral_folder, limit=2)
+        second_page, cursor = list_jobs(self.ephemeral_folder, limit=2, cursor=cursor)
+        last_page, cursor = list_jobs(self.ephemeral_folder, limit=2, cursor=cursor)
+
+        ids = [job["id"] for job in first_page + second_page + last_page]
+        self.assertListEqual(ids, ["id4", "id3", "id2", "id1", "id0"])
+        self.assertIsNone(cursor)
+        self.assertEqual(
+            first_page[0]["repo"], "dd2480-spring-2025-group-1/assignment-1"
+        )
+        self.assertEqual(first_page[0]["head_commit"], "b7f1a1c")
+        self.assertEqual(first_page[0]["duration"], 20)
+
+    def test_list_jobs_filters(self):
+        """
+        Test filtering the jobs by their summary fields and by time.
+        """
+        write_job_log("ad21", self.mock_metadata("ad21"), self.ephemeral_folder)
+        write_job_log(
+            "df44",
+            self.mock_metadata("df44", status="failure", ref="dev", author="alice"),
+            self.ephemeral_folder,
+        )
+        write_job_log(
+            "gh55",
+            self.mock_metadata(
+                "gh55",
+                repo_url="https://github.com/someone/other",
+                time_started=1739277000,
+                time_ended=1739277030,
+            ),
+            self.ephemeral_folder,
+        )
+
+        def ids(**filters) -> list[str]:
+            jobs, _ = list_jobs(self.ephemeral_folder, **filters)
+            return [job["id"] for job in jobs]
+
+        self.assertListEqual(ids(status=Status.FAILURE), ["df44"])
+        self.assertListEqual(ids(ref="main"), ["gh55", "ad21"])
+        self.assertListEqual(ids(author="alice"), ["df44"])
+        self.assertListEqual(ids(repo="someone/other"), ["gh55"])
+        self.assertListEqual(ids(since=1739276500), ["gh55"])
+        self.assertListEqual(ids(until=1739276500, ref="main"), ["ad21"])
+
+    def test_read_log_section(self):
+        """
+        Test reading ranges of a large section, across its compressed blocks.
+        """
+        test_log = "".join(f"line {index}\n" for index in range(100000))
+        mock = self.mock_metadata(
+            "ad21", logs=["clone", "checkout", "setup", "lint", test_log]
+        )
+        write_job_log("ad21", mock, self.ephemeral_folder)
+
+        content, size = read_log_section("ad21", "test", self.ephemeral_folder)
+        self.assertEqual(content.decode(), test_log)
+        self.assertEqual(size, len(test_log))
+
+        content, _ = read_log_section(
+            "ad21", "test", self.ephemeral_folder, 300000, 300020
+        )
+        self.assertEqual(content.decode(), test_log[300000:300020])
+
+        self.assertEqual(read_job_log("ad21", self.ephemeral_folder), mock)
+        self.assertRaises(
+            Exception, read_log_section, "ad21", "deploy", self.ephemeral_folder
+        )
+
+    def test_tail_log_section(self):
+        """
+        Test reading the last lines of a section, including one without a trailing newline.
+        """
+        mock = self.mock_metadata(
+            "ad21",
+            logs=["one\ntwo\nthree\n", "one\ntwo"],
+            log_sections=["first", "second"],
+        )
+        write_job_log("ad21", mock, self.ephemeral_folder)
+
+        self.assertEqual(
+            tail_log_section("ad21", "first", 2, self.ephemeral_folder), b"two\nthree\n"
+        )
+        self.assertEqual(
+            tail_log_section("ad21", "first", 10, self.ephemeral_folder),
+            b"one\ntwo\nthree\n",
+        )
+        self.assertEqual(
+            tail_log_section("ad21", "second", 1, self.ephemeral_folder), b"two"
+        )
+
+    def test_read_log_section_of_migrated_job(self):
+        """
+        Test that the sections of jobs imported from the JSON store can still be read.
+        """
+        folder = self.copy_fixture("single_log")
+        with open(os.path.join(folder, "ad21.json"), "w") as outfile:
+            json.dump(self.mock_metadata("ad21").model_dump(mode="json"), outfile)
+
+        content, size = read_log_section("ad21", "checkout", folder, 11)
+        self.assertEqual(content, b"2")
+        self.assertEqual(size, len("Mocked log 2"))
+        self.assertEqual(tail_log_section("ad21", "lint", 1, folder), b"Mocked log 4")
+
+    def test_cached_result(self):
+        """
+        Test that the first result of a tree is kept, per CI configuration.
+        """
+        self.assertIsNone(find_cached_result("tree", "config", self.ephemeral_folder))
+
+        store_cached_result(
+            "tree", "config", "ad21", Status.FAILURE, self.ephemeral_folder
+        )
+        store_cached_result(
+            "tree", "config", "df44", Status.SUCCESS, self.ephemeral_folder
+        )
+
+        self.assertEqual(
+            find_cached_result("tree", "config", self.ephemeral_folder),
+            ("ad21", Status.FAILURE),
+        )
+        self.assertIsNone(find_cached_result("tree", "other", self.ephemeral_folder))
+
+    def test_job_store_is_initialized_once(self):
+        """
+        Test that the schema is only created on the first use of the job store,
+        and again if the job store has been removed.
+        """
+        statements = []
+        connect = sqlite3.connect
+
+        def traced_connect(*args, **kwargs):
+            connection = connect(*args, **kwargs)
+            connection.set_trace_callback(statements.append)
+            return connection
+
+        with patch("src.modules.logs.sqlite3.connect", traced_connect):
+            list_jobs(self.ephemeral_folder)
+            list_jobs(self.ephemeral_folder)
+            self.assertEqual(statements.count("PRAGMA journal_mode=WAL"), 1)
+
+            remove_folder(self.ephemeral_folder)
+            self.assertEqual(list_jobs(self.ephemeral_folder), ([], None))
+            self.assertEqual(statements.count("PRAGMA journal_mode=WAL"), 2)
+
+    def test_tail_live_log_follows_until_job_completes(self):
+        """
+        Test that lines written while tailing are yielded, and that tailing stops once the job log is written.
+        """
+        live_log_file = get_live_log_path("ad21", self.ephemeral_folder)
+        write_to_file(live_log_file, "first\n")
+
+        async def tail() -> list[str]:
+            return [
+                line
+                async for line in tail_live_log(
+                    "ad21", self.ephemeral_folder, poll_interval=0.05
+                )
+            ]
+
+        async def write_more() -> None:
+            await asyncio.sleep(0.2)
+            with open(live_log_file, "a") as file:
+                file.write("second\nthi")
+            await asyncio.sleep(0.2)
+            with open(live_log_file, "a") as file:
+                file.write("rd\n")
+            write_job_log("ad21", self.mock_metadata("ad21"), self.ephemeral_folder)
+
+        async def run() -> list[str]:
+            lines, _ = await asyncio.gather(tail(), write_more())
+            return lines
+
+        self.assertListEqual(asyncio.run(run()), ["first", "second", "third"])
+
+    def test_tail_live_log_does_not_block_event_loop(self):
+        """
+        Test that tailing does not hold the event loop while it waits for the job store.
+        """
+        live_log_file = get_live_log_path("ad21", self.ephemeral_folder)
+        write_to_file(live_log_file, "first\n")
+        write_job_log("ad21", self.mock_metadata("ad21"), self.ephemeral_folder)
+        ticks = []
+
+        async def tick() -> None:
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run() -> list[str]:
+            ticker = asyncio.create_task(tick())
+            with patch(
+                "src.modules.logs.check_if_job_log_exists",
+                lambda *_: time.sleep(0.3) or True,
+            ):
+                lines = [
+                    line async for line in tail_live_log("ad21", self.ephemeral_folder)
+                ]
+            ticker.cancel()
+            return lines
+
+        self.assertListEqual(asyncio.run(run()), ["first"])
+        self.assertGreater(len(ticks), 10)
+
+    def test_tail_live_log_reads_in_chunks(self):
+        """
+        Test that the live log is read by chunks, and that a line longer than a chunk is yielded in pieces.
+        """
+        live_log_file = get_live_log_path("ad21", self.ephemeral_folder)
+        write_to_file(live_log_file, "first\n" + "x" * 20 + "\nlast")
+        write_job_log("ad21", self.mock_metadata("ad21"), self.ephemeral_folder)
+
+        async def tail() -> list[str]:
+            return [line async for line in tail_live_log("ad21", self.ephemeral_folder)]
+
+        with patch("src.modules.logs.LIVE_LOG_CHUNK_BYTES", 8):
+            lines = asyncio.run(tail())
+        self.assertListEqual(lines, ["first", "x" * 10, "x" * 8, "xx", "last"])
+
+    def test_archive_live_log(self):
+        """
+        Test that the live log of a completed job is compressed, and can still be streamed.
+        """
+        live_log_file = get_live_log_path("ad21", self.ephemeral_folder)
+        write_to_file(live_log_file, "first\nsecond\n")
+        write_job_log("ad21", self.mock_metadata("ad21"), self.ephemeral_folder)
+
+        archive_live_log("ad21", self.ephemeral_folder)
+        self.assertFalse(os.path.exists(live_log_file))
+        self.assertTrue(os.path.exists(f"{live_log_file}.gz"))
+        self.assertTrue(check_if_live_log_exists("ad21", self.ephemeral_folder))
+
+        async def tail() -> list[str]:
+            return [line async for line in tail_live_log("ad21", self.ephemeral_folder)]
+
+        self.assertListEqual(asyncio.run(tail()), ["first", "second"])
+
+    def test_remove_expired_live_logs(self):
+        """
+        Test that the compressed live logs are removed once they are older than the retention.
+        """
+        for id in ["old", "new"]:
+            write_to_file(get_live_log_path(id, self.ephemeral_folder), "output\n")
+            archive_live_log(id, self.ephemeral_folder)
+        old_file = f"{get_live_log_path('old', self.ephemeral_folder)}.gz"
+        expired = time.time() - 15 * 24 * 3600
+        os.utime(old_file, (expired, expired))
+
+        remove_expired_live_logs(self.ephemeral_folder, 0)
+        self.assertTrue(check_if_live_log_exists("old", self.ephemeral_folder))
+
+        remove_expired_live_logs(self.ephemeral_folder, 14)
+        self.assertFalse(check_if_live_log_exists("old", self.ephemeral_folder))
+        self.assertTrue(check_if_live_log_exists("new", self.ephemeral_folder))
+
+    def test_tail_live_log_ends_when_idle(self):
+        """
+        Test that tailing the live log of a job that never completes, e.g. because its
+        process died, ends once the live log has not changed for the idle timeout.
+        """
+        live_log_file = get_live_log_path("ad21", self.ephemeral_folder)
+        write_to_file(live_log_file, "first\nsecond")
+        stale = time.time() - 60
+        os.utime(live_log_file, (stale, stale))
+        lines = []
+
+        async def tail() -> None:
+            async for line in tail_live_log(
+                "ad21", self.ephemeral_folder, poll_interval=0.05, idle_timeout=30
+            ):
+                lines.append(line)
+
+        with self.assertRaisesRegex(TimeoutError, "has not changed"):
+            asyncio.run(asyncio.wait_for(tail(), 5))
+        self.assertListEqual(lines, ["first", "second"])
+
+    def test_format_event_keeps_the_last_state_of_a_progress_line(self):
+        """
+        Test that the carriage returns of progress bars, which are line breaks in
+        server-sent events, are not sent.
+        """
+        live_log_file = get_live_log_path("ad21", self.ephemeral_folder)
+        write_to_file(
+            live_log_file,
+            "Receiving objects:  50% (1/2)\rReceiving objects: 100% (2/2), done.\r\nok\n",
+        )
+        write_job_log("ad21", self.mock_metadata("ad21"), self.ephemeral_folder)
+
+        async def stream() -> str:
+            return "".join(
+                [
+                    format_event(line)
+                    async for line in tail_live_log("ad21", self.ephemeral_folder)
+                ]
+            )
+
+        events = asyncio.run(stream())
+        self.assertNotIn("\r", events)
+        self.assertEqual(
+            events, "data: Receiving objects: 100% (2/2), done.\n\ndata: ok\n\n"
+        )
+        self.assertEqual(format_event("", "end"), "event: end\ndata: \n\n")
+
+    def test_tail_live_log_raises_exception(self):
+        """
+        Tests that tail_live_log raises an exception if the job has no live log.
+        """
+
+        async def tail():
+            async for _ in tail_live_log("xxxx", self.ephemeral_folder):
+                pass
+
+        with self.assertRaises(Exception):
+            asyncio.run(tail())
+
 
 if __name__ == "__main__":
     unittest.main()
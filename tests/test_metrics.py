@@ -0,0 +1,104 @@
+import time
+import unittest
+from src.modules.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Metric,
+    registry,
+    render_metrics,
+    time_stage,
+)
+
+
+class MetricsTest(unittest.TestCase):
+    def test_counter_per_label(self):
+        counter = Counter("ci_lookups_total", "Lookups.", ("cache",), register=False)
+
+        counter.inc(cache="venv")
+        counter.inc(2, cache="venv")
+        counter.inc(cache="mirror")
+
+        self.assertEqual(
+            counter.render(),
+            "# HELP ci_lookups_total Lookups.\n"
+            "# TYPE ci_lookups_total counter\n"
+            'ci_lookups_total{cache="mirror"} 1\n'
+            'ci_lookups_total{cache="venv"} 3\n',
+        )
+
+    def test_gauge(self):
+        gauge = Gauge("ci_queue_depth", "Depth.", register=False)
+
+        gauge.set(4)
+        gauge.set(2)
+
+        self.assertIn("ci_queue_depth 2\n", gauge.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram(
+            "ci_stage_seconds", "Stages.", ("stage",), (1, 5), register=False
+        )
+
+        for value in [0.5, 2, 10]:
+            histogram.observe(value, stage="test")
+
+        self.assertEqual(
+            histogram.samples(),
+            [
+                'ci_stage_seconds_bucket{stage="test",le="1"} 1',
+                'ci_stage_seconds_bucket{stage="test",le="5"} 2',
+                'ci_stage_seconds_bucket{stage="test",le="+Inf"} 3',
+                'ci_stage_seconds_sum{stage="test"} 12.5',
+                'ci_stage_seconds_count{stage="test"} 3',
+            ],
+        )
+
+    def test_labels_must_match(self):
+        histogram = Histogram("ci_seconds", "Seconds.", ("stage",), register=False)
+
+        with self.assertRaises(ValueError):
+            histogram.observe(1)
+
+    def test_metric_without_type_is_not_registered(self):
+        """
+        Test that a metric must have a type, so that it cannot break `/metrics` once registered.
+        """
+        count = len(registry)
+        with self.assertRaises(TypeError):
+            Metric("ci_untyped", "Untyped.")
+        self.assertEqual(len(registry), count)
+
+    def test_label_values_are_escaped(self):
+        counter = Counter("ci_total", "Total.", ("ref",), register=False)
+
+        counter.inc(ref='say "hi"\\')
+
+        self.assertIn('ci_total{ref="say \\"hi\\"\\\\"} 1', counter.render())
+
+    def test_time_stage_stores_duration_on_error(self):
+        durations = {}
+
+        with self.assertRaises(RuntimeError):
+            with time_stage(durations, "clone"):
+                time.sleep(0.1)
+                raise RuntimeError()
+
+        self.assertGreaterEqual(durations["clone"], 0.1)
+
+    def test_server_metrics_are_registered(self):
+        metrics = render_metrics()
+
+        for name in [
+            "ci_stage_duration_seconds",
+            "ci_queue_wait_seconds",
+            "ci_queue_depth",
+            "ci_running_jobs",
+            "ci_cache_lookups_total",
+            "ci_status_post_duration_seconds",
+        ]:
+            self.assertIn(f"# TYPE {name} ", metrics)
+
+
+if __name__ == "__main__":
+    unittest.main()
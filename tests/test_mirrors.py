@@ -0,0 +1,105 @@
+import os
+import subprocess
+import unittest
+from src.modules.actions import clone_repo
+from src.modules.mirrors import evict_mirrors, get_mirror_path
+from src.modules.utils import (
+    check_if_file_exists,
+    check_if_folder_exists,
+    remove_folder,
+    write_to_file,
+)
+
+
+def git(cwd: str, *args: str) -> str:
+    ret = subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@kth.se", *args],
+        capture_output=True,
+        check=True,
+        cwd=cwd,
+    )
+    return ret.stdout.decode().strip()
+
+
+class MirrorsTest(unittest.TestCase):
+    # Set up a local origin repository to clone from
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/mirrors_test/")
+        self.origin = os.path.join(self.ephemeral_folder, "origin", "sample-repo")
+        self.cache_folder = os.path.join(self.ephemeral_folder, "cache")
+        self.workspace = os.path.join(self.ephemeral_folder, "workspace")
+
+        write_to_file(os.path.join(self.origin, "README.md"), "first")
+        git(self.origin, "init", "--quiet", "--initial-branch=main")
+        git(self.origin, "add", ".")
+        git(self.origin, "commit", "--quiet", "-m", "first")
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def commit_to_origin(self, file_name: str) -> str:
+        write_to_file(os.path.join(self.origin, file_name), file_name)
+        git(self.origin, "add", ".")
+        git(self.origin, "commit", "--quiet", "-m", file_name)
+        return git(self.origin, "rev-parse", "HEAD")
+
+    def test_clone_through_mirror(self):
+        clone_repo(self.origin, self.workspace, self.cache_folder)
+
+        repo_folder = os.path.join(self.workspace, "sample-repo")
+        self.assertTrue(check_if_file_exists(os.path.join(repo_folder, "README.md")))
+        self.assertTrue(
+            check_if_folder_exists(get_mirror_path(self.origin, self.cache_folder))
+        )
+        # The workspace should still point at the real remote
+        self.assertEqual(git(repo_folder, "remote", "get-url", "origin"), self.origin)
+
+    def test_mirror_fetches_new_commits(self):
+        clone_repo(self.origin, os.path.join(self.workspace, "1"), self.cache_folder)
+        sha = self.commit_to_origin("second.txt")
+        clone_repo(self.origin, os.path.join(self.workspace, "2"), self.cache_folder)
+
+        repo_folder = os.path.join(self.workspace, "2", "sample-repo")
+        self.assertEqual(git(repo_folder, "rev-parse", "origin/main"), sha)
+
+    def test_clone_through_mirror_failure(self):
+        with self.assertRaises(Exception):
+            clone_repo(
+                os.path.join(self.ephemeral_folder, "non_existent_repo"),
+                self.workspace,
+                self.cache_folder,
+            )
+
+        # A mirror that could not be fetched should not be kept around
+        self.assertEqual(
+            [name for name in os.listdir(self.cache_folder) if name.endswith(".git")],
+            [],
+        )
+
+    def test_evict_least_recently_used_mirror(self):
+        other_origin = os.path.join(self.ephemeral_folder, "origin", "other-repo")
+        git(self.ephemeral_folder, "clone", "--quiet", self.origin, other_origin)
+
+        clone_repo(self.origin, os.path.join(self.workspace, "1"), self.cache_folder)
+        clone_repo(other_origin, os.path.join(self.workspace, "2"), self.cache_folder)
+        old_mirror = get_mirror_path(self.origin, self.cache_folder)
+        os.utime(old_mirror + ".lock", (0, 0))
+
+        evicted = evict_mirrors(self.cache_folder, max_bytes=1)
+
+        self.assertIn(old_mirror, evicted)
+        self.assertFalse(check_if_folder_exists(old_mirror))
+
+    def test_evict_keeps_given_mirror(self):
+        clone_repo(self.origin, self.workspace, self.cache_folder)
+        mirror = get_mirror_path(self.origin, self.cache_folder)
+
+        evicted = evict_mirrors(self.cache_folder, max_bytes=1, keep=mirror)
+
+        self.assertEqual(evicted, [])
+        self.assertTrue(check_if_folder_exists(mirror))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from src.modules.notifications import get_commit_status
+from src.modules.notifier import StatusNotifier
+from src.modules.rate_limit import RateLimiter
+from src.modules.types import Status
+from src.modules.utils import check_if_folder_exists, remove_folder
+
+
+class FakeStatusAPI:
+    """
+    A local stand-in for the commit status API of GitHub.
+    The next responses can be queued, it answers 201 otherwise.
+    The headers are added to every response, e.g. the rate limit headers.
+    """
+
+    def __init__(self):
+        self.statuses: list[tuple[str, str]] = []
+        self.clients: list[tuple[str, int]] = []
+        self.responses: list[int] = []
+        self.headers: dict[str, str] = {}
+        self.times: list[float] = []
+        self.reads: list[int] = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                code = api.responses.pop(0) if api.responses else 201
+                api.clients.append(self.client_address)
+                api.times.append(time.monotonic())
+                if code == 201:
+                    api.statuses.append((self.path.rsplit("/", 1)[-1], body["state"]))
+                self.respond(code, b"{}")
+
+            def do_GET(self):
+                state = api.statuses[-1][1] if api.statuses else "pending"
+                etag = f'"{state}"'
+                code = 304 if self.headers.get("If-None-Match") == etag else 200
+                api.reads.append(code)
+                self.respond(code, json.dumps({"state": state}).encode(), etag)
+
+            def respond(self, code: int, body: bytes, etag: str | None = None):
+                self.send_response(code)
+                for name, value in api.headers.items():
+                    self.send_header(name, value)
+                if etag:
+                    self.send_header("ETag", etag)
+                if code == 304:
+                    body = b""
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NotifierTest(unittest.TestCase):
+    def setUp(self):
+        self.ephemeral_folder = "./temp/notifier_test/"
+        self.outbox_file = os.path.join(self.ephemeral_folder, "outbox.db")
+        self.api = FakeStatusAPI()
+        self.token = patch.dict(os.environ, {"GITHUB_TOKEN": "fake-token"})
+        self.token.start()
+
+    def tearDown(self):
+        self.token.stop()
+        self.api.close()
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def create_notifier(self, limiter: RateLimiter | None = None) -> StatusNotifier:
+        notifier = StatusNotifier(
+            self.outbox_file,
+            self.api.url,
+            3,
+            base_delay=0.05,
+            limiter=limiter or RateLimiter(1000, 1000),
+        )
+        self.addCleanup(notifier.stop)
+        return notifier
+
+    def test_statuses_are_sent_in_order(self):
+        notifier = self.create_notifier()
+        notifier.start()
+
+        notifier.notify("owner", "repo", "abc", Status.PENDING, "job")
+        self.assertTrue(notifier.flush(5))
+        notifier.notify("owner", "repo", "abc", Status.SUCCESS, "job")
+
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.statuses, [("abc", "pending"), ("abc", "success")])
+        # The connection was kept alive between the statuses
+        self.assertEqual(self.api.clients[0], self.api.clients[1])
+
+    def test_failed_status_is_retried_before_the_next_one(self):
+        self.api.responses = [500, 502]
+        notifier = self.create_notifier()
+        notifier.start()
+
+        notifier.notify("owner", "repo", "abc", Status.PENDING, "job", "lint")
+        notifier.notify("owner", "repo", "abc", Status.FAILURE, "job", "test")
+
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.statuses, [("abc", "pending"), ("abc", "failure")])
+
+    def test_status_is_dropped_after_permanent_failure(self):
+        self.api.responses = [422]
+        notifier = self.create_notifier()
+        notifier.start()
+
+        notifier.notify("owner", "repo", "abc", Status.PENDING, "job", "lint")
+        notifier.notify("owner", "repo", "abc", Status.SUCCESS, "job", "test")
+
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.statuses, [("abc", "success")])
+
+    def test_cancelled_is_sent_as_error(self):
+        notifier = self.create_notifier()
+        notifier.start()
+
+        notifier.notify("owner", "repo", "abc", Status.CANCELLED, "job")
+
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.statuses, [("abc", "error")])
+
+    def test_waiting_status_is_replaced_by_a_newer_one(self):
+        notifier = self.create_notifier()
+        notifier.notify("owner", "repo", "abc", Status.PENDING, "job")
+        notifier.notify("owner", "repo", "def", Status.PENDING, "job")
+        notifier.notify("owner", "repo", "abc", Status.SUCCESS, "job")
+        notifier.start()
+
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.statuses, [("def", "pending"), ("abc", "success")])
+
+    def test_statuses_wait_for_the_quota_to_reset(self):
+        reset = int(time.time()) + 2
+        self.api.headers = {
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(reset),
+        }
+        notifier = self.create_notifier()
+        notifier.start()
+
+        notifier.notify("owner", "repo", "abc", Status.PENDING, "job")
+        self.assertTrue(notifier.flush(5))
+        self.api.headers = {}
+        notifier.notify("owner", "repo", "def", Status.PENDING, "job")
+
+        self.assertTrue(notifier.flush(5))
+        self.assertGreaterEqual(time.time(), reset - 1)
+        self.assertGreater(self.api.times[1] - self.api.times[0], 0.9)
+
+    def test_get_commit_status_uses_etag(self):
+        limiter = RateLimiter(1000, 1000)
+        self.api.statuses = [("abc", "success")]
+
+        for _ in range(2):
+            state = get_commit_status(
+                "owner", "repo", "abc", self.api.url, limiter=limiter
+            )
+            self.assertEqual(state, "success")
+
+        self.assertEqual(self.api.reads, [200, 304])
+
+    def test_status_is_dropped_after_max_attempts(self):
+        self.api.responses = [500, 500, 500]
+        notifier = self.create_notifier()
+        notifier.start()
+
+        notifier.notify("owner", "repo", "abc", Status.PENDING, "job")
+
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.api.statuses, [])
+        self.assertEqual(len(self.api.clients), 3)
+
+    def test_outbox_survives_a_restart(self):
+        notifier = self.create_notifier()
+        notifier.notify("owner", "repo", "abc", Status.PENDING, "job")
+        self.assertEqual(notifier.pending(), 1)
+
+        restarted = self.create_notifier()
+        restarted.start()
+
+        self.assertTrue(restarted.flush(5))
+        self.assertEqual(self.api.statuses, [("abc", "pending")])
+
+    def test_outbox_shared_between_processes(self):
+        """
+        Test that the notifiers sharing an outbox send every status once.
+        """
+        first = self.create_notifier()
+        second = self.create_notifier()
+        shas = [f"sha{index}" for index in range(10)]
+        for sha in shas:
+            first.notify("owner", "repo", sha, Status.PENDING, "job")
+
+        first.start()
+        second.start()
+
+        self.assertTrue(first.flush(5))
+        self.assertCountEqual(self.api.statuses, [(sha, "pending") for sha in shas])
+
+    def test_claimed_status_is_not_replaced(self):
+        """
+        Test that a status claimed by another process is neither sent again nor replaced,
+        and that the newer statuses of the commit wait for it.
+        """
+        first = self.create_notifier()
+        second = self.create_notifier()
+        first.notify("owner", "repo", "abc", Status.PENDING, "job")
+        seq = first._next_entry()[0]
+
+        self.assertTrue(first._claim(seq))
+        self.assertFalse(second._claim(seq))
+        second.notify("owner", "repo", "abc", Status.SUCCESS, "job")
+        self.assertEqual(second.pending(), 2)
+        self.assertIsNone(second._next_entry())
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(10, 2)
+
+        waited = [limiter.acquire() for _ in range(3)]
+
+        self.assertEqual(waited[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waited[2], 0.1, delta=0.05)
+
+    def test_remaining_quota_is_spread_until_reset(self):
+        limiter = RateLimiter(1000, 1)
+        limiter.acquire()
+
+        limiter.update(
+            {"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": str(time.time() + 100)}
+        )
+
+        # 10 requests left in 100 seconds, one every 10 seconds
+        self.assertAlmostEqual(limiter.wait_time(), 10, delta=0.5)
+
+    def test_retry_after(self):
+        limiter = RateLimiter(1000, 10)
+
+        limiter.update({"Retry-After": "30"})
+
+        self.assertAlmostEqual(limiter.wait_time(), 30, delta=0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
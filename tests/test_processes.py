@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from src.modules.processes import (
+    JobCancelledError,
+    LiveLog,
+    OutputBuffer,
+    ProcessGroup,
+    StageTimeoutError,
+    run_command,
+)
+from src.modules.utils import check_if_folder_exists, remove_folder
+
+
+class ProcessesTest(unittest.TestCase):
+    def setUp(self):
+        self.ephemeral_folder = "./temp/processes_test/"
+        self.live_log_file = os.path.join(self.ephemeral_folder, "live", "job.log")
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def test_run_command_captures_output(self):
+        result = run_command("echo out && echo err >&2", shell=True)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.decode(), "out\n")
+        self.assertEqual(result.stderr.decode(), "err\n")
+
+    def test_cancel_kills_running_command(self):
+        group = ProcessGroup()
+        threading.Timer(0.2, group.cancel).start()
+
+        started = time.monotonic()
+        with self.assertRaises(JobCancelledError):
+            # The sleep is a grandchild of the shell, and must be killed as well
+            group.run("sleep 30; echo done", shell=True)
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_cancelled_group_refuses_new_commands(self):
+        group = ProcessGroup()
+        group.cancel()
+
+        with self.assertRaises(JobCancelledError):
+            group.run(["true"])
+
+    def test_cancel_propagates_to_children(self):
+        group = ProcessGroup()
+        child = group.child()
+        group.cancel()
+
+        self.assertTrue(child.cancelled)
+        self.assertTrue(group.child().cancelled)
+
+    def test_live_log_receives_output_while_running(self):
+        live_log = LiveLog(self.live_log_file)
+        group = ProcessGroup(live_log=live_log)
+        command = "echo first; sleep 0.5; echo second"
+        thread = threading.Thread(
+            target=group.run, args=(command,), kwargs={"shell": True}
+        )
+        thread.start()
+
+        time.sleep(0.3)
+        with open(self.live_log_file) as file:
+            self.assertEqual(file.read(), "first\n")
+
+        thread.join()
+        with open(self.live_log_file) as file:
+            self.assertEqual(file.read(), "first\nsecond\n")
+
+    def test_live_log_is_shared_with_children(self):
+        live_log = LiveLog(self.live_log_file)
+        group = ProcessGroup(live_log=live_log)
+        live_log.write_line("==> Stage")
+
+        result = group.child().run("echo out; echo err >&2", shell=True)
+        live_log.close()
+
+        self.assertEqual(result.stdout, b"out\n")
+        self.assertEqual(result.stderr, b"err\n")
+        with open(self.live_log_file) as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[0], "==> Stage")
+        self.assertCountEqual(lines[1:], ["out", "err"])
+
+    def test_long_output_is_truncated(self):
+        """
+        Test that only the start and the end of a long output are kept in memory,
+        while the live log still gets all of it.
+        """
+        live_log = LiveLog(self.live_log_file)
+        group = ProcessGroup(live_log=live_log)
+        command = "seq 1 100000"
+
+        with patch("src.modules.processes.OUTPUT_HEAD_BYTES", 100), patch(
+            "src.modules.processes.OUTPUT_TAIL_BYTES", 100
+        ):
+            result = group.run(command, shell=True)
+            full = group.run(command, shell=True, bounded=False)
+        live_log.close()
+
+        output = result.stdout.decode()
+        self.assertTrue(output.startswith("1\n2\n3\n"))
+        self.assertTrue(output.endswith("99999\n100000\n"))
+        self.assertIn("bytes of output truncated", output)
+        self.assertIn(self.live_log_file, output)
+        self.assertLess(len(result.stdout), 400)
+        self.assertEqual(len(full.stdout.decode().splitlines()), 100000)
+        with open(self.live_log_file) as file:
+            self.assertEqual(file.read(), full.stdout.decode() * 2)
+
+    def test_timeout_kills_the_command(self):
+        """
+        Test that the commands of a group are killed once its timeout is reached,
+        together with the processes they spawned.
+        """
+        group = ProcessGroup().child(timeout=0.3)
+
+        started = time.monotonic()
+        with self.assertRaises(StageTimeoutError):
+            group.run("sleep 30 & wait", shell=True)
+        self.assertLess(time.monotonic() - started, 5)
+
+        # The timeout counts from the creation of the group, and children are bound by it
+        with self.assertRaises(StageTimeoutError):
+            group.child(timeout=60).run(["true"])
+        self.assertEqual(ProcessGroup().child(timeout=60).run(["true"]).returncode, 0)
+
+
+class OutputBufferTest(unittest.TestCase):
+    def test_short_output_is_kept_whole(self):
+        output = OutputBuffer(head_bytes=10, tail_bytes=10)
+        output.write(b"hello ")
+        output.write(b"world\n")
+        self.assertEqual(output.getvalue(), b"hello world\n")
+        self.assertEqual(output.truncated, 0)
+
+    def test_long_output_keeps_head_and_tail(self):
+        output = OutputBuffer(head_bytes=4, tail_bytes=6)
+        for chunk in [b"abcdef", b"ghijkl", b"mnopqr", b"stuvwxyz"]:
+            output.write(chunk)
+
+        self.assertEqual(output.size, 26)
+        self.assertEqual(output.truncated, 16)
+        self.assertEqual(
+            output.getvalue(),
+            b"abcd\n[... 16 bytes of output truncated ...]\nuvwxyz",
+        )
+
+    def test_memory_is_bounded(self):
+        output = OutputBuffer(head_bytes=1024, tail_bytes=1024)
+        for _ in range(10000):
+            output.write(b"x" * 1000)
+        self.assertLessEqual(len(output._head) + output._tail_size, 1024 + 2000)
+
+    def test_cuts_on_character_boundaries(self):
+        """
+        Test that a multi-byte character cut by the limits does not break decoding.
+        """
+        output = OutputBuffer(head_bytes=5, tail_bytes=5)
+        output.write("ééééééééé".encode())
+        self.assertEqual(
+            output.getvalue().decode(),
+            "éé\n[... 10 bytes of output truncated ...]\néé",
+        )
+
+    def test_unbounded(self):
+        output = OutputBuffer(head_bytes=None, tail_bytes=1)
+        output.write(b"a" * 100)
+        self.assertEqual(output.getvalue(), b"a" * 100)
+
+    def test_live_log_gets_whole_lines(self):
+        """
+        Test that the live log gets all of the output, one line at a time when possible.
+        """
+        folder = "./temp/processes_test/"
+        self.addCleanup(remove_folder, folder)
+        live_log = LiveLog(os.path.join(folder, "job.log"))
+        output = OutputBuffer(live_log, head_bytes=1, tail_bytes=1)
+
+        output.write(b"first li")
+        self.assertEqual(os.path.getsize(live_log.path), 0)
+        output.write(b"ne\nsecond")
+        output.close()
+        live_log.close()
+        with open(live_log.path, "rb") as file:
+            self.assertEqual(file.read(), b"first line\nsecond")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import src.jobs
+import src.runner
+from src.modules.broker import SQLiteBroker
+from src.modules.processes import JobCancelledError
+from src.modules.runner import Runner
+from src.modules.logs import read_job_log
+from tests.test_broker import mock_result
+from src.modules.types import Status
+from tests.test_scheduler import mock_payload, wait_until
+
+
+class RunnerTest(unittest.TestCase):
+    # Set up a runner whose jobs block until released, or until cancelled
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.logs_folder = os.path.join(self.folder.name, "logs")
+        self.broker = SQLiteBroker(
+            os.path.join(self.folder.name, "broker.db"),
+            self.logs_folder,
+            supersede=True,
+        )
+        self.release = threading.Event()
+        self.started: list[str] = []
+        self.cancelled: list[str] = []
+        self.runner = Runner(
+            self.broker, self.handler, "runner-1", 2, lease=0.3, poll_interval=0.01
+        )
+
+    def tearDown(self):
+        self.release.set()
+        self.runner.stop(timeout=5)
+        self.folder.cleanup()
+
+    def handler(self, job):
+        self.started.append(job.id)
+        try:
+            while not self.release.wait(0.01):
+                if job.group.cancelled:
+                    raise JobCancelledError("The job was cancelled.")
+        except JobCancelledError:
+            self.cancelled.append(job.id)
+            raise
+        return mock_result(job.id)
+
+    def test_runs_and_reports_jobs(self):
+        """
+        Test that the runner runs the jobs of the broker, and reports their results.
+        """
+        jobs = [
+            self.broker.submit(mock_payload(ref=f"refs/heads/{branch}"))
+            for branch in ["a", "b", "c"]
+        ]
+        self.runner.start()
+        self.assertTrue(wait_until(lambda: len(self.started) == 2))
+        self.assertEqual(len(self.broker.snapshot()["pending"]), 1)
+
+        self.release.set()
+        self.assertTrue(wait_until(lambda: not self.broker.snapshot()["running"]))
+        self.assertTrue(wait_until(lambda: len(self.started) == 3))
+        for job in jobs:
+            self.assertTrue(
+                wait_until(lambda: self._has_result(job.id)), f"No result for {job.id}"
+            )
+
+    def test_heartbeats_keep_the_lease(self):
+        """
+        Test that a job running for longer than the lease is not given to another runner.
+        """
+        self.broker.lease = 0.3
+        self.broker.submit(mock_payload())
+        self.runner.start()
+        self.assertTrue(wait_until(lambda: len(self.started) == 1))
+
+        # Wait for a few leases
+        self.assertFalse(self.release.wait(1))
+        self.assertIsNone(self.broker.claim("runner-2"))
+
+    def test_cancels_superseded_job(self):
+        """
+        Test that a running job is cancelled once a newer job for the same ref is submitted.
+        """
+        older = self.broker.submit(mock_payload("1111111"))
+        self.runner.start()
+        self.assertTrue(wait_until(lambda: len(self.started) == 1))
+
+        newer = self.broker.submit(mock_payload("2222222"))
+        self.assertTrue(wait_until(lambda: self.cancelled == [older.id]))
+        self.assertTrue(wait_until(lambda: newer.id in self.started))
+
+    def _has_result(self, id: str) -> bool:
+        try:
+            read_job_log(id, self.logs_folder)
+            return True
+        except Exception:
+            return False
+
+
+class RunnerEntryPointTest(unittest.TestCase):
+    def test_does_not_create_the_server(self):
+        """
+        Test that the runner does not create the API and its scheduler, which would
+        run the jobs of the server's queue and spool on the runner's node.
+        """
+        code = "import sys, src.runner; print('src.main' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_closed_job_posts_its_final_status(self):
+        """
+        Test that a job that the broker closes is stored and posted with its final status,
+        so that its commit does not stay on the pending status of an earlier run.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            broker = SQLiteBroker(os.path.join(folder, "broker.db"), folder, lease=0.01)
+            broker.max_attempts = 1
+            broker.submit(mock_payload("1111111"))
+            broker.claim("runner-1")
+            time.sleep(0.02)
+            job = broker.claim("runner-2")
+
+            with patch.object(src.jobs.notifier, "notify") as notify, patch(
+                "src.jobs.LOGS_FOLDER", folder
+            ), patch("src.runner.LOGS_FOLDER", folder):
+                result = src.runner.run_claimed_job(job)
+
+        self.assertEqual(result.status, Status.ERROR)
+        notify.assert_called_once_with(
+            "dd2480-spring-2025-group-1",
+            "assignment-1",
+            "1111111",
+            Status.ERROR,
+            job.id,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,361 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from src.modules.processes import JobCancelledError
+from src.modules.scheduler import (
+    Job,
+    JobScheduler,
+    JobSpool,
+    QueueFullError,
+    get_priority,
+    get_weight,
+)
+from src.modules.types import PushEventPayload
+
+
+def mock_payload(
+    after: str = "b7f1a1c", ref: str = "refs/heads/main"
+) -> PushEventPayload:
+    return PushEventPayload(
+        after=after,
+        before="0000000",
+        commits=[],
+        compare="https://github.com/dd2480-spring-2025-group-1/assignment-1/compare",
+        created=False,
+        deleted=False,
+        forced=False,
+        pusher={"name": "Joel90689"},
+        ref=ref,
+        repository={
+            "name": "assignment-1",
+            "full_name": "dd2480-spring-2025-group-1/assignment-1",
+            "owner": {"login": "dd2480-spring-2025-group-1"},
+            "clone_url": "https://github.com/dd2480-spring-2025-group-1/assignment-1.git",
+        },
+        sender={},
+    )
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class SchedulerTest(unittest.TestCase):
+    # Set up a scheduler whose jobs block until released
+    def setUp(self):
+        self.release = threading.Event()
+        self.completed: list[str] = []
+        self.scheduler = JobScheduler(self.handler, max_workers=2, max_queue_depth=4)
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.stop(timeout=5)
+
+    def handler(self, job):
+        self.release.wait()
+        self.completed.append(job.id)
+
+    def test_runs_at_most_max_workers_jobs(self):
+        for _ in range(4):
+            self.scheduler.submit(mock_payload())
+
+        self.assertTrue(
+            wait_until(lambda: len(self.scheduler.snapshot()["running"]) == 2)
+        )
+        snapshot = self.scheduler.snapshot()
+        self.assertEqual(len(snapshot["running"]), 2)
+        self.assertEqual(len(snapshot["pending"]), 2)
+
+        self.release.set()
+        self.assertTrue(wait_until(lambda: len(self.completed) == 4))
+
+    def test_submit_raises_when_queue_is_full(self):
+        for _ in range(2):
+            self.scheduler.submit(mock_payload())
+        self.assertTrue(
+            wait_until(lambda: len(self.scheduler.snapshot()["running"]) == 2)
+        )
+        for _ in range(4):
+            self.scheduler.submit(mock_payload())
+
+        with self.assertRaises(QueueFullError) as context:
+            self.scheduler.submit(mock_payload())
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+
+    def test_all_jobs_complete(self):
+        ids = [self.scheduler.submit(mock_payload()).id for _ in range(4)]
+        self.release.set()
+
+        self.assertTrue(wait_until(lambda: len(self.completed) == 4))
+        self.assertCountEqual(self.completed, ids)
+        self.assertEqual(self.scheduler.snapshot()["pending"], [])
+
+    def test_snapshot_describes_jobs(self):
+        job = self.scheduler.submit(mock_payload(after="abc123"), id="job-1")
+
+        self.assertTrue(
+            wait_until(lambda: len(self.scheduler.snapshot()["running"]) == 1)
+        )
+        description = self.scheduler.snapshot()["running"][0]
+        self.assertEqual(description["id"], job.id)
+        self.assertEqual(description["head_commit"], "abc123")
+        self.assertEqual(description["repo"], "dd2480-spring-2025-group-1/assignment-1")
+        self.assertIsNotNone(description["time_started"])
+
+
+class SupersedeTest(unittest.TestCase):
+    # Set up a scheduler with one worker, whose jobs run a command until it is killed
+    def setUp(self):
+        self.outcomes: dict[str, str] = {}
+        self.scheduler = JobScheduler(
+            self.handler, max_workers=1, max_queue_depth=4, supersede=True
+        )
+        self.scheduler.start()
+
+    def tearDown(self):
+        for job in self.scheduler._running.values():
+            job.group.cancel()
+        self.scheduler.stop(timeout=5)
+
+    def handler(self, job):
+        try:
+            job.group.run(["sleep", "30" if job.id == "first" else "0.2"])
+            self.outcomes[job.id] = "completed"
+        except JobCancelledError:
+            self.outcomes[job.id] = "cancelled"
+
+    def test_newer_push_cancels_running_and_drops_queued_jobs(self):
+        first = self.scheduler.submit(mock_payload(after="a"), id="first")
+        self.assertTrue(
+            wait_until(lambda: len(self.scheduler.snapshot()["running"]) == 1)
+        )
+        second = self.scheduler.submit(mock_payload(after="b"), id="second")
+        other = self.scheduler.submit(
+            mock_payload(after="c", ref="refs/heads/dev"), id="other"
+        )
+        self.scheduler.submit(mock_payload(after="d"), id="last")
+
+        self.assertEqual(first.superseded_by, "second")
+        self.assertEqual(second.superseded_by, "last")
+        self.assertIsNone(other.superseded_by)
+        self.assertTrue(wait_until(lambda: "first" in self.outcomes))
+        self.assertEqual(self.outcomes["first"], "cancelled")
+
+        pending = [job["id"] for job in self.scheduler.snapshot()["pending"]]
+        self.assertNotIn("second", pending)
+        self.assertTrue(wait_until(lambda: "last" in self.outcomes))
+        self.assertEqual(self.outcomes["other"], "completed")
+        self.assertEqual(self.outcomes["last"], "completed")
+        self.assertNotIn("second", self.outcomes)
+
+
+class SpoolTest(unittest.TestCase):
+    # Set up a spool, and schedulers whose jobs block until released
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.spool_file = os.path.join(self.folder.name, "queue.db")
+        self.release = threading.Event()
+        self.started: list[Job] = []
+        self.schedulers: list[JobScheduler] = []
+
+    def tearDown(self):
+        self.release.set()
+        for scheduler in self.schedulers:
+            scheduler.stop(timeout=5)
+        self.folder.cleanup()
+
+    def handler(self, job):
+        self.started.append(job)
+        self.release.wait()
+
+    def create_scheduler(self, supersede: bool = False) -> JobScheduler:
+        scheduler = JobScheduler(
+            self.handler,
+            max_workers=1,
+            supersede=supersede,
+            spool=JobSpool(self.spool_file),
+        )
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def test_resumes_jobs_after_restart(self):
+        """
+        Test that the jobs that had not completed, running or pending, run again after a restart,
+        in the order they were accepted.
+        """
+        scheduler = self.create_scheduler()
+        scheduler.start()
+        for branch in ["a", "b", "c"]:
+            scheduler.submit(mock_payload(ref=f"refs/heads/{branch}"), id=branch)
+        self.assertTrue(wait_until(lambda: len(self.started) == 1))
+
+        # A crash: the workers are never stopped, and the jobs never complete
+        restarted = self.create_scheduler()
+        restarted.start()
+        self.assertTrue(wait_until(lambda: len(self.started) == 2))
+        self.assertEqual([job.id for job in self.started], ["a", "a"])
+        pending = [job["id"] for job in restarted.snapshot()["pending"]]
+        self.assertEqual(pending, ["b", "c"])
+
+    def test_completed_jobs_leave_the_spool(self):
+        """
+        Test that completed jobs, and jobs dropped from the queue, are not resumed.
+        """
+        scheduler = self.create_scheduler(supersede=True)
+        scheduler.start()
+        scheduler.submit(mock_payload(ref="refs/heads/a"), id="done")
+        self.assertTrue(wait_until(lambda: len(self.started) == 1))
+        scheduler.submit(mock_payload("1111111"), id="dropped")
+        scheduler.submit(mock_payload("2222222"), id="kept")
+        self.release.set()
+        self.assertTrue(wait_until(lambda: len(self.started) == 2))
+        self.assertEqual(self.started[1].id, "kept")
+        self.assertTrue(wait_until(lambda: not scheduler.snapshot()["running"]))
+
+        self.assertEqual(JobSpool(self.spool_file).load(), [])
+
+    def test_resume_supersedes_older_jobs(self):
+        """
+        Test that on resume, an older job of the same ref is dropped if it had not started,
+        and cancelled if it had, so that it still completes with a final status.
+        """
+        spool = JobSpool(self.spool_file)
+        jobs = {}
+        for id, after in [("started", "1111111"), ("queued", "2222222")]:
+            jobs[id] = Job(id, mock_payload(after))
+            spool.add(jobs[id])
+        jobs["started"].time_started = time.time()
+        spool.mark_started(jobs["started"])
+        spool.add(Job("newest", mock_payload("3333333")))
+
+        scheduler = self.create_scheduler(supersede=True)
+        scheduler.start()
+        self.assertTrue(wait_until(lambda: len(self.started) == 1))
+        self.assertEqual(self.started[0].id, "started")
+        self.assertEqual(self.started[0].superseded_by, "newest")
+        self.assertTrue(self.started[0].group.cancelled)
+        pending = [job["id"] for job in scheduler.snapshot()["pending"]]
+        self.assertEqual(pending, ["newest"])
+        self.assertEqual(
+            [job.id for job in JobSpool(self.spool_file).load()], ["started", "newest"]
+        )
+
+
+def repo_payload(repo: str, ref: str = "refs/heads/feature") -> PushEventPayload:
+    payload = mock_payload(ref=ref)
+    payload.repository = {**payload.repository, "full_name": repo}
+    return payload
+
+
+class PriorityTest(unittest.TestCase):
+    classes = [
+        ("release", ["refs/heads/main", "refs/tags/*"]),
+        ("staging", ["refs/heads/staging"]),
+    ]
+
+    def test_get_priority(self):
+        self.assertEqual(get_priority("refs/heads/main", self.classes), (0, "release"))
+        self.assertEqual(get_priority("refs/tags/v1.0", self.classes), (0, "release"))
+        self.assertEqual(
+            get_priority("refs/heads/staging", self.classes), (1, "staging")
+        )
+        self.assertEqual(
+            get_priority("refs/heads/main-fix", self.classes), (2, "default")
+        )
+        self.assertEqual(get_priority("refs/heads/main", []), (0, "default"))
+
+    def test_get_weight(self):
+        weights = [("org/backend", 3.0), ("org/*", 2.0)]
+        self.assertEqual(get_weight("org/backend", weights), 3.0)
+        self.assertEqual(get_weight("org/frontend", weights), 2.0)
+        self.assertEqual(get_weight("other/backend", weights), 1.0)
+        self.assertEqual(get_weight(None, weights), 1.0)
+
+    def test_higher_class_runs_first(self):
+        """
+        Test that a release job that arrives last runs before the feature jobs waiting for a worker.
+        """
+        release = threading.Event()
+        order: list[str] = []
+
+        def handler(job):
+            order.append(job.id)
+            release.wait()
+
+        scheduler = JobScheduler(handler, max_workers=1, priority_classes=self.classes)
+        self.addCleanup(scheduler.stop, 5)
+        self.addCleanup(release.set)
+        scheduler.start()
+        scheduler.submit(repo_payload("org/a", "refs/heads/one"), id="one")
+        self.assertTrue(wait_until(lambda: order == ["one"]))
+        scheduler.submit(repo_payload("org/a", "refs/heads/two"), id="two")
+        scheduler.submit(repo_payload("org/a", "refs/heads/staging"), id="staging")
+        scheduler.submit(repo_payload("org/a", "refs/tags/v1"), id="tag")
+
+        pending = scheduler.snapshot()["pending"]
+        self.assertEqual(
+            [job["priority"] for job in pending], ["default", "staging", "release"]
+        )
+        release.set()
+        self.assertTrue(wait_until(lambda: len(order) == 4))
+        self.assertEqual(order, ["one", "tag", "staging", "two"])
+
+
+class FairShareTest(unittest.TestCase):
+    def take(self, scheduler: JobScheduler, count: int) -> list[str]:
+        with scheduler._condition:
+            return [scheduler._take_next().key[0] for _ in range(count)]
+
+    def test_repositories_take_turns(self):
+        """
+        Test that a repository with many queued jobs does not hold up a repository with one.
+        """
+        scheduler = JobScheduler(lambda job: None, max_queue_depth=10)
+        for index in range(4):
+            scheduler.submit(repo_payload("org/busy", f"refs/heads/{index}"))
+        scheduler.submit(repo_payload("org/quiet"))
+
+        self.assertEqual(self.take(scheduler, 3), ["org/busy", "org/quiet", "org/busy"])
+
+    def test_shares_follow_weights(self):
+        """
+        Test that a repository with three times the weight gets three times the workers.
+        """
+        scheduler = JobScheduler(
+            lambda job: None, max_queue_depth=30, repo_weights=[("org/a", 3.0)]
+        )
+        for index in range(12):
+            scheduler.submit(repo_payload("org/a", f"refs/heads/{index}"))
+            scheduler.submit(repo_payload("org/b", f"refs/heads/{index}"))
+
+        taken = self.take(scheduler, 12)
+        self.assertEqual(taken.count("org/a"), 9)
+        self.assertEqual(taken.count("org/b"), 3)
+
+    def test_idle_repository_does_not_save_up(self):
+        """
+        Test that a repository that was idle while another ran many jobs only gets its fair share.
+        """
+        scheduler = JobScheduler(lambda job: None, max_queue_depth=20)
+        for index in range(5):
+            scheduler.submit(repo_payload("org/a", f"refs/heads/{index}"))
+        self.take(scheduler, 5)
+
+        for index in range(3):
+            scheduler.submit(repo_payload("org/a", f"refs/heads/next-{index}"))
+            scheduler.submit(repo_payload("org/b", f"refs/heads/{index}"))
+        self.assertEqual(
+            sorted(self.take(scheduler, 4)), ["org/a", "org/a", "org/b", "org/b"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
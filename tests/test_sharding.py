@@ -0,0 +1,103 @@
+import json
+import os
+import unittest
+from src.modules.actions import run_tests
+from src.modules.sharding import split_into_shards
+from src.modules.utils import check_if_folder_exists, remove_folder, write_to_file
+
+
+def mock_test_case(name: str, passing: bool = True) -> str:
+    return f"""import unittest
+
+
+class {name}(unittest.TestCase):
+    def test_first(self):
+        self.assertTrue({passing})
+
+    def test_second(self):
+        self.assertTrue(True)
+"""
+
+
+class ShardingTest(unittest.TestCase):
+    # Set up a project with a few test cases
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/sharding_test/")
+        self.project = os.path.join(self.ephemeral_folder, "project")
+        self.durations_file = os.path.join(self.ephemeral_folder, "durations.json")
+        for name in ["Alpha", "Beta", "Gamma"]:
+            write_to_file(
+                os.path.join(self.project, f"test_{name.lower()}.py"),
+                mock_test_case(name),
+            )
+
+    def tearDown(self):
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def test_split_keeps_test_cases_together(self):
+        test_ids = ["a.A.test_1", "a.A.test_2", "b.B.test_1", "c.C.test_1"]
+
+        shards = split_into_shards(test_ids, 2, {})
+
+        self.assertEqual(len(shards), 2)
+        self.assertCountEqual(sum(shards, []), test_ids)
+        self.assertTrue(
+            any(shard[:2] == ["a.A.test_1", "a.A.test_2"] for shard in shards)
+        )
+
+    def test_split_balances_by_duration(self):
+        test_ids = ["a.A.test_1", "b.B.test_1", "c.C.test_1", "d.D.test_1"]
+        durations = {
+            "a.A.test_1": 10.0,
+            "b.B.test_1": 6.0,
+            "c.C.test_1": 3.0,
+            "d.D.test_1": 1.0,
+        }
+
+        shards = split_into_shards(test_ids, 2, durations)
+
+        self.assertCountEqual(
+            shards, [["a.A.test_1"], ["b.B.test_1", "c.C.test_1", "d.D.test_1"]]
+        )
+
+    def test_split_never_creates_empty_shards(self):
+        shards = split_into_shards(["a.A.test_1"], 4, {})
+
+        self.assertEqual(shards, [["a.A.test_1"]])
+
+    def test_run_sharded_tests_successfully(self):
+        check, logs = run_tests(
+            self.project, shards=2, durations_file=self.durations_file
+        )
+
+        self.assertTrue(check)
+        self.assertIn("Ran 6 tests in 2 shards", logs)
+        self.assertIn("OK", logs)
+        with open(self.durations_file) as file:
+            self.assertEqual(len(json.load(file)), 6)
+
+    def test_run_sharded_tests_failure(self):
+        write_to_file(
+            os.path.join(self.project, "test_delta.py"), mock_test_case("Delta", False)
+        )
+
+        check, logs = run_tests(self.project, shards=3)
+
+        self.assertFalse(check)
+        self.assertIn("FAILED", logs)
+
+    def test_run_sharded_tests_with_broken_import(self):
+        write_to_file(
+            os.path.join(self.project, "test_broken.py"), "import non_existent_module\n"
+        )
+
+        check, logs = run_tests(self.project, shards=2)
+
+        # The tests are run in a single process, which reports the import error
+        self.assertFalse(check)
+        self.assertIn("non_existent_module", logs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import time
+import unittest
+from src.modules.processes import StageTimeoutError
+from src.modules.stages import Stage, run_stages
+
+
+def sleeping_stage(seconds: float, passed: bool = True):
+    def run(group):
+        result = group.run(["sleep", str(seconds)])
+        return (passed, f"slept {seconds} with code {result.returncode}")
+
+    return run
+
+
+class StagesTest(unittest.TestCase):
+    def test_stages_run_in_parallel(self):
+        stages = [Stage("lint", sleeping_stage(1)), Stage("test", sleeping_stage(1))]
+
+        started = time.monotonic()
+        results = run_stages(stages)
+
+        self.assertLess(time.monotonic() - started, 1.8)
+        self.assertEqual([passed for passed, _ in results], [True, True])
+
+    def test_stage_durations(self):
+        stages = [
+            Stage("lint", sleeping_stage(0.1)),
+            Stage("test", sleeping_stage(0.5)),
+        ]
+
+        run_stages(stages)
+
+        self.assertAlmostEqual(stages[0].duration, 0.1, delta=0.2)
+        self.assertAlmostEqual(stages[1].duration, 0.5, delta=0.2)
+
+    def test_results_keep_stage_order(self):
+        stages = [
+            Stage("lint", sleeping_stage(0.5)),
+            Stage("test", sleeping_stage(0.1, passed=False)),
+        ]
+
+        results = run_stages(stages)
+
+        self.assertEqual(
+            results,
+            [(True, "slept 0.5 with code 0"), (False, "slept 0.1 with code 0")],
+        )
+
+    def test_fail_fast_cancels_other_stages(self):
+        stages = [
+            Stage("lint", sleeping_stage(0.1, passed=False), fail_fast=True),
+            Stage("test", sleeping_stage(30)),
+        ]
+
+        started = time.monotonic()
+        results = run_stages(stages)
+
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertFalse(results[1][0])
+        self.assertIn("Cancelled because the lint stage failed", results[1][1])
+        self.assertTrue(stages[0].completed)
+        self.assertFalse(stages[1].completed)
+
+    def test_fail_fast_sequential(self):
+        ran = []
+        stages = [
+            Stage("lint", lambda group: (False, "failed"), fail_fast=True),
+            Stage("test", lambda group: ran.append("test") or group.run(["true"])),
+        ]
+
+        results = run_stages(stages, parallel=False)
+
+        self.assertEqual(ran, ["test"])
+        self.assertEqual(
+            results[1], (False, "Test Log: Cancelled because the lint stage failed.")
+        )
+
+    def test_stage_exception_is_raised(self):
+        def broken(group):
+            raise ValueError("broken")
+
+        stages = [Stage("lint", broken), Stage("test", sleeping_stage(30))]
+
+        started = time.monotonic()
+        with self.assertRaises(ValueError):
+            run_stages(stages)
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_stage_timeout(self):
+        """
+        Test that a stage is killed once it reaches its timeout, and that the timeout
+        is raised rather than the cancellation of the other stage.
+        """
+        stages = [
+            Stage("lint", sleeping_stage(30)),
+            Stage("test", sleeping_stage(30), timeout=0.3),
+        ]
+
+        started = time.monotonic()
+        with self.assertRaises(StageTimeoutError):
+            run_stages(stages)
+        self.assertLess(time.monotonic() - started, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,6 +6,7 @@ from src.modules.utils import (
     write_to_file,
     remove_folder,
     remove_file,
+    get_folder_size,
 )
 
 
@@ -102,6 +103,16 @@ class TestUtils(unittest.TestCase):
         remove_file(self.ephemeral_folder)
         self.assertTrue(check_if_folder_exists(self.ephemeral_folder))
 
+    # Tests for get_folder_size
+    def test_get_folder_size(self):
+        write_to_file(self.ephemeral_folder + "a.txt", "12345")
+        write_to_file(self.ephemeral_folder_nested + "b.txt", "123")
+
+        self.assertEqual(get_folder_size(self.ephemeral_folder), 8)
+
+    def test_get_folder_size_of_non_existent_folder(self):
+        self.assertEqual(get_folder_size("./non_existent_folder"), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,102 @@
+import os
+import unittest
+from src.modules.actions import setup_dependencies
+from src.modules.cache import evict_entries
+from src.modules.venv_cache import (
+    get_venv_key,
+    is_requirements_cacheable,
+    release_cached_venv,
+)
+from src.modules.utils import (
+    check_if_file_exists,
+    check_if_folder_exists,
+    remove_folder,
+    write_to_file,
+)
+
+
+class VenvCacheTest(unittest.TestCase):
+    # Set up two projects with the same requirements
+    def setUp(self):
+        self.ephemeral_folder = os.path.abspath("./temp/venv_cache_test/")
+        self.cache_folder = os.path.join(self.ephemeral_folder, "cache")
+        self.projects = [
+            os.path.join(self.ephemeral_folder, name) for name in ["first", "second"]
+        ]
+        for project in self.projects:
+            write_to_file(
+                os.path.join(project, "requirements-dev.txt"), "# no dependencies\n"
+            )
+
+    def tearDown(self):
+        for project in self.projects:
+            release_cached_venv(project)
+        if check_if_folder_exists(self.ephemeral_folder):
+            remove_folder(self.ephemeral_folder)
+
+    def test_environment_is_reused(self):
+        first_logs = setup_dependencies(self.projects[0], self.cache_folder)
+        second_logs = setup_dependencies(self.projects[1], self.cache_folder)
+
+        self.assertIn("Stored the environment", first_logs)
+        self.assertIn("Reusing the cached environment", second_logs)
+        first_venv = os.path.realpath(os.path.join(self.projects[0], ".venv"))
+        second_venv = os.path.realpath(os.path.join(self.projects[1], ".venv"))
+        self.assertEqual(first_venv, second_venv)
+        self.assertTrue(check_if_folder_exists(os.path.join(second_venv, "bin")))
+
+    def test_cached_environment_is_read_only(self):
+        setup_dependencies(self.projects[0], self.cache_folder)
+        venv = os.path.realpath(os.path.join(self.projects[0], ".venv"))
+
+        for folder, _, files in os.walk(venv):
+            for path in [folder, *(os.path.join(folder, file) for file in files)]:
+                if not os.path.islink(path):
+                    self.assertFalse(os.stat(path).st_mode & 0o222, path)
+
+    def test_committed_venv_is_replaced(self):
+        write_to_file(os.path.join(self.projects[0], ".venv", "bin", "python"), "")
+
+        setup_dependencies(self.projects[0], self.cache_folder)
+
+        self.assertTrue(os.path.islink(os.path.join(self.projects[0], ".venv")))
+
+    def test_removing_workspace_keeps_cached_environment(self):
+        setup_dependencies(self.projects[0], self.cache_folder)
+        venv = os.path.realpath(os.path.join(self.projects[0], ".venv"))
+
+        remove_folder(self.projects[0])
+
+        self.assertTrue(check_if_folder_exists(venv))
+
+    def test_venv_key_depends_on_requirements_and_interpreter(self):
+        key = get_venv_key("requests==2.32.0", "3.11.7")
+
+        self.assertEqual(key, get_venv_key("requests==2.32.0", "3.11.7"))
+        self.assertNotEqual(key, get_venv_key("requests==2.32.1", "3.11.7"))
+        self.assertNotEqual(key, get_venv_key("requests==2.32.0", "3.12.1"))
+
+    def test_requirements_cacheable(self):
+        self.assertTrue(is_requirements_cacheable("requests\nfastapi==0.115.8\n"))
+        self.assertFalse(is_requirements_cacheable("-e .\n"))
+        self.assertFalse(is_requirements_cacheable("-r requirements.txt\n"))
+        self.assertFalse(is_requirements_cacheable("./libs/helper\n"))
+
+    def test_eviction_skips_environments_in_use(self):
+        """
+        Test that an environment is only evicted once the job using it has released it.
+        """
+        setup_dependencies(self.projects[0], self.cache_folder)
+
+        evicted = evict_entries(self.cache_folder, ".venv", 1)
+        self.assertEqual(evicted, [])
+
+        release_cached_venv(self.projects[0])
+        evicted = evict_entries(self.cache_folder, ".venv", 1)
+        self.assertEqual(len(evicted), 1)
+        self.assertFalse(check_if_folder_exists(evicted[0]))
+        self.assertFalse(check_if_file_exists(os.path.join(evicted[0], "pyvenv.cfg")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import json
+import os
+import subprocess
+import unittest
+import zipfile
+from unittest.mock import patch
+from src.modules.utils import check_if_folder_exists, remove_folder, write_to_file
+from src.modules.wheelhouse import (
+    get_requirement_name,
+    get_wheel_names,
+    install_requirements,
+    is_pinned,
+    parse_requirements,
+    record_requests,
+)
+
+
+def create_wheel(folder: str, name: str, version: str = "0.1.0") -> None:
+    """
+    Create a minimal pure-python wheel, so that no network access is needed.
+    """
+    dist_info = f"{name}-{version}.dist-info"
+    files = {
+        f"{name}/__init__.py": "",
+        f"{dist_info}/METADATA": f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n",
+        f"{dist_info}/WHEEL": "Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    files[f"{dist_info}/RECORD"] = "".join(f"{path},,\n" for path in files) + (
+        f"{dist_info}/RECORD,,\n"
+    )
+
+    os.makedirs(folder, exist_ok=True)
+    with zipfile.ZipFile(
+        os.path.join(folder, f"{name}-{version}-py3-none-any.whl"), "w"
+    ) as wheel:
+        for path, content in files.items():
+            wheel.writestr(path, content)
+
+
+class WheelhouseTest(unittest.TestCase):
+    # Set up a virtual environment once, creating it takes a few seconds
+    @classmethod
+    def setUpClass(cls):
+        cls.ephemeral_folder = os.path.abspath("./temp/wheelhouse_test/")
+        cls.venv = os.path.join(cls.ephemeral_folder, "venv")
+        subprocess.run(["python3", "-m", "venv", cls.venv], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        if check_if_folder_exists(cls.ephemeral_folder):
+            remove_folder(cls.ephemeral_folder)
+
+    def setUp(self):
+        self.wheelhouse = os.path.join(self.ephemeral_folder, "wheelhouse")
+        self.pip_cache = os.path.join(self.ephemeral_folder, "pip")
+        self.requirements_file = os.path.join(self.ephemeral_folder, "requirements.txt")
+
+    def tearDown(self):
+        remove_folder(self.wheelhouse)
+        remove_folder(self.pip_cache)
+
+    def test_parse_requirements(self):
+        requirements = (
+            "# comment\nuvicorn[standard]\n-r other.txt\nrequests==2.32.0 # pinned\n"
+        )
+
+        self.assertEqual(
+            parse_requirements(requirements), ["uvicorn[standard]", "requests==2.32.0"]
+        )
+        self.assertEqual(get_requirement_name("uvicorn[standard]"), "uvicorn")
+        self.assertEqual(get_requirement_name("Python_Dotenv>=1.0"), "python-dotenv")
+
+    def test_get_wheel_names(self):
+        create_wheel(self.wheelhouse, "ci_sample_pkg")
+
+        self.assertEqual(get_wheel_names(self.wheelhouse), {"ci-sample-pkg"})
+
+    def test_install_offline_from_wheelhouse(self):
+        create_wheel(self.wheelhouse, "ci_sample_pkg")
+        write_to_file(self.requirements_file, "ci-sample-pkg==0.1.0\n")
+
+        logs = install_requirements(
+            [os.path.join(self.venv, "bin", "pip")],
+            self.requirements_file,
+            self.wheelhouse,
+            self.pip_cache,
+        )
+
+        self.assertIn("1 hits, 0 misses (offline install)", logs)
+
+    def test_unpinned_requirements_are_resolved_first(self):
+        """
+        Test that a wheel in the wheelhouse does not satisfy an unpinned requirement
+        without resolving it, and that the resolved wheels are moved into the wheelhouse.
+        """
+        create_wheel(self.wheelhouse, "ci_sample_pkg")
+        # The newer release that the index would offer
+        releases = os.path.join(self.ephemeral_folder, "releases")
+        create_wheel(releases, "ci_sample_pkg", "0.2.0")
+        write_to_file(self.requirements_file, "ci-sample-pkg\n")
+
+        environment = {"PIP_NO_INDEX": "1", "PIP_FIND_LINKS": releases}
+        with patch.dict(os.environ, environment):
+            logs = install_requirements(
+                [os.path.join(self.venv, "bin", "pip")],
+                self.requirements_file,
+                self.wheelhouse,
+                self.pip_cache,
+            )
+
+        self.assertIn("(online install)", logs)
+        # No build folder is left behind
+        files = [file for file in os.listdir(self.wheelhouse) if "requests" not in file]
+        self.assertEqual(
+            sorted(files),
+            [
+                "ci_sample_pkg-0.1.0-py3-none-any.whl",
+                "ci_sample_pkg-0.2.0-py3-none-any.whl",
+            ],
+        )
+
+    def test_is_pinned(self):
+        self.assertTrue(is_pinned("requests==2.32.0"))
+        self.assertTrue(is_pinned("uvicorn[standard]==0.30.1"))
+        self.assertTrue(is_pinned('requests==2.32.0; python_version >= "3.8"'))
+        self.assertFalse(is_pinned("requests"))
+        self.assertFalse(is_pinned("flake8>=6"))
+        self.assertFalse(is_pinned("requests==2.*"))
+        self.assertFalse(is_pinned("requests==2.32.0,!=2.32.1"))
+
+    def test_record_requests(self):
+        record_requests(self.wheelhouse, ["requests", "fastapi"])
+        record_requests(self.wheelhouse, ["requests"])
+
+        with open(os.path.join(self.wheelhouse, "requests.json")) as file:
+            stats = json.load(file)
+        self.assertEqual(stats, {"requests": 2, "fastapi": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+import unittest
+from src.modules.workspaces import TRASH_FOLDER, WorkspaceManager
+
+
+def fill(folder: str, files: int) -> None:
+    os.makedirs(os.path.join(folder, "nested"), exist_ok=True)
+    for index in range(files):
+        with open(os.path.join(folder, "nested", f"{index}.txt"), "w") as file:
+            file.write("content")
+
+
+class WorkspaceManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.folder.name, "temp")
+        self.tmpfs = os.path.join(self.folder.name, "tmpfs")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_allocate_on_disk(self):
+        manager = WorkspaceManager(self.root)
+        path = manager.allocate("job-1")
+        self.assertEqual(path, os.path.join(self.root, "job-1"))
+        self.assertTrue(os.path.isdir(path))
+
+    def test_tmpfs_pool_falls_back_to_disk(self):
+        """
+        Test that workspaces are created in the tmpfs pool until it is full,
+        and that a deleted workspace gives its room back.
+        """
+        manager = WorkspaceManager(self.root, self.tmpfs, 2, 1)
+        first = manager.allocate("job-1")
+        second = manager.allocate("job-2")
+        third = manager.allocate("job-3")
+        self.assertEqual(os.path.dirname(first), self.tmpfs)
+        self.assertEqual(os.path.dirname(second), self.tmpfs)
+        self.assertEqual(os.path.dirname(third), self.root)
+
+        manager.release(first)
+        self.assertTrue(manager.flush(5))
+        self.assertEqual(os.path.dirname(manager.allocate("job-4")), self.tmpfs)
+
+    def test_release_deletes_in_background(self):
+        """
+        Test that a released workspace is moved out of the way at once, and deleted later.
+        """
+        manager = WorkspaceManager(self.root)
+        path = manager.allocate("job-1")
+        fill(path, 10)
+
+        manager.release(path)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(manager.flush(5))
+        self.assertEqual(os.listdir(os.path.join(self.root, TRASH_FOLDER)), [])
+        self.assertEqual(manager.pending(), 0)
+
+    def test_release_keeps_symlink_targets(self):
+        """
+        Test that the targets of links in a workspace, e.g. a cached `.venv`, are not deleted.
+        """
+        venv = os.path.join(self.folder.name, "cache", "env.venv")
+        fill(venv, 1)
+        manager = WorkspaceManager(self.root)
+        path = manager.allocate("job-1")
+        os.symlink(venv, os.path.join(path, ".venv"))
+
+        manager.release(path)
+        self.assertTrue(manager.flush(5))
+        self.assertTrue(os.path.exists(os.path.join(venv, "nested", "0.txt")))
+
+    def test_deletion_is_throttled(self):
+        manager = WorkspaceManager(self.root, max_files_per_second=1000)
+        path = manager.allocate("job-1")
+        fill(path, 300)
+
+        started = time.monotonic()
+        manager.release(path)
+        self.assertTrue(manager.flush(5))
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+    def test_remove_stale(self):
+        """
+        Test that the workspaces and the trash of interrupted jobs are removed.
+        """
+        manager = WorkspaceManager(self.root, self.tmpfs, 2, 1)
+        for path in [
+            os.path.join(self.root, "job-1"),
+            os.path.join(self.root, TRASH_FOLDER, "job-0-1"),
+            os.path.join(self.tmpfs, "job-2"),
+        ]:
+            fill(path, 1)
+
+        manager.remove_stale()
+        self.assertEqual(os.listdir(self.root), [])
+        self.assertEqual(os.listdir(self.tmpfs), [])
+
+
+if __name__ == "__main__":
+    unittest.main()